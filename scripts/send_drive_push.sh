@@ -0,0 +1,17 @@
+#!/usr/bin/env bash
+# Drive push bildirimini taklit eder (yerel deneme için; gerçek Drive gerekmez).
+# Kullanım: DRIVE_WATCH_TOKEN=... COUNT=5 bash scripts/send_drive_push.sh [url]
+set -euo pipefail
+URL="${1:-http://localhost:8000/drive/notifications}"
+STATE="${LOCAL_OUTPUT_DIR:-outputs}/drive_watch.json"
+CHANNEL_ID="${CHANNEL_ID:-$(python -c "import json; print(json.load(open('$STATE'))['id'])")}"
+COUNT="${COUNT:-1}"
+for i in $(seq 1 "$COUNT"); do
+  curl -sS -X POST "$URL" \
+    -H "X-Goog-Channel-ID: ${CHANNEL_ID}" \
+    -H "X-Goog-Channel-Token: ${DRIVE_WATCH_TOKEN:-}" \
+    -H "X-Goog-Resource-State: change" \
+    -H "X-Goog-Message-Number: ${i}" \
+    -H "Content-Length: 0"
+  echo
+done
@@ -2,15 +2,20 @@
 from __future__ import annotations
 
 from pathlib import Path
+import json
 import traceback
 from typing import Optional
 
-from fastapi import FastAPI, Query, Body
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Query, Body, Header
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 
-from .main import process_once
+from .main import pending_changes, process_once
 from .config import settings
+from .drive_client import DriveClient
+from .drive_watch import DriveWatcher
+from .jobs import JobManager
+from .resilience import get_breaker
 
 app = FastAPI(
     title="Homework Controller API",
@@ -23,9 +28,76 @@ app = FastAPI(
 class RunRequest(BaseModel):
     # 0 veya None = sınırsız (settings.MAX_FILES_PER_RUN devreye girer)
     limit: Optional[int] = None
+    # True = işlenmiş dosya defterini yok say, hepsini yeniden puanla
+    force: bool = False
+
+
+# Koşular arka planda; aynı klasör için eşzamanlı tetikler tek işte birleşir
+jobs = JobManager(process_once)
+
+
+def _grade_changes() -> None:
+    # push sonrası: yalnızca değişen dosyalar (changes akışı) → kayan rapor.
+    # Bildirim tüm Drive içindir; kaynak klasörde puanlanacak değişiklik yoksa koşu açılmaz.
+    try:
+        if not pending_changes():
+            return
+    except Exception as e:
+        print(f"[warn] change feed check failed, running anyway: {e}")
+    jobs.submit(settings.drive_source_folder_id, trailing=True, listing="changes", rolling=True)
+
+
+watcher: Optional[DriveWatcher] = None
+if settings.drive_watch_address:
+    watcher = DriveWatcher(
+        drive_factory=lambda: DriveClient.shared(),
+        state_path=str(Path(settings.local_output_dir or "outputs") / "drive_watch.json"),
+        address=settings.drive_watch_address,
+        token=settings.drive_watch_token,
+        on_changes=_grade_changes,
+        ttl_seconds=settings.drive_watch_ttl_hours * 3600,
+        renew_margin=settings.drive_watch_renew_minutes * 60,
+        debounce_seconds=settings.drive_watch_debounce_seconds,
+        max_delay_seconds=settings.drive_watch_max_delay_seconds,
+    )
+
+
+@app.on_event("startup")
+def _start_watch():
+    if watcher is not None:
+        if not settings.drive_watch_token:
+            print("[warn] DRIVE_WATCH_ADDRESS set without DRIVE_WATCH_TOKEN; push notifications will be rejected")
+        watcher.start()
+
+
+@app.on_event("shutdown")
+def _stop_watch():
+    if watcher is not None:
+        watcher.stop()
 
 
 # ---------- Helpers ----------
+def _effective_limit(limit: Optional[int]) -> Optional[int]:
+    eff_limit = None if (limit is None or limit == 0) else max(0, int(limit))
+    return eff_limit or (settings.max_files_per_run or None)
+
+
+def _submit(limit: Optional[int], force: bool):
+    return jobs.submit(settings.drive_source_folder_id, limit=_effective_limit(limit), force=force or None)
+
+
+def _wait_result(job, created: bool):
+    # /run eski sözleşmeyi korur: iş bitene kadar bekler
+    job.wait()
+    snap = job.snapshot()
+    if snap["status"] == "error":
+        return JSONResponse(
+            status_code=500,
+            content={"error": snap["error"], "trace": snap["trace"], "job_id": job.id, "coalesced": not created},
+        )
+    return {"status": "done", "job_id": job.id, "coalesced": not created, "report": snap["result"]}
+
+
 def _check_writable(dir_path: Path) -> tuple[bool, str]:
     try:
         dir_path.mkdir(parents=True, exist_ok=True)
@@ -44,6 +116,8 @@ def root():
         "message": "Homework Controller API is running",
         "health": "/health",
         "run": {"GET": "/run?limit=0", "POST": "/run"},
+        "jobs": {"POST": "/jobs", "GET": "/jobs/{job_id}", "events": "/jobs/{job_id}/events"},
+        "drive_push": {"POST": "/drive/notifications", "status": "/drive/watch"},
         "docs": "/docs",
     }
 
@@ -77,18 +151,21 @@ def diag():
         "using_oauth": bool(settings.oauth_client_secret_json),
         "oauth_persist_path": str(persist_token),
         "oauth_persist_exists": persist_exists,
+        "openai_circuit": get_breaker().status(),
     }
 
 @app.get("/run")
-def run_get(limit: Optional[int] = Query(None, description="0 veya None = sınırsız")):
+def run_get(
+    limit: Optional[int] = Query(None, description="0 veya None = sınırsız"),
+    force: bool = Query(False, description="True = daha önce işlenenleri de yeniden puanla"),
+):
     """
     Tarayıcıdan kolay tetikleme için GET desteklenir.
     limit=None veya 0 -> tüm uygun dosyaları işler.
     """
     try:
-        eff_limit = None if (limit is None or limit == 0) else max(0, int(limit))
-        info = process_once(limit=eff_limit or (settings.max_files_per_run or None))
-        return {"status": "done", "report": info}
+        job, created = _submit(limit, force)
+        return _wait_result(job, created)
     except Exception as e:
         return JSONResponse(
             status_code=500,
@@ -99,15 +176,109 @@ def run_get(limit: Optional[int] = Query(None, description="0 veya None = sını
 @app.post("/run")
 def run_post(payload: RunRequest = Body(default=RunRequest())):
     """
-    Programatik tetikleme için POST. Örn: { "limit": 5 }
+    Programatik tetikleme için POST. Örn: { "limit": 5, "force": false }
     """
     try:
-        limit = payload.limit
-        eff_limit = None if (limit is None or limit == 0) else max(0, int(limit))
-        info = process_once(limit=eff_limit or (settings.max_files_per_run or None))
-        return {"status": "done", "report": info}
+        job, created = _submit(payload.limit, payload.force)
+        return _wait_result(job, created)
     except Exception as e:
         return JSONResponse(
             status_code=500,
             content={"error": str(e), "trace": traceback.format_exc()[:6000]},
         )
+
+
+@app.post("/jobs", status_code=202)
+def jobs_create(payload: RunRequest = Body(default=RunRequest())):
+    """
+    Koşuyu arka planda başlatır ve hemen iş kimliği döner.
+    Aynı klasör ve aynı parametrelerle aktif/sıradaki bir iş varsa yenisi açılmaz:
+    "coalesced": true ile o iş döner. Parametreler farklıysa iş sıraya girer ("queued").
+    """
+    job, created = _submit(payload.limit, payload.force)
+    return {"job_id": job.id, "status": job.status, "coalesced": not created, "status_url": f"/jobs/{job.id}"}
+
+
+@app.get("/jobs/{job_id}")
+def jobs_get(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"unknown job: {job_id}"})
+    return job.snapshot()
+
+
+def _event_stream(job, start: int, ndjson: bool):
+    # İş olay günlüğünü izler; yeni olay yoksa 15 sn'de bir canlı tutma satırı yollar
+    seq = start
+    while True:
+        events, finished = job.events_since(seq, timeout=15.0)
+        if not events and not finished:
+            yield "\n" if ndjson else ": keep-alive\n\n"
+            continue
+        for ev in events:
+            seq = ev["seq"] + 1
+            data = json.dumps(ev, ensure_ascii=False, default=str)
+            yield data + "\n" if ndjson else f"id: {ev['seq']}\nevent: {ev['event']}\ndata: {data}\n\n"
+        if finished and not job.events_since(seq, timeout=0)[0]:
+            return
+
+
+@app.get("/jobs/{job_id}/events")
+def jobs_events(
+    job_id: str,
+    format: str = Query("sse", description="sse | ndjson"),
+    last_event_id: Optional[str] = Header(None),
+):
+    """
+    İşin olaylarını canlı yayınlar: phase, stage (dosya + aşama süresi),
+    file (done/skipped, süreler, puan) ve son olarak end.
+    Yeniden bağlanan SSE istemcisi Last-Event-ID ile kaldığı yerden devam eder.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"unknown job: {job_id}"})
+    ndjson = format == "ndjson"
+    start = int(last_event_id) + 1 if (last_event_id or "").isdigit() else 0
+    return StreamingResponse(
+        _event_stream(job, start, ndjson),
+        media_type="application/x-ndjson" if ndjson else "text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/drive/notifications")
+def drive_notification(
+    x_goog_channel_id: Optional[str] = Header(None),
+    x_goog_channel_token: Optional[str] = Header(None),
+    x_goog_resource_state: Optional[str] = Header(None),
+):
+    """
+    Drive changes.watch webhook'u. Gövde yok; bilgi başlıklarda gelir.
+    Bildirimler debounce edilir, sonra yalnızca değişen dosyalar puanlanır.
+    """
+    if watcher is None:
+        return JSONResponse(status_code=404, content={"error": "drive watch is not configured"})
+    try:
+        result = watcher.handle(x_goog_channel_id, x_goog_channel_token, x_goog_resource_state)
+    except PermissionError as e:
+        return JSONResponse(status_code=403, content={"error": str(e)})
+    return {"status": result}
+
+
+@app.get("/drive/watch")
+def drive_watch_status():
+    if watcher is None:
+        return {"enabled": False}
+    return {"enabled": True, **watcher.status()}
+
+
+@app.post("/drive/watch")
+def drive_watch_renew():
+    """Kanalı hemen yeniler (adres/token değiştiyse ya da kanal kaybolduysa)."""
+    if watcher is None:
+        return JSONResponse(status_code=404, content={"error": "drive watch is not configured"})
+    try:
+        watcher.ensure_channel(force=True)
+        return {"enabled": True, **watcher.status()}
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
@@ -0,0 +1,279 @@
+# src/batch_eval.py
+from __future__ import annotations
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from openai import OpenAI
+
+from .evaluator import (
+    merge_payloads, note_format_rejected_message, plan_requests, _request_kwargs, _payload_from_content,
+)
+from .eval_engine import estimate_tokens
+from .grading_cache import cache_key
+from .tokens import TokenBudgetExceeded, UsageMeter
+
+# ─────────────────────────────────────────────────────────────────────────────
+# OpenAI Batch API modu (gece koşuları için)
+# İstekler JSONL olarak yüklenir, batch oluşturulur ve tamamlanana kadar yoklanır.
+# custom_id = içerik anahtarı (grading_cache.cache_key) → yeniden başlatılan süreç
+# aynı metinleri aynı batch'e eşler. İş durumu JSON dosyasında tutulur.
+# Uzun metinler parçalara bölünür: her parça "<anahtar>#<i>" id'siyle ayrı istektir;
+# tüm parçalar gelince puanlar birleştirilir. Model response_format'ı satır başına
+# 400 ile reddederse biçim bir alta iner (bkz. evaluator.note_format_rejected) ve
+# o id'ler deneme hakkı harcanmadan yeni biçimle tekrar gönderilir.
+# ─────────────────────────────────────────────────────────────────────────────
+
+ENDPOINT = "/v1/chat/completions"
+_TERMINAL = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchPending(Exception):
+    """Batch bekleme süresi doldu; sonuç bir sonraki koşuda alınacak."""
+
+
+class BatchEvaluator:
+    def __init__(
+        self,
+        client: OpenAI,
+        state_path: str,
+        model: str,
+        poll_interval: float = 30.0,
+        max_wait: float = 6 * 3600.0,
+        max_attempts: int = 3,
+        max_requests_per_batch: int = 5000,
+    ):
+        self.client = client
+        self.state_path = Path(state_path)
+        self.model = model
+        self.poll_interval = max(1.0, poll_interval)
+        self.max_wait = max(0.0, max_wait)
+        self.max_attempts = max(1, max_attempts)
+        self.max_requests = max(1, max_requests_per_batch)
+        self.state = self._load()
+        self.meter: Optional[UsageMeter] = None
+        self._reserved: Dict[str, int] = {}  # bu koşuda gönderilen id → ayrılan token
+
+    # ── Kalıcı durum ─────────────────────────────────────────────────────────
+    def _load(self) -> Dict[str, Any]:
+        if self.state_path.exists():
+            try:
+                data = json.loads(self.state_path.read_text(encoding="utf-8"))
+                data.setdefault("batches", {})
+                data.setdefault("results", {})
+                data.setdefault("errors", {})
+                data.setdefault("attempts", {})
+                return data
+            except Exception:
+                pass
+        return {"batches": {}, "results": {}, "errors": {}, "attempts": {}}
+
+    def _save(self) -> None:
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.state_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.state, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(self.state_path)  # atomik: yarıda kalan yazım durumu bozmasın
+
+    def _in_flight(self) -> Dict[str, str]:
+        # custom_id → batch_id
+        out = {}
+        for bid, info in self.state["batches"].items():
+            for cid in info.get("ids", []):
+                out[cid] = bid
+        return out
+
+    # ── Gönderim ─────────────────────────────────────────────────────────────
+    def _submit(self, requests: List[Tuple[str, str, str]]) -> None:
+        # requests: (id, system, user)
+        for start in range(0, len(requests), self.max_requests):
+            chunk = requests[start:start + self.max_requests]
+            lines = []
+            fmt = None
+            for cid, system_msg, user_msg in chunk:
+                body = _request_kwargs(self.model, system_msg, user_msg, force_json=True)
+                fmt = (body.get("response_format") or {}).get("type")
+                lines.append(json.dumps({
+                    "custom_id": cid,
+                    "method": "POST",
+                    "url": ENDPOINT,
+                    "body": body,
+                }, ensure_ascii=False))
+            jsonl = self.state_path.parent / f"batch_input_{int(time.time())}_{start}.jsonl"
+            jsonl.write_text("\n".join(lines) + "\n", encoding="utf-8")
+            with open(jsonl, "rb") as fh:
+                up = self.client.files.create(file=fh, purpose="batch")
+            batch = self.client.batches.create(
+                input_file_id=up.id, endpoint=ENDPOINT, completion_window="24h",
+            )
+            for cid, _, _ in chunk:
+                self.state["attempts"][cid] = self.state["attempts"].get(cid, 0) + 1
+            self.state["batches"][batch.id] = {
+                "ids": [cid for cid, _, _ in chunk],
+                "input_file": str(jsonl),
+                "format": fmt,
+                "submitted_at": time.time(),
+            }
+            self._save()
+
+    # ── Sonuç toplama ────────────────────────────────────────────────────────
+    def _read_file_lines(self, file_id: Optional[str]) -> List[Dict[str, Any]]:
+        if not file_id:
+            return []
+        raw = self.client.files.content(file_id).text
+        out = []
+        for line in raw.splitlines():
+            line = line.strip()
+            if line:
+                try:
+                    out.append(json.loads(line))
+                except Exception:
+                    continue
+        return out
+
+    def _note_line_error(self, cid: str, rec: Dict[str, Any], used_format: Optional[str]) -> None:
+        resp = rec.get("response") or {}
+        err = rec.get("error") or resp.get("body") or {}
+        self.state["errors"][cid] = str(err)[:500]
+        if resp.get("status_code") == 400 and note_format_rejected_message(self.model, str(err), used_format):
+            # biçim reddi id'nin hatası değil: deneme sayılmaz, alt biçimle tekrar gönderilir
+            self.state["attempts"][cid] = max(0, self.state["attempts"].get(cid, 1) - 1)
+
+    def _collect(self, bid: str, batch: Any) -> None:
+        info = self.state["batches"].pop(bid)
+        done = set()
+        failed: Dict[str, Dict[str, Any]] = {}
+        for rec in self._read_file_lines(getattr(batch, "output_file_id", None)):
+            cid = rec.get("custom_id")
+            resp = rec.get("response") or {}
+            if not cid:
+                continue
+            if resp.get("status_code") != 200:
+                failed[cid] = rec
+                continue
+            try:
+                content = resp["body"]["choices"][0]["message"]["content"] or ""
+            except (KeyError, IndexError, TypeError):
+                continue
+            self.state["results"][cid] = _payload_from_content(content)
+            done.add(cid)
+            if self.meter is not None:
+                self.meter.record(self._reserved.pop(cid, 0), resp["body"].get("usage"))
+        for rec in self._read_file_lines(getattr(batch, "error_file_id", None)):
+            cid = rec.get("custom_id")
+            if cid and cid not in done:
+                failed[cid] = rec
+        for cid, rec in failed.items():
+            self._note_line_error(cid, rec, info.get("format"))
+        # Çıktıda olmayan her id (hata, süre aşımı, iptal) tekrar gönderilmeye aday
+        for cid in info.get("ids", []):
+            if cid not in done:
+                self.state["errors"].setdefault(cid, f"batch {batch.status}")
+                if self.meter is not None:
+                    self.meter.release(self._reserved.pop(cid, 0))
+        try:
+            Path(info.get("input_file", "")).unlink(missing_ok=True)
+        except Exception:
+            pass
+        self._save()
+
+    def _poll_once(self) -> None:
+        for bid in list(self.state["batches"]):
+            batch = self.client.batches.retrieve(bid)
+            if batch.status in _TERMINAL:
+                self._collect(bid, batch)
+
+    # ── Ana giriş ────────────────────────────────────────────────────────────
+    def _units(self, cid: str, text: str, filename: str) -> Tuple[List[Tuple[str, str, str, int]], int]:
+        # ([(id, system, user, ağırlık)], düşen_parça); tek parçalı metinde id = içerik anahtarı
+        plan, dropped = plan_requests(text, filename, self.model)
+        if len(plan) == 1:
+            return [(cid, *plan[0])], dropped
+        return [(f"{cid}#{i}", s, u, w) for i, (s, u, w) in enumerate(plan)], dropped
+
+    def evaluate_all(
+        self, items: List[Tuple[Any, str, str]], meter: Optional[UsageMeter] = None
+    ) -> Dict[Any, Any]:
+        """
+        items: (anahtar, metin, dosya_adı)
+        Dönüş: anahtar → payload | Exception (BatchPending = henüz bitmedi,
+        TokenBudgetExceeded = koşu bütçesi doldu, gönderilmedi)
+        """
+        self.meter = meter
+        units_of: Dict[str, List[Tuple[str, str, str, int]]] = {}
+        dropped_of: Dict[str, int] = {}
+        keys_of: Dict[str, List[Any]] = {}
+        for key, text, filename in items:
+            cid = cache_key(text, self.model)
+            if cid not in units_of:
+                units_of[cid], dropped_of[cid] = self._units(cid, text, filename)
+                if meter is not None and len(units_of[cid]) > 1:
+                    meter.note_chunked()
+            keys_of.setdefault(cid, []).append(key)
+        over_budget = set()
+
+        # Önceki süreçten kalan batch'ler bitmiş olabilir
+        if self.state["batches"]:
+            self._poll_once()
+
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            in_flight = self._in_flight()
+            retry = []
+            for units in units_of.values():
+                for uid, system_msg, user_msg, _ in units:
+                    if uid in self.state["results"] or uid in in_flight or uid in over_budget:
+                        continue
+                    if self.state["attempts"].get(uid, 0) >= self.max_attempts:
+                        continue
+                    if meter is not None:
+                        cost = estimate_tokens(system_msg, user_msg, self.model)
+                        try:
+                            meter.reserve(cost)
+                        except TokenBudgetExceeded:
+                            over_budget.add(uid)
+                            continue
+                        self._reserved[uid] = self._reserved.get(uid, 0) + cost
+                    # yeni ya da kısmi hatadan dönen istek → (yeniden) gönder
+                    self.state["errors"].pop(uid, None)
+                    retry.append((uid, system_msg, user_msg))
+            if retry:
+                self._submit(retry)
+
+            in_flight = self._in_flight()
+            waiting = [u[0] for units in units_of.values() for u in units if u[0] in in_flight]
+            if not waiting or time.monotonic() >= deadline:
+                break
+            time.sleep(self.poll_interval)
+            self._poll_once()
+
+        out: Dict[Any, Any] = {}
+        in_flight = self._in_flight()
+        for cid, keys in keys_of.items():
+            units = units_of[cid]
+            ids = [u[0] for u in units]
+            running = [in_flight[uid] for uid in ids if uid in in_flight]
+            failed = [uid for uid in ids if uid not in self.state["results"] and uid not in in_flight]
+            if not running and not failed:
+                val: Any = merge_payloads(
+                    [self.state["results"][uid] for uid in ids], [u[3] for u in units], dropped_of[cid]
+                )
+            elif running:
+                val = BatchPending(f"batch {running[0]} still running")
+            elif any(uid in over_budget for uid in failed):
+                val = TokenBudgetExceeded("token budget exhausted")
+            else:
+                val = RuntimeError(self.state["errors"].get(failed[0], "batch request failed"))
+            for key in keys:
+                out[key] = val
+        return out
+
+    def forget(self, items: List[Tuple[Any, str, str]]) -> None:
+        """Rapora işlenen sonuçları durum dosyasından temizle."""
+        for _, text, filename in items:
+            cid = cache_key(text, self.model)
+            for uid, _, _, _ in self._units(cid, text, filename)[0]:
+                self.state["results"].pop(uid, None)
+                self.state["errors"].pop(uid, None)
+                self.state["attempts"].pop(uid, None)
+        self._save()
@@ -0,0 +1,50 @@
+# src/change_feed.py
+from __future__ import annotations
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .drive_client import DriveClient
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Artımlı listeleme: Drive changes API + kalıcı start page token
+# Token, koşu başarıyla bittiğinde kaydedilir (commit); yarıda kalan koşu aynı
+# değişiklikleri tekrar görür, defter zaten işlenenleri atlar.
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+class ChangeCheckpoint:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    def _read(self) -> Dict[str, str]:
+        if not self.path.exists():
+            return {}
+        try:
+            return json.loads(self.path.read_text(encoding="utf-8"))
+        except Exception:
+            return {}
+
+    def load(self, folder_id: str) -> Optional[str]:
+        return self._read().get(folder_id)
+
+    def save(self, folder_id: str, token: str) -> None:
+        data = self._read()
+        data[folder_id] = token
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(data, indent=2), encoding="utf-8")
+        tmp.replace(self.path)
+
+
+def list_incremental(drive: DriveClient, folder_id: str, checkpoint: ChangeCheckpoint) -> Tuple[List[Dict], str]:
+    """
+    Dönüş: (dosyalar, kaydedilecek_token).
+    İlk koşuda token yoktur → tam listeleme yapılır; token listelemeden ÖNCE
+    alınır ki arada gelen değişiklikler kaçmasın.
+    """
+    token = checkpoint.load(folder_id)
+    if not token:
+        start = drive.get_start_page_token()
+        return drive.list_files_in_folder(folder_id), start
+    return drive.list_changed_files_in_folder(folder_id, token)
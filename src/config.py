@@ -9,10 +9,38 @@ def _split_csv(v: Optional[str]) -> List[str]:
         return []
     return [s.strip() for s in v.split(",") if s.strip()]
 
+def _env_bool(name: str, default: bool = False) -> bool:
+    v = os.getenv(name)
+    if v is None or not v.strip():
+        return default
+    return v.strip().lower() in {"1", "true", "yes", "on"}
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, "") or default)
+    except Exception:
+        return default
+
 @dataclass
 class Settings:
     # OpenAI
     openai_api_key: str = os.getenv("OPENAI_API_KEY", "")
+    # Yerel sahte sunucu / proxy için (boş = resmi API)
+    openai_base_url: str = os.getenv("OPENAI_BASE_URL", "")
+    openai_model: str = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    # Hesabın hız limitleri (token bucket bunlara göre boyutlanır)
+    openai_rpm: int = _env_int("OPENAI_RPM", 500)
+    openai_tpm: int = _env_int("OPENAI_TPM", 200000)
+    openai_max_retries: int = _env_int("OPENAI_MAX_RETRIES", 5)
+    # Aynı anda uçuşta olabilecek en fazla istek
+    openai_max_concurrency: int = _env_int("OPENAI_MAX_CONCURRENCY", 8)
+    # Devre kesici: art arda bu kadar 429/5xx/zaman aşımı → istekler bekleme süresince durur
+    openai_breaker_threshold: int = _env_int("OPENAI_BREAKER_THRESHOLD", 5)
+    openai_breaker_cooldown_seconds: int = _env_int("OPENAI_BREAKER_COOLDOWN_SECONDS", 15)
+    # Sağlayıcı bu kadar sn bozuk kalırsa kalan dosyalar sonraki koşuya bırakılır
+    openai_breaker_max_pause_seconds: int = _env_int("OPENAI_BREAKER_MAX_PAUSE_SECONDS", 900)
+    # Yapılandırılmış çıktı (strict json_schema); desteklemeyen modelde json_object'e düşer
+    openai_strict_schema: bool = _env_bool("OPENAI_STRICT_SCHEMA", True)
 
     # Google creds (env'de yollar ya da /etc/secrets pathleri)
     service_account_json: Optional[str] = os.getenv("GOOGLE_SERVICE_ACCOUNT_JSON")
@@ -24,6 +52,22 @@ class Settings:
     drive_reports_folder_id: str = os.getenv("DRIVE_REPORTS_FOLDER_ID", "")
     drive_backup_folder_id: Optional[str] = os.getenv("DRIVE_BACKUP_FOLDER_ID")
 
+    # Listeleme: "full" = her koşuda tüm klasör, "changes" = Drive changes API ile artımlı
+    drive_listing_mode: str = os.getenv("DRIVE_LISTING_MODE", "full").strip().lower()
+
+    # Drive push bildirimleri: herkese açık https adresi (…/drive/notifications); boş = kapalı
+    drive_watch_address: str = os.getenv("DRIVE_WATCH_ADDRESS", "")
+    # Bildirimlerin X-Goog-Channel-Token başlığı bununla eşleşmeli
+    drive_watch_token: str = os.getenv("DRIVE_WATCH_TOKEN", "")
+    drive_watch_ttl_hours: int = _env_int("DRIVE_WATCH_TTL_HOURS", 24)
+    drive_watch_renew_minutes: int = _env_int("DRIVE_WATCH_RENEW_MINUTES", 60)
+    # Bildirim patlaması: son bildirimden bu kadar sn sessizlik sonra (en geç max) koşu başlar
+    drive_watch_debounce_seconds: int = _env_int("DRIVE_WATCH_DEBOUNCE_SECONDS", 10)
+    drive_watch_max_delay_seconds: int = _env_int("DRIVE_WATCH_MAX_DELAY_SECONDS", 120)
+    # Kayan rapor sınırı: son N günde puanlanan satırlar, en fazla M satır (0 = sınırsız)
+    rolling_report_days: int = _env_int("ROLLING_REPORT_DAYS", 7)
+    rolling_report_max_rows: int = _env_int("ROLLING_REPORT_MAX_ROWS", 5000)
+
     # App behavior
     local_output_dir: str = os.getenv("LOCAL_OUTPUT_DIR", "outputs")
     report_prefix: str = os.getenv("REPORT_PREFIX", "grading-report")
@@ -38,6 +82,61 @@ class Settings:
     # 🔴 HATA SEBEBİ: eksikti → eklendi
     ocr_lang: str = os.getenv("OCR_LANG", "rus+kaz+tur+eng")
 
+    # İşlenmiş dosya defteri (SQLite). Boşsa LOCAL_OUTPUT_DIR/ledger.sqlite3
+    ledger_path: str = os.getenv("LEDGER_PATH", "")
+    # 1 = defteri yok say, klasördeki her şeyi yeniden işle
+    force_reprocess: bool = _env_bool("FORCE_REPROCESS", False)
+
+    # Uzun metinler bu kadar token'lık parçalarla puanlanıp birleştirilir (0 = parçalama yok)
+    eval_chunk_tokens: int = _env_int("EVAL_CHUNK_TOKENS", 4000)
+    eval_max_chunks: int = _env_int("EVAL_MAX_CHUNKS", 8)
+    # Kısa teslimleri paketle: tek istekte en fazla bu kadar istem token'ı (0 = kapalı, ör. 6000)
+    eval_pack_tokens: int = _env_int("EVAL_PACK_TOKENS", 0)
+    eval_pack_max_items: int = _env_int("EVAL_PACK_MAX_ITEMS", 8)
+    # Yalnızca bu kadar token'a kadar olan teslimler paketlenir
+    eval_pack_item_tokens: int = _env_int("EVAL_PACK_ITEM_TOKENS", 800)
+    # Paket dolmasa da ilk teslimden bu kadar ms sonra gönderilir
+    eval_pack_linger_ms: int = _env_int("EVAL_PACK_LINGER_MS", 200)
+    # Koşu başına token bütçesi (istem + cevap); dolunca kalan dosyalar sonraki koşuya kalır. 0 = sınırsız
+    run_token_budget: int = _env_int("RUN_TOKEN_BUDGET", 0)
+
+    # Değerlendirme modu: "realtime" (iş hattında anlık) | "batch" (OpenAI Batch API)
+    eval_mode: str = os.getenv("EVAL_MODE", "realtime").strip().lower()
+    batch_poll_seconds: int = _env_int("BATCH_POLL_SECONDS", 30)
+    # Bu süre dolunca koşu biter; bekleyen batch bir sonraki /run'da devam eder
+    batch_max_wait_minutes: int = _env_int("BATCH_MAX_WAIT_MINUTES", 360)
+    batch_max_attempts: int = _env_int("BATCH_MAX_ATTEMPTS", 3)
+
+    # Puanlama önbelleği (LOCAL_OUTPUT_DIR/grading_cache.sqlite3); 0 MB = kapalı
+    grade_cache_max_mb: int = _env_int("GRADE_CACHE_MAX_MB", 50)
+    grade_cache_max_age_days: int = _env_int("GRADE_CACHE_MAX_AGE_DAYS", 90)
+
+    # Çıkarılmış metin deposu (LOCAL_OUTPUT_DIR/text_cache.sqlite3); 0 MB = kapalı
+    text_cache_max_mb: int = _env_int("TEXT_CACHE_MAX_MB", 200)
+
+    # Bu boyutun altındaki TXT/DOCX dosyaları diske yazılmadan bellekte okunur (0 = kapalı)
+    inmemory_max_bytes: int = _env_int("DOWNLOAD_INMEMORY_MAX_BYTES", 2 * 1024 * 1024)
+
+    # Kopya kontrolü: "minhash" (LSH aday çiftleri) | "sparse" (seyrek matris, scipy)
+    #                 | "cdist" (RapidFuzz toplu matris) | "exact" (tüm çiftler)
+    similarity_method: str = os.getenv("SIMILARITY_METHOD", "minhash").strip().lower()
+    # partial_ratio en pahalı skor; combined'a girmediği için varsayılan kapalı
+    similarity_partial_ratio: bool = _env_bool("SIMILARITY_PARTIAL_RATIO", False)
+    # İşaretli çiftler için eşleşen pasajlar (winnowing) → "Passages" sayfası
+    plag_passages: bool = _env_bool("PLAG_PASSAGES", True)
+
+    # Koşular arası kopya indeksi (LOCAL_OUTPUT_DIR/plagiarism_index.sqlite3)
+    plag_index_enabled: bool = _env_bool("PLAG_INDEX_ENABLED", True)
+    plag_index_retention_days: int = _env_int("PLAG_INDEX_RETENTION_DAYS", 730)
+    plag_index_max_docs: int = _env_int("PLAG_INDEX_MAX_DOCS", 100000)
+
+    # İş hattı (indir → çıkar → değerlendir) worker sayıları ve kuyruk boyu
+    pipeline_download_workers: int = _env_int("PIPELINE_DOWNLOAD_WORKERS", 4)
+    # extract worker'ları thread; taralı PDF sayfaları ortak OCR süreç havuzuna (OCR_PAGE_WORKERS) gider
+    pipeline_extract_workers: int = _env_int("PIPELINE_EXTRACT_WORKERS", 4)
+    pipeline_evaluate_workers: int = _env_int("PIPELINE_EVALUATE_WORKERS", 4)
+    pipeline_queue_size: int = _env_int("PIPELINE_QUEUE_SIZE", 8)
+
     def __post_init__(self):
         # max_files_per_run sayısal değilse 0 yap
         try:
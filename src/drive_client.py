@@ -2,16 +2,29 @@ from __future__ import annotations
 
 import json
 import os
+import re
 from pathlib import Path
-from typing import Optional, List, Dict
+import threading
+import time
+from typing import Callable, Optional, List, Dict
 
+import httplib2
+import google_auth_httplib2
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
+from googleapiclient.http import HttpRequest, MediaFileUpload, MediaIoBaseDownload
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google.oauth2.service_account import Credentials as SA_Credentials
 import io
 
+# progress(etiket, indirilen_bayt, toplam_bayt | None, bayt_per_saniye)
+ProgressCallback = Callable[[str, int, Optional[int], float], None]
+
+# İndirme parça boyutu (kütüphane varsayılanı 100 MB → tek parçada tüm dosya)
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DRIVE_CHUNK_SIZE", str(4 * 1024 * 1024)) or 4 * 1024 * 1024)
+
+HTTP_TIMEOUT = int(os.getenv("DRIVE_HTTP_TIMEOUT", "120") or 120)
+
 SCOPES = [
     "https://www.googleapis.com/auth/drive",
     "https://www.googleapis.com/auth/drive.file",
@@ -34,8 +47,12 @@ GOOGLE_DOC_MIMES = {
 }
 
 class DriveClient:
-    def __init__(self, service):
+    _shared: Optional["DriveClient"] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, service, chunk_size: int = DOWNLOAD_CHUNK_SIZE):
         self.service = service
+        self.chunk_size = max(256 * 1024, int(chunk_size))
 
     # ── OAuth persist ─────────────────────────────────────────────────────────
     @staticmethod
@@ -89,20 +106,59 @@ class DriveClient:
 
         if oauth_secret and oauth_token:
             creds = cls._build_oauth_creds()
-            service = build("drive", "v3", credentials=creds, cache_discovery=False)
-            return cls(service)
+            return cls(cls._build_service(creds))
 
         if sa_json:
             creds = SA_Credentials.from_service_account_file(sa_json, scopes=SCOPES)
-            service = build("drive", "v3", credentials=creds, cache_discovery=False)
-            return cls(service)
+            return cls(cls._build_service(creds))
 
         raise RuntimeError("No Google credentials provided. Set OAuth or Service Account envs.")
 
+    @classmethod
+    def shared(
+        cls,
+        service_account_json: Optional[str] = None,
+        oauth_client_secret_json: Optional[str] = None,
+        oauth_token_json: Optional[str] = None,
+    ) -> "DriveClient":
+        """
+        Süreç genelinde tek istemci: kimlik bilgisi ve discovery bir kez kurulur,
+        her koşuda yeniden inşa edilmez. Thread'ler arasında güvenle paylaşılır.
+        """
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls.from_env(
+                    service_account_json=service_account_json,
+                    oauth_client_secret_json=oauth_client_secret_json,
+                    oauth_token_json=oauth_token_json,
+                )
+            return cls._shared
+
+    @staticmethod
+    def _build_service(creds):
+        """
+        httplib2 thread-safe değil → her thread kendi AuthorizedHttp'sini (keep-alive
+        bağlantılarıyla) kullanır. Kimlik bilgisi ortaktır; süresi dolduğunda
+        AuthorizedHttp ilk istekte tembelce yeniler.
+        """
+        local = threading.local()
+
+        def thread_http():
+            http = getattr(local, "http", None)
+            if http is None:
+                http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+                local.http = http
+            return http
+
+        def request_builder(_http, *args, **kwargs):
+            return HttpRequest(thread_http(), *args, **kwargs)
+
+        return build("drive", "v3", http=thread_http(), requestBuilder=request_builder, cache_discovery=False)
+
     # ── Public API ────────────────────────────────────────────────────────────
     def list_files_in_folder(self, folder_id: str, page_size: int = 100) -> List[Dict]:
         q = f"'{folder_id}' in parents and trashed = false"
-        fields = "nextPageToken, files(id, name, mimeType, modifiedTime, size)"
+        fields = "nextPageToken, files(id, name, mimeType, modifiedTime, md5Checksum, size)"
         files: List[Dict] = []
         page_token = None
         while True:
@@ -116,68 +172,214 @@ class DriveClient:
                 break
         return files
 
+    # ── Değişiklik akışı (changes API) ────────────────────────────────────────
+    CHANGE_FILE_FIELDS = "id, name, mimeType, modifiedTime, md5Checksum, size, parents, trashed"
+
+    def get_start_page_token(self) -> str:
+        return self.service.changes().getStartPageToken().execute()["startPageToken"]
+
+    def list_changed_files_in_folder(self, folder_id: str, page_token: str, page_size: int = 1000):
+        """
+        page_token'dan bu yana klasöre eklenen/değişen dosyaları döner.
+        Dönüş: (dosyalar, yeni_start_page_token). Maliyet klasör boyutuyla değil
+        yeni etkinlikle orantılıdır.
+        """
+        fields = f"nextPageToken, newStartPageToken, changes(fileId, removed, file({self.CHANGE_FILE_FIELDS}))"
+        latest: Dict[str, Dict] = {}
+        token = page_token
+        new_start = page_token
+        while token:
+            resp = self.service.changes().list(
+                pageToken=token, spaces="drive", pageSize=page_size,
+                includeRemoved=False, fields=fields,
+            ).execute()
+            for ch in resp.get("changes", []):
+                f = ch.get("file") or {}
+                if ch.get("removed") or not f or f.get("trashed"):
+                    latest.pop(ch.get("fileId"), None)
+                    continue
+                if folder_id not in (f.get("parents") or []):
+                    continue
+                latest[f["id"]] = f  # aynı dosyanın son değişikliği kazanır
+            if resp.get("newStartPageToken"):
+                new_start = resp["newStartPageToken"]
+            token = resp.get("nextPageToken")
+        return list(latest.values()), new_start
+
+    # ── Push bildirimleri (changes.watch) ────────────────────────────────────
+    def watch_changes(self, page_token: str, channel_id: str, address: str, token: str,
+                      ttl_seconds: int = 86400) -> Dict:
+        """
+        Değişiklik akışı için web_hook kanalı açar. Drive her değişiklikte
+        address'e başlıklı bir POST atar (gövde yok; X-Goog-Channel-Token = token).
+        Dönüş: {"id", "resourceId", "expiration" (ms)}
+        """
+        body = {
+            "id": channel_id,
+            "type": "web_hook",
+            "address": address,
+            "token": token,
+            "expiration": str(int((time.time() + ttl_seconds) * 1000)),
+        }
+        return self.service.changes().watch(pageToken=page_token, spaces="drive", body=body).execute()
+
+    def stop_channel(self, channel_id: str, resource_id: str) -> None:
+        self.service.channels().stop(body={"id": channel_id, "resourceId": resource_id}).execute()
+
+    def update_file_content(self, file_id: str, file_path: str, mime_type: str) -> dict:
+        # aynı Drive dosyasının içeriğini değiştirir (kayan rapor: link sabit kalır)
+        media = MediaFileUpload(file_path, mimetype=mime_type, resumable=True)
+        return self.service.files().update(
+            fileId=file_id, media_body=media, fields="id, name, webViewLink"
+        ).execute()
+
+    @staticmethod
+    def _q(value: str) -> str:
+        # Drive sorgu dizesi kaçışı
+        return value.replace("\\", "\\\\").replace("'", "\\'")
+
     def find_by_name_in_folder(self, name: str, folder_id: str) -> List[Dict]:
-        q = f"name = '{name}' and '{folder_id}' in parents and trashed = false"
-        resp = self.service.files().list(q=q, spaces="drive", fields="files(id, name, parents)").execute()
+        q = f"name = '{self._q(name)}' and '{folder_id}' in parents and trashed = false"
+        resp = self.service.files().list(
+            q=q, spaces="drive", fields="files(id, name, parents, createdTime)"
+        ).execute()
         return resp.get("files", [])
 
-    def unique_name_in_folder(self, base_name: str, folder_id: str) -> str:
+    def _sibling_names(self, base_name: str, folder_id: str) -> set:
         """
-        base_name (örn: grading-report_2025-10-25.xlsx)
-        klasörde aynı isim varsa sonuna _1, _2 ... ekler.
+        Tek sorguyla base_name ve _N türevlerini getirir (name contains önek eşleşmesi);
+        kesin eşleşme yerelde regex ile yapılır.
         """
-        if not self.find_by_name_in_folder(base_name, folder_id):
+        stem, ext = Path(base_name).stem, Path(base_name).suffix
+        q = f"name contains '{self._q(stem)}' and '{folder_id}' in parents and trashed = false"
+        pat = re.compile(rf"^{re.escape(stem)}(?:_(\d+))?{re.escape(ext)}$")
+        names = set()
+        page_token = None
+        while True:
+            resp = self.service.files().list(
+                q=q, spaces="drive", pageSize=1000, fields="nextPageToken, files(name)", pageToken=page_token,
+            ).execute()
+            names.update(f["name"] for f in resp.get("files", []) if pat.match(f.get("name", "")))
+            page_token = resp.get("nextPageToken")
+            if not page_token:
+                break
+        return names
+
+    @staticmethod
+    def _next_free_name(base_name: str, taken: set) -> str:
+        if base_name not in taken:
             return base_name
-        stem = Path(base_name).stem
-        ext = Path(base_name).suffix
+        stem, ext = Path(base_name).stem, Path(base_name).suffix
+        used = set()
+        for n in taken:
+            m = re.match(rf"^{re.escape(stem)}_(\d+){re.escape(ext)}$", n)
+            if m:
+                used.add(int(m.group(1)))
         i = 1
-        while True:
-            candidate = f"{stem}_{i}{ext}"
-            if not self.find_by_name_in_folder(candidate, folder_id):
-                return candidate
+        while i in used:
             i += 1
+        return f"{stem}_{i}{ext}"
 
-    def download_file(self, file_id: str, dest_path: str) -> str:
-        request = self.service.files().get_media(fileId=file_id)
-        fh = io.BytesIO()
-        downloader = MediaFileUpload  # just to keep import used (not necessary but harmless)
-        from googleapiclient.http import MediaIoBaseDownload
-        downloader = MediaIoBaseDownload(fh, request)
+    def unique_name_in_folder(self, base_name: str, folder_id: str) -> str:
+        """
+        base_name (örn: grading-report_2025-10-25.xlsx)
+        klasörde aynı isim varsa sonuna _1, _2 ... ekler. Tek bir Drive sorgusu yapar.
+        """
+        return self._next_free_name(base_name, self._sibling_names(base_name, folder_id))
+
+    def upload_file_unique(self, file_path: str, base_name: str, mime_type: str, parent_folder_id: str,
+                           max_attempts: int = 5) -> dict:
+        """
+        Dosyayı ilk boş adla yükler ve adı atomik olarak sahiplenir: aynı anda iki koşu
+        aynı adı seçerse en erken oluşturulan kazanır, diğeri kendini sıradaki boş ada
+        yeniden adlandırır. Dönüşte "name" alanı nihai adı içerir.
+        """
+        name = self.unique_name_in_folder(base_name, parent_folder_id)
+        file = self.upload_file(file_path, name, mime_type, parent_folder_id)
+        for _ in range(max_attempts):
+            same = self.find_by_name_in_folder(name, parent_folder_id)
+            winner = min(same, key=lambda f: (f.get("createdTime", ""), f["id"])) if same else file
+            if winner["id"] == file["id"]:
+                file["name"] = name
+                return file
+            # yarışı kaybettik → sıradaki boş ada geç
+            name = self._next_free_name(base_name, self._sibling_names(base_name, parent_folder_id) | {name})
+            self.service.files().update(fileId=file["id"], body={"name": name}, fields="id").execute()
+        raise RuntimeError(f"Could not reserve a unique name for {base_name}")
+
+    # ── İndirme ───────────────────────────────────────────────────────────────
+    def _stream_media(self, request, fh, label: str = "", total: Optional[int] = None,
+                      progress: Optional[ProgressCallback] = None) -> int:
+        """
+        İsteği parça parça doğrudan fh'ye yazar (ara BytesIO kopyası yok).
+        progress(label, indirilen_bayt, toplam_bayt|None, bayt/sn) her parçadan sonra çağrılır.
+        """
+        downloader = MediaIoBaseDownload(fh, request, chunksize=self.chunk_size)
+        started = time.monotonic()
         done = False
+        got = 0
         while not done:
-            _, done = downloader.next_chunk()
-        p = Path(dest_path)
-        p.parent.mkdir(parents=True, exist_ok=True)
-        p.write_bytes(fh.getvalue())
-        return str(p)
+            status, done = downloader.next_chunk()
+            if status is not None:
+                got = int(status.resumable_progress)
+                total = total or (int(status.total_size) if status.total_size else None)
+            if progress:
+                elapsed = max(time.monotonic() - started, 1e-6)
+                progress(label, got, total, got / elapsed)
+        return got
 
-    def export_file(self, file_id: str, export_mime: str, dest_path: str) -> str:
-        data = self.service.files().export(fileId=file_id, mimeType=export_mime).execute()
+    def _stream_to_path(self, request, dest_path: str, label: str = "", total: Optional[int] = None,
+                        progress: Optional[ProgressCallback] = None) -> str:
         p = Path(dest_path)
         p.parent.mkdir(parents=True, exist_ok=True)
-        p.write_bytes(data)
+        tmp = p.with_name(p.name + ".part")
+        try:
+            with open(tmp, "wb") as fh:
+                self._stream_media(request, fh, label, total, progress)
+            tmp.replace(p)  # yarım dosya asla hedef adla görünmesin
+        finally:
+            tmp.unlink(missing_ok=True)
         return str(p)
 
-    def download_any(self, file_obj: Dict, dest_path: str) -> str:
-        fid = file_obj["id"]
+    def download_file(self, file_id: str, dest_path: str, progress: Optional[ProgressCallback] = None) -> str:
+        request = self.service.files().get_media(fileId=file_id)
+        return self._stream_to_path(request, dest_path, label=file_id, progress=progress)
+
+    def export_file(self, file_id: str, export_mime: str, dest_path: str,
+                    progress: Optional[ProgressCallback] = None) -> str:
+        request = self.service.files().export_media(fileId=file_id, mimeType=export_mime)
+        return self._stream_to_path(request, dest_path, label=file_id, progress=progress)
+
+    def _media_request(self, file_obj: Dict):
         mime = file_obj.get("mimeType", "")
         if mime in GOOGLE_DOC_MIMES:
-            export_mime, ext = GOOGLE_DOC_MIMES[mime]
+            export_mime, _ = GOOGLE_DOC_MIMES[mime]
+            return self.service.files().export_media(fileId=file_obj["id"], mimeType=export_mime)
+        return self.service.files().get_media(fileId=file_obj["id"])
+
+    def download_any(self, file_obj: Dict, dest_path: str, progress: Optional[ProgressCallback] = None) -> str:
+        mime = file_obj.get("mimeType", "")
+        if mime in GOOGLE_DOC_MIMES:
+            _, ext = GOOGLE_DOC_MIMES[mime]
             if not dest_path.lower().endswith(ext):
                 dest_path = str(Path(dest_path).with_suffix(ext))
-            return self.export_file(fid, export_mime, dest_path)
-        # normal dosya
-        from googleapiclient.http import MediaIoBaseDownload
-        request = self.service.files().get_media(fileId=fid)
+        size = int(file_obj["size"]) if file_obj.get("size") else None
+        return self._stream_to_path(
+            self._media_request(file_obj), dest_path, label=file_obj.get("name", file_obj["id"]),
+            total=size, progress=progress,
+        )
+
+    def download_to_buffer(self, file_obj: Dict, progress: Optional[ProgressCallback] = None) -> io.BytesIO:
+        """
+        Küçük dosyalar için: diske yazmadan bellek içi tampon döner (imleç başta).
+        Büyük PDF/fotoğraflar için download_any kullanın.
+        """
         fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while not done:
-            _, done = downloader.next_chunk()
-        p = Path(dest_path)
-        p.parent.mkdir(parents=True, exist_ok=True)
-        p.write_bytes(fh.getvalue())
-        return str(p)
+        size = int(file_obj["size"]) if file_obj.get("size") else None
+        self._stream_media(self._media_request(file_obj), fh, label=file_obj.get("name", file_obj["id"]),
+                           total=size, progress=progress)
+        fh.seek(0)
+        return fh
 
     def upload_file(self, file_path: str, name: str, mime_type: str, parent_folder_id: str) -> dict:
         media = MediaFileUpload(file_path, mimetype=mime_type, resumable=True)
@@ -185,13 +387,14 @@ class DriveClient:
         file = self.service.files().create(
             body=body, media_body=media, fields="id, webViewLink, parents"
         ).execute()
-        # hedef klasörde olduğundan emin ol (çoğu zaman gerekmez ama garantili olsun)
-        try:
-            self.service.files().update(
-                fileId=file["id"],
-                addParents=parent_folder_id,
-                fields="id, parents"
-            ).execute()
-        except Exception:
-            pass
+        # create zaten parents ayarlar; yalnızca yanıtta hedef klasör yoksa ikinci tur at
+        if parent_folder_id not in (file.get("parents") or []):
+            try:
+                self.service.files().update(
+                    fileId=file["id"],
+                    addParents=parent_folder_id,
+                    fields="id, parents"
+                ).execute()
+            except Exception:
+                pass
         return file
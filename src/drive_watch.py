@@ -0,0 +1,232 @@
+# src/drive_watch.py
+from __future__ import annotations
+import json
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from .drive_client import DriveClient
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Drive push bildirimleri (changes.watch)
+# Drive bildirimde hangi dosyanın değiştiğini söylemez; yalnızca "akışta yenilik
+# var" der. Bildirim patlamaları debounce edilir, sonra artımlı listeleme
+# (change_feed) yalnızca değişen dosyaları getirir. Kanallar süreleri dolmadan
+# yenilenir; kanal durumu JSON dosyasında tutulur (yeniden başlatmaya dayanıklı).
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+class Debouncer:
+    """
+    Her trigger() sessizlik süresini baştan başlatır; fn en geç max_delay sonra çalışır.
+    """
+
+    def __init__(self, fn: Callable[[], None], quiet: float = 10.0, max_delay: float = 120.0):
+        self.fn = fn
+        self.quiet = max(0.0, quiet)
+        self.max_delay = max(self.quiet, max_delay)
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self._first: Optional[float] = None
+
+    def trigger(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if self._first is None:
+                self._first = now
+            if self._timer is not None:
+                self._timer.cancel()
+            delay = min(self.quiet, max(0.0, self._first + self.max_delay - now))
+            self._timer = threading.Timer(delay, self._fire)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _fire(self) -> None:
+        with self._lock:
+            self._first = None
+            self._timer = None
+        try:
+            self.fn()
+        except Exception as e:
+            print(f"[warn] drive watch handler failed: {e}")
+
+    def cancel(self) -> None:
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = None
+            self._first = None
+
+
+class DriveWatcher:
+    def __init__(
+        self,
+        drive_factory: Callable[[], DriveClient],
+        state_path: str,
+        address: str,
+        token: str,
+        on_changes: Callable[[], None],
+        ttl_seconds: int = 86400,
+        renew_margin: int = 3600,
+        debounce_seconds: float = 10.0,
+        max_delay_seconds: float = 120.0,
+    ):
+        self.drive_factory = drive_factory
+        self.state_path = Path(state_path)
+        self.address = address
+        self.token = token
+        self.ttl = max(300, ttl_seconds)
+        self.margin = max(60, min(renew_margin, self.ttl // 2))
+        self.debouncer = Debouncer(on_changes, debounce_seconds, max_delay_seconds)
+        self.notifications = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.state = self._load()
+
+    # ── Kalıcı kanal durumu ──────────────────────────────────────────────────
+    def _load(self) -> Dict[str, Any]:
+        if self.state_path.exists():
+            try:
+                return json.loads(self.state_path.read_text(encoding="utf-8"))
+            except Exception:
+                pass
+        return {}
+
+    def _save(self) -> None:
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.state_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.state, indent=2), encoding="utf-8")
+        tmp.replace(self.state_path)
+
+    # ── Kanal yönetimi ───────────────────────────────────────────────────────
+    def _expires_in(self) -> float:
+        exp_ms = int(self.state.get("expiration") or 0)
+        return exp_ms / 1000.0 - time.time()
+
+    def ensure_channel(self, force: bool = False) -> Dict[str, Any]:
+        """Kanal yoksa, adres değiştiyse ya da süresi dolmak üzereyse yenisini açar."""
+        with self._lock:
+            fresh = (
+                self.state.get("id")
+                and self.state.get("address") == self.address
+                and self._expires_in() > self.margin
+            )
+            if fresh and not force:
+                return dict(self.state)
+            drive = self.drive_factory()
+            old = dict(self.state)
+            channel_id = uuid.uuid4().hex
+            resp = drive.watch_changes(
+                drive.get_start_page_token(), channel_id, self.address, self.token, self.ttl,
+            )
+            self.state = {
+                "id": resp.get("id", channel_id),
+                "resourceId": resp.get("resourceId"),
+                "expiration": resp.get("expiration"),
+                "address": self.address,
+                "created_at": time.time(),
+            }
+            self._save()
+            # yeni kanal açıldıktan sonra eskisini kapat → bildirim boşluğu olmaz
+            if old.get("id") and old.get("resourceId"):
+                try:
+                    drive.stop_channel(old["id"], old["resourceId"])
+                except Exception as e:
+                    print(f"[warn] could not stop old drive channel {old['id']}: {e}")
+            print(f"[watch] drive channel {self.state['id']} active until {self.state.get('expiration')}")
+            return dict(self.state)
+
+    def _renew_loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.ensure_channel()
+                wait = max(60.0, self._expires_in() - self.margin)
+            except Exception as e:
+                print(f"[warn] drive channel renewal failed: {e}")
+                wait = 60.0
+            self._stop.wait(wait)
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._renew_loop, daemon=True, name="drive-watch")
+        self._thread.start()
+
+    def stop(self) -> None:
+        # kanal açık bırakılır: yeniden başlayan süreç aynı kanalı kullanır
+        self._stop.set()
+        self.debouncer.cancel()
+
+    # ── Bildirim ─────────────────────────────────────────────────────────────
+    def handle(self, channel_id: Optional[str], token: Optional[str], resource_state: Optional[str]) -> str:
+        """
+        Webhook başlıklarını doğrular. Dönüş: "sync" | "ignored" | "queued"
+        Yanlış token → PermissionError.
+        """
+        if not self.token or token != self.token:
+            raise PermissionError("invalid channel token")
+        if channel_id != self.state.get("id"):
+            return "ignored"  # eski/yabancı kanal
+        if resource_state == "sync":
+            return "sync"  # kanal açılış el sıkışması
+        self.notifications += 1
+        self.debouncer.trigger()
+        return "queued"
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "channel_id": self.state.get("id"),
+            "address": self.state.get("address"),
+            "expires_in_seconds": round(self._expires_in()) if self.state.get("expiration") else None,
+            "notifications": self.notifications,
+        }
+
+
+class RollingReport:
+    """
+    Push ile gelen koşuların satırlarını file_id'ye göre biriktirir; tek bir Drive
+    dosyası yerinde güncellenir (link sabit kalır). Satırlar max_age_days'ten eski
+    olunca ya da sayı max_rows'u aşınca (en eskiden) düşer; dosya sınırsız büyümez.
+    """
+
+    def __init__(self, path: str, max_age_days: int = 0, max_rows: int = 0):
+        self.path = Path(path)
+        self.max_age = max(0, max_age_days) * 86400
+        self.max_rows = max(0, max_rows)
+        self.state = {"drive_file_id": None, "rows": {}}
+        if self.path.exists():
+            try:
+                self.state.update(json.loads(self.path.read_text(encoding="utf-8")))
+            except Exception:
+                pass
+
+    def merge(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        now = time.time()
+        store = self.state["rows"]
+        for r in rows:
+            # metin raporda yok; dosyayı şişirmesin. Yeniden puanlanan satır sona taşınır.
+            store.pop(r["file_id"], None)
+            store[r["file_id"]] = {**{k: v for k, v in r.items() if k != "text"}, "_graded_at": now}
+        self._prune(now)
+        out = [{k: v for k, v in r.items() if k != "_graded_at"} for r in store.values()]
+        return sorted(out, key=lambda r: (r.get("file_name") or "").lower())
+
+    def _prune(self, now: float) -> None:
+        store = self.state["rows"]
+        if self.max_age:
+            for fid in [fid for fid, r in store.items() if now - r.get("_graded_at", 0) > self.max_age]:
+                del store[fid]
+        if self.max_rows and len(store) > self.max_rows:
+            # dict sırası = puanlanma sırası → en eskiler önde
+            for fid in list(store)[:len(store) - self.max_rows]:
+                del store[fid]
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.state, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(self.path)
@@ -0,0 +1,361 @@
+# src/eval_engine.py
+from __future__ import annotations
+import asyncio
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from openai import AsyncOpenAI
+import openai
+
+from .config import settings
+from .evaluator import (
+    MAX_TOKENS, PACK_MAX_TOKENS, PACK_SCHEMA, build_packed_messages, merge_payloads, normalize_text,
+    note_format_rejected, plan_requests, unpack_payloads, _request_kwargs, _payload_from_content,
+)
+from .resilience import CircuitBreaker, backoff_delay, get_breaker, is_rate_limit, is_retryable
+from .tokens import UsageMeter, count_tokens
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Asenkron değerlendirme motoru
+# - Tek, paylaşılan AsyncOpenAI istemcisi (httpx bağlantı havuzu)
+# - RPM/TPM limitlerine göre boyutlanmış token bucket'lar
+# - 429 / 5xx / zaman aşımında Retry-After'a uyan, jitter'lı geri çekilme; diğer 4xx
+#   tekrar edilmez. Sağlayıcı bozulunca ortak devre kesici tüm istekleri bekletir
+#   (bkz. resilience.py)
+# - İsteğe bağlı paketleme: kısa teslimler kısa bir bekleme penceresinde toplanıp
+#   tek istekte puanlanır (EVAL_PACK_TOKENS)
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+class TokenBucket:
+    """
+    Dakikalık kapasite ile dolan kova. acquire(n) yeterli jeton birikene kadar bekler.
+    """
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(max(1, per_minute))
+        self.rate = self.capacity / 60.0  # saniyede dolan jeton
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        # Kapasiteden büyük istek sonsuza kadar beklemesin
+        amount = min(float(amount), self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        # 429 geldiğinde kovayı boşalt: sonraki istekler Retry-After kadar bekler
+        self._refill()
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+def estimate_tokens(
+    system_msg: str, user_msg: str, model: Optional[str] = None, completion: int = MAX_TOKENS
+) -> int:
+    # İstem token'ları (tiktoken; yoksa bayt/4) + mesaj başına ek yük + cevap için ayrılan bütçe
+    model = model or settings.openai_model
+    return count_tokens(system_msg, model) + count_tokens(user_msg, model) + 8 + completion
+
+
+class _Pack:
+    """Gönderilmeyi bekleyen kısa teslimler: (id, metin, dosya_adı, future)."""
+
+    def __init__(self, meter: Optional[UsageMeter]):
+        self.meter = meter
+        self.items: List[Tuple[str, str, str, asyncio.Future]] = []
+        self.tokens = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+async def _settle(fut: asyncio.Future, coro: Any) -> None:
+    try:
+        res = await coro
+    except Exception as e:
+        if not fut.done():
+            fut.set_exception(e)
+    else:
+        if not fut.done():
+            fut.set_result(res)
+
+
+class AsyncEvaluationEngine:
+    def __init__(
+        self,
+        api_key: str,
+        base_url: Optional[str] = None,
+        model: Optional[str] = None,
+        rpm: int = 500,
+        tpm: int = 200000,
+        max_concurrency: int = 8,
+        max_retries: int = 5,
+        pack_tokens: int = 0,
+        pack_max_items: int = 8,
+        pack_item_tokens: int = 800,
+        pack_linger_ms: int = 200,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        # SDK'nın kendi retry'ı kapalı: geri çekilmeyi limiter ile birlikte burada yönetiyoruz
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url or None, max_retries=0)
+        self.model = model or settings.openai_model
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_retries = max(0, max_retries)
+        self.breaker = breaker or get_breaker(base_url)
+        self._sem = asyncio.Semaphore(max(1, max_concurrency))
+        self.pack_tokens = max(0, pack_tokens)
+        self.pack_max_items = max(1, pack_max_items)
+        self.pack_item_tokens = max(0, pack_item_tokens)
+        self.pack_linger = max(0, pack_linger_ms) / 1000.0
+        self._packs: Dict[int, _Pack] = {}  # id(meter) → açık paket (koşular karışmasın)
+        self._pack_seq = 0
+
+    @classmethod
+    def from_settings(cls) -> "AsyncEvaluationEngine":
+        return cls(
+            api_key=settings.openai_api_key,
+            base_url=settings.openai_base_url,
+            model=settings.openai_model,
+            rpm=settings.openai_rpm,
+            tpm=settings.openai_tpm,
+            max_concurrency=settings.openai_max_concurrency,
+            max_retries=settings.openai_max_retries,
+            pack_tokens=settings.eval_pack_tokens,
+            pack_max_items=settings.eval_pack_max_items,
+            pack_item_tokens=settings.eval_pack_item_tokens,
+            pack_linger_ms=settings.eval_pack_linger_ms,
+        )
+
+    async def _complete(
+        self, system_msg: str, user_msg: str, force_json: bool, meter: Optional[UsageMeter] = None,
+        max_tokens: int = MAX_TOKENS, schema: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        cost = estimate_tokens(system_msg, user_msg, self.model, completion=max_tokens)
+        attempt = 0
+        while True:
+            delay = self.breaker.wait_time()  # devre açıksa bekle (ProviderUnavailable olabilir)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            if meter is not None:
+                meter.reserve(cost)  # bütçe dolduysa TokenBudgetExceeded
+            kwargs = _request_kwargs(self.model, system_msg, user_msg, force_json, max_tokens, schema)
+            try:
+                await self.requests.acquire(1)
+                await self.tokens.acquire(cost)
+                async with self._sem:
+                    started = time.perf_counter()
+                    resp = await self.client.chat.completions.create(**kwargs)
+            except asyncio.CancelledError:
+                # iptal (ör. kardeş parça başarısız oldu) → ayrılan pay geri verilir
+                if meter is not None:
+                    meter.release(cost)
+                raise
+            except Exception as e:
+                if meter is not None:
+                    meter.release(cost)
+                if note_format_rejected(self.model, e, kwargs):
+                    continue  # model bu biçimi desteklemiyor → alt biçimle hemen tekrar
+                if not is_retryable(e):
+                    if isinstance(e, openai.APIStatusError):
+                        self.breaker.record_success()  # sağlayıcı cevap verdi; istek hatalı
+                    raise
+                self.breaker.record_failure()
+                if attempt >= self.max_retries:
+                    raise
+                backoff = backoff_delay(attempt, e)
+                if is_rate_limit(e):
+                    self.requests.pause(backoff)
+                attempt += 1
+                await asyncio.sleep(backoff)
+                continue
+            self.breaker.record_success()
+            if meter is not None:
+                meter.record(cost, resp.usage, time.perf_counter() - started)
+            return resp.choices[0].message.content or ""
+
+    async def _evaluate_part(
+        self, system_msg: str, user_msg: str, meter: Optional[UsageMeter]
+    ) -> Dict[str, Any]:
+        # bozuk/kesik JSON ikinci bir istekle değil, yerelde onarılır (_parse_json_loose)
+        out = await self._complete(system_msg, user_msg, force_json=True, meter=meter)
+        return _payload_from_content(out)
+
+    async def evaluate(
+        self, student_text: str, filename: str, meter: Optional[UsageMeter] = None
+    ) -> Dict[str, Any]:
+        size = self._pack_size(student_text, filename)
+        if size:
+            return await self._enqueue(student_text, filename, size, meter)
+        return await self._evaluate_single(student_text, filename, meter)
+
+    async def _evaluate_single(
+        self, student_text: str, filename: str, meter: Optional[UsageMeter] = None
+    ) -> Dict[str, Any]:
+        # Uzun metin → parçalar eşzamanlı puanlanır (map), sonra birleştirilir (reduce)
+        plan, dropped = plan_requests(student_text, filename, self.model)
+        if meter is not None and len(plan) > 1:
+            meter.note_chunked()
+        tasks = [asyncio.ensure_future(self._evaluate_part(s, u, meter)) for s, u, _ in plan]
+        try:
+            parts = await asyncio.gather(*tasks)
+        except BaseException:
+            # bir parça başarısız → sonuç zaten kullanılamaz; kalan parçalar iptal edilir
+            # (istekleri gönderilmez/faturalanmaz)
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        return merge_payloads(list(parts), [w for _, _, w in plan], dropped)
+
+    # ── Paketleme ────────────────────────────────────────────────────────────
+    def _pack_size(self, student_text: str, filename: str) -> int:
+        # paketlenebilecek kadar kısaysa teslimin token payı, değilse 0
+        if self.pack_tokens <= 0 or self.pack_max_items < 2:
+            return 0
+        n = count_tokens(normalize_text(student_text), self.model) + count_tokens(filename, self.model) + 16
+        return n if n <= min(self.pack_item_tokens, self.pack_tokens) else 0
+
+    async def _enqueue(
+        self, student_text: str, filename: str, size: int, meter: Optional[UsageMeter]
+    ) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        key = id(meter)
+        pack = self._packs.get(key)
+        if pack is not None and pack.tokens + size > self.pack_tokens:
+            self._flush(key)
+            pack = None
+        if pack is None:
+            pack = self._packs[key] = _Pack(meter)
+            pack.timer = loop.call_later(self.pack_linger, self._flush, key)
+        self._pack_seq += 1
+        fut = loop.create_future()
+        pack.items.append((f"s{self._pack_seq}", student_text, filename, fut))
+        pack.tokens += size
+        if len(pack.items) >= self.pack_max_items:
+            self._flush(key)
+        return await fut
+
+    def _flush(self, key: int) -> None:
+        pack = self._packs.pop(key, None)
+        if pack is None:
+            return
+        if pack.timer is not None:
+            pack.timer.cancel()
+        asyncio.ensure_future(self._run_pack(pack))
+
+    async def _run_pack(self, pack: _Pack) -> None:
+        try:
+            await self._grade_pack(pack)
+        finally:
+            # beklenmedik bir hata bekleyen hiçbir teslimi asılı bırakmasın
+            for _, _, _, fut in pack.items:
+                if not fut.done():
+                    fut.set_exception(RuntimeError("packed evaluation aborted"))
+
+    async def _grade_pack(self, pack: _Pack) -> None:
+        items = pack.items
+        if len(items) == 1:
+            _, text, filename, fut = items[0]
+            await _settle(fut, self._evaluate_single(text, filename, pack.meter))
+            return
+        system_msg, user_msg = build_packed_messages([(sid, t, fn) for sid, t, fn, _ in items])
+        ids = [sid for sid, _, _, _ in items]
+        try:
+            out = await self._complete(
+                system_msg, user_msg, force_json=True, meter=pack.meter,
+                max_tokens=min(PACK_MAX_TOKENS, MAX_TOKENS * len(items)), schema=PACK_SCHEMA,
+            )
+            parsed = unpack_payloads(out, ids)
+        except openai.BadRequestError:
+            parsed = {sid: None for sid in ids}  # paket reddedildi → hepsi tek tek
+        except Exception as e:
+            for _, _, _, fut in items:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        retry = []
+        for sid, text, filename, fut in items:
+            if parsed[sid] is None:
+                retry.append((text, filename, fut))
+            elif not fut.done():
+                fut.set_result(parsed[sid])
+        if pack.meter is not None:
+            pack.meter.note_packed(len(items), len(retry))
+        # eksik/bozuk öğeler yalnızca kendileri için yeniden istenir
+        await asyncio.gather(*(_settle(fut, self._evaluate_single(t, fn, pack.meter)) for t, fn, fut in retry))
+
+    async def evaluate_many(
+        self, items: Iterable[Tuple[Any, str, str]]
+    ) -> AsyncIterator[Tuple[Any, Any]]:
+        """
+        items: (anahtar, metin, dosya_adı) üçlüleri
+        Tamamlanma sırasıyla (anahtar, sonuç | Exception) döner.
+        """
+
+        async def one(key: Any, text: str, filename: str) -> Tuple[Any, Any]:
+            try:
+                return key, await self.evaluate(text, filename)
+            except Exception as e:
+                return key, e
+
+        tasks = [asyncio.ensure_future(one(k, t, fn)) for k, t, fn in items]
+        for fut in asyncio.as_completed(tasks):
+            yield await fut
+
+    async def aclose(self) -> None:
+        await self.client.close()
+
+
+# ── Senkron köprü ────────────────────────────────────────────────────────────
+# İş hattının thread worker'ları tek bir olay döngüsündeki motoru paylaşır;
+# böylece limiter ve bağlantı havuzu tüm koşu için ortaktır.
+
+class _EngineRunner:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True, name="eval-engine")
+        self.thread.start()
+        self.engine: AsyncEvaluationEngine = asyncio.run_coroutine_threadsafe(
+            self._make(), self.loop
+        ).result()
+
+    @staticmethod
+    async def _make() -> AsyncEvaluationEngine:
+        # asyncio nesneleri motorun döngüsünde oluşturulmalı
+        return AsyncEvaluationEngine.from_settings()
+
+    def evaluate(self, student_text: str, filename: str, meter: Optional[UsageMeter] = None) -> Dict[str, Any]:
+        return asyncio.run_coroutine_threadsafe(
+            self.engine.evaluate(student_text, filename, meter), self.loop
+        ).result()
+
+
+_runner: Optional[_EngineRunner] = None
+_runner_lock = threading.Lock()
+
+
+def evaluate_text_pooled(
+    student_text: str, filename: str, meter: Optional[UsageMeter] = None
+) -> Dict[str, Any]:
+    """
+    evaluate_text ile aynı sonuç; ama süreç genelinde paylaşılan motor üzerinden.
+    meter verilirse token/gecikme kaydı tutulur ve koşu bütçesi uygulanır.
+    """
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = _EngineRunner()
+    return _runner.evaluate(student_text, filename, meter)
@@ -1,9 +1,26 @@
 # src/evaluator.py
 from __future__ import annotations
-from typing import Dict, Any, List
+from typing import TYPE_CHECKING, Dict, Any, List, Optional, Tuple
 from openai import OpenAI
+import openai
 import json
 import re
+import threading
+import time
+
+from .config import settings
+from .tokens import UsageMeter, split_by_tokens
+from .resilience import backoff_delay, get_breaker, is_retryable
+
+if TYPE_CHECKING:
+    from .grading_cache import GradingCache
+
+# Örnekleme parametreleri (önbellek anahtarı ve batch istekleri de bunları kullanır)
+TEMPERATURE = 0.1
+MAX_TOKENS = 900
+# Uzun metinler kesilmez: EVAL_CHUNK_TOKENS'lık parçalar ayrı puanlanıp birleştirilir
+# (en fazla EVAL_MAX_CHUNKS parça; fazlası puanlanmaz ve satırda not edilir).
+MAX_LIST_ITEMS = 6
 
 RUBRIC = """
 You are a fair, detail-oriented academic grader.
@@ -42,6 +59,105 @@ CONSTRAINTS:
 - No markdown, no code blocks, only the JSON object.
 """
 
+# ── Yapılandırılmış çıktı şemaları (_coerce_payload ile aynı alanlar) ────────
+# strict modda aralıklar (0..40 vb.) şemada değil; _coerce_payload kırpar.
+_BREAKDOWN_KEYS = ["content", "structure", "language", "originality"]
+_GRADE_PROPS: Dict[str, Any] = {
+    "total": {"type": "integer"},
+    "breakdown": {
+        "type": "object",
+        "properties": {k: {"type": "integer"} for k in _BREAKDOWN_KEYS},
+        "required": _BREAKDOWN_KEYS,
+        "additionalProperties": False,
+    },
+    "strengths": {"type": "array", "items": {"type": "string"}},
+    "weaknesses": {"type": "array", "items": {"type": "string"}},
+    "suggestions": {"type": "array", "items": {"type": "string"}},
+    "feedback": {"type": "string"},
+}
+GRADE_SCHEMA: Dict[str, Any] = {
+    "name": "grade",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": _GRADE_PROPS,
+        "required": list(_GRADE_PROPS),
+        "additionalProperties": False,
+    },
+}
+PACK_SCHEMA: Dict[str, Any] = {
+    "name": "grade_pack",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "results": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {"id": {"type": "string"}, **_GRADE_PROPS},
+                    "required": ["id", *_GRADE_PROPS],
+                    "additionalProperties": False,
+                },
+            },
+        },
+        "required": ["results"],
+        "additionalProperties": False,
+    },
+}
+
+# Model başına çıktı biçimi: 0 = json_schema, 1 = json_object, 2 = serbest metin.
+# Model bir biçimi reddederse (400) bir alta inilir ve süreç boyunca hatırlanır.
+_FORMATS = ("json_schema", "json_object", None)
+_format_level: Dict[str, int] = {}
+_format_lock = threading.Lock()
+
+def _format_for(model: str) -> int:
+    with _format_lock:
+        return _format_level.get(model, 0 if settings.openai_strict_schema else 1)
+
+def note_format_rejected(model: str, exc: Exception, kwargs: Dict[str, Any]) -> bool:
+    """
+    400 hatası response_format'ı reddediyorsa modeli bir alt biçime indirir → True
+    (çağıran hemen yeniden dener; 400 ücretlendirilmez). Diğer hatalar → False.
+    """
+    if not isinstance(exc, openai.BadRequestError):
+        return False
+    return note_format_rejected_message(model, str(exc), (kwargs.get("response_format") or {}).get("type"))
+
+def note_format_rejected_message(model: str, message: str, used: Optional[str]) -> bool:
+    """
+    note_format_rejected'in mesaj tabanlı hali (batch çıktısındaki satır başına 400'ler için).
+    used: reddedilen istekte gönderilen response_format tipi (None = serbest metin).
+    """
+    msg = (message or "").lower()
+    if not any(w in msg for w in ("response_format", "json_schema", "json_object", "structured output")):
+        return False
+    level = _FORMATS.index(used) if used in _FORMATS else 2
+    with _format_lock:
+        current = _format_level.get(model, 0 if settings.openai_strict_schema else 1)
+        if current == level and level < 2:
+            _format_level[model] = level + 1
+            print(f"[warn] {model} rejected response_format={used}; using {_FORMATS[level + 1] or 'plain text'}")
+        return _format_level.get(model, current) > level
+
+# İstem/cevap biçimi değişince (parça/paket şablonları, şema) artırılır → önbellek geçersizleşir
+PROMPT_VERSION = 2
+
+def grading_setup(model: str) -> str:
+    """
+    Aynı metnin puanını etkileyen kurulum: istem sürümü, şema, cevap biçimi,
+    parçalama ve paketleme ayarları (puanlama önbelleği anahtarına girer).
+    """
+    packed = settings.eval_pack_tokens > 0 and settings.eval_mode != "batch"
+    return "|".join([
+        f"prompt=v{PROMPT_VERSION}",
+        f"schema={json.dumps(GRADE_SCHEMA, sort_keys=True)}",
+        f"format={_FORMATS[_format_for(model)]}",
+        f"chunks={settings.eval_chunk_tokens}x{settings.eval_max_chunks}",
+        f"pack={settings.eval_pack_item_tokens if packed else 0}",
+    ])
+
 def _clamp(v: int, lo: int, hi: int) -> int:
     try:
         v = int(round(float(v)))
@@ -87,6 +203,46 @@ def _coerce_payload(d: Dict[str, Any]) -> Dict[str, Any]:
     d["feedback"] = fb.strip()
     return d
 
+def _repair_json(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Yerel onarım (ikinci bir ücretli istek yerine): kod bloğu, sondaki virgüller ve
+    max_tokens'ta kesilmiş cevaptaki kapanmamış tırnak/parantezler düzeltilir.
+    """
+    start = (text or "").find("{")
+    if start < 0:
+        return None
+    body = re.sub(r"```\s*$", "", text[start:].strip())
+    stack: List[str] = []
+    in_str = esc = False
+    for ch in body:
+        if in_str:
+            if esc:
+                esc = False
+            elif ch == "\\":
+                esc = True
+            elif ch == '"':
+                in_str = False
+        elif ch == '"':
+            in_str = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+    if esc:
+        body = body[:-1]
+    if in_str:
+        body += '"'
+    # yarım kalan anahtar ("key": ya da "key") ve sondaki virgüller
+    body = re.sub(r',?\s*"[^"]*"\s*:\s*$', "", body)
+    body = re.sub(r'([{,])\s*"[^"]*"\s*$', r"\1", body) if stack and stack[-1] == "}" else body
+    body = body.rstrip().rstrip(",") + "".join(reversed(stack))
+    body = re.sub(r",\s*([}\]])", r"\1", body)
+    try:
+        data = json.loads(body)
+    except Exception:
+        return None
+    return data if isinstance(data, dict) else None
+
 def _parse_json_loose(text: str) -> Dict[str, Any]:
     # Kod bloğu içindeki JSON
     m = re.search(r"```json\s*(\{[\s\S]*?\})\s*```", text, re.I)
@@ -102,6 +258,10 @@ def _parse_json_loose(text: str) -> Dict[str, Any]:
             return json.loads(m.group(0))
         except Exception:
             pass
+    # Kesik/bozuk JSON → yerel onarım
+    repaired = _repair_json(text)
+    if repaired is not None:
+        return repaired
     # Olmadıysa minimal payload
     return {
         "total": 0,
@@ -112,43 +272,217 @@ def _parse_json_loose(text: str) -> Dict[str, Any]:
         "feedback": text.strip()[:1500] if text else "",
     }
 
-def _chat(client: OpenAI, model: str, system_msg: str, user_msg: str, force_json: bool = True) -> Dict[str, Any]:
+def _request_kwargs(
+    model: str, system_msg: str, user_msg: str, force_json: bool = True, max_tokens: int = MAX_TOKENS,
+    schema: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
     kwargs = dict(
         model=model,
         messages=[
             {"role": "system", "content": system_msg},
             {"role": "user",   "content": user_msg},
         ],
-        temperature=0.1,
-        max_tokens=900,
+        temperature=TEMPERATURE,
+        max_tokens=max_tokens,
     )
-    if force_json:
+    fmt = _FORMATS[_format_for(model)] if force_json else None
+    if fmt == "json_schema":
+        kwargs["response_format"] = {"type": "json_schema", "json_schema": schema or GRADE_SCHEMA}
+    elif fmt == "json_object":
         kwargs["response_format"] = {"type": "json_object"}
-    resp = client.chat.completions.create(**kwargs)
-    out = resp.choices[0].message.content or ""
+    return kwargs
+
+def _payload_from_content(out: str) -> Dict[str, Any]:
     try:
         data = json.loads(out)
     except Exception:
         data = _parse_json_loose(out)
     return _coerce_payload(data)
 
-def evaluate_text(api_key: str, student_text: str, filename: str) -> Dict[str, Any]:
-    client = OpenAI(api_key=api_key)
+# ── Çoklu teslim (paketleme) ─────────────────────────────────────────────────
+# Kısa cevaplarda RUBRIC metinden pahalı: birden fazla teslim tek istekte puanlanır.
+# Sistem mesajı yine RUBRIC (önbellek öneki aynı kalır); paket talimatı kullanıcı mesajında.
+PACK_MAX_TOKENS = 16000  # paket cevabı için üst sınır (modelin çıktı limiti)
 
-    # Gürültülü OCR metinlerini biraz kısaltıp normalize et
-    text = (student_text or "").replace("\x0c", " ").strip()
-    text = re.sub(r"\s+", " ", text)
-    # Çok uzun metinleri kes (token güvenliği)
-    if len(text) > 12000:
-        text = text[:12000]
+def build_packed_messages(items: List[Tuple[str, str, str]]) -> Tuple[str, str]:
+    """items: (id, metin, dosya_adı) → tek istek (system, user)"""
+    parts = [
+        f"Grade each of the {len(items)} submissions below independently, using the rubric above.\n"
+        'Return a STRICT JSON object {"results": [...]} with exactly one item per submission.\n'
+        'Each item is the schema above plus "id": the submission id as given. No other keys at the top level.'
+    ]
+    for sid, text, filename in items:
+        parts.append(f"=== SUBMISSION id={sid} ===\nFILENAME: {filename}\nSTUDENT_TEXT:\n{normalize_text(text)}")
+    return RUBRIC, "\n\n".join(parts)
 
-    system_msg = RUBRIC
-    user_msg = f"FILENAME: {filename}\nSTUDENT_TEXT:\n{text}"
+def _valid_item(d: Any) -> bool:
+    # _coerce_payload her şeyi düzeltir; paket öğesi yine de puanları gerçekten içermeli
+    if not isinstance(d, dict) or not isinstance(d.get("breakdown"), dict):
+        return False
+    for k in ("content", "structure", "language", "originality"):
+        v = d["breakdown"].get(k)
+        if isinstance(v, bool) or not isinstance(v, (int, float)):
+            return False
+    return isinstance(d.get("feedback"), str) and bool(d["feedback"].strip())
 
+def unpack_payloads(out: str, ids: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    Paket cevabını id → payload olarak çözer. Eksik, yinelenen ya da bozuk öğe → None
+    (çağıran o teslimi tek başına yeniden puanlar).
+    """
     try:
-        data = _chat(client, "gpt-4o-mini", system_msg, user_msg, force_json=True)
+        data = json.loads(out)
     except Exception:
-        # bir kez toleranslı dene (JSON zorunlu değil)
-        data = _chat(client, "gpt-4o-mini", system_msg, user_msg, force_json=False)
+        data = _parse_json_loose(out)
+    items = data.get("results") if isinstance(data, dict) else data
+    found: Dict[str, Any] = {}
+    for item in items if isinstance(items, list) else []:
+        sid = str(item.get("id")) if isinstance(item, dict) else None
+        if sid in found:
+            found[sid] = None  # aynı id iki kez → güvenilmez
+        elif sid is not None:
+            found[sid] = item
+    return {
+        sid: _coerce_payload({k: v for k, v in found[sid].items() if k != "id"}) if _valid_item(found.get(sid)) else None
+        for sid in ids
+    }
+
+def _chat(client: OpenAI, model: str, system_msg: str, user_msg: str, force_json: bool = True,
+          meter: Optional[UsageMeter] = None) -> Dict[str, Any]:
+    # Senkron yol: eval_engine._complete ile aynı tekrar / devre kesici kuralları
+    from .eval_engine import estimate_tokens
+    breaker = get_breaker()
+    client = client.with_options(max_retries=0)  # tekrarları burada yönetiyoruz
+    attempt = 0
+    while True:
+        delay = breaker.wait_time()  # devre açıksa bekle (ProviderUnavailable olabilir)
+        if delay > 0:
+            time.sleep(delay)
+            continue
+        kwargs = _request_kwargs(model, system_msg, user_msg, force_json)
+        estimate = estimate_tokens(system_msg, user_msg, model)
+        if meter is not None:
+            meter.reserve(estimate)
+        started = time.perf_counter()
+        try:
+            resp = client.chat.completions.create(**kwargs)
+        except Exception as e:
+            if meter is not None:
+                meter.release(estimate)
+            if note_format_rejected(model, e, kwargs):
+                continue
+            if not is_retryable(e):
+                if isinstance(e, openai.APIStatusError):
+                    breaker.record_success()  # sağlayıcı cevap verdi; istek hatalı
+                raise
+            breaker.record_failure()
+            if attempt >= settings.openai_max_retries:
+                raise
+            time.sleep(backoff_delay(attempt, e))
+            attempt += 1
+            continue
+        breaker.record_success()
+        if meter is not None:
+            meter.record(estimate, resp.usage, time.perf_counter() - started)
+        return _payload_from_content(resp.choices[0].message.content or "")
+
+# ── Paylaşılan istemci ────────────────────────────────────────────────────────
+# Her dosyada yeni OpenAI() yerine süreç boyunca tek istemci → bağlantı havuzu yeniden kullanılır
+_clients: Dict[Tuple[str, Optional[str]], OpenAI] = {}
+_clients_lock = threading.Lock()
+
+def get_client(api_key: str) -> OpenAI:
+    key = (api_key, settings.openai_base_url or None)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = OpenAI(api_key=api_key, base_url=settings.openai_base_url or None)
+            _clients[key] = client
+        return client
+
+def normalize_text(student_text: str) -> str:
+    # Gürültülü OCR metinlerini normalize et (boşluklar)
+    text = (student_text or "").replace("\x0c", " ").strip()
+    return re.sub(r"\s+", " ", text)
+
+def build_messages(student_text: str, filename: str) -> Tuple[str, str]:
+    # Tek istekte gönderilen metin (parçalama yok)
+    text = normalize_text(student_text)
+    return RUBRIC, f"FILENAME: {filename}\nSTUDENT_TEXT:\n{text}"
+
+def plan_requests(
+    student_text: str, filename: str, model: Optional[str] = None,
+) -> Tuple[List[Tuple[str, str, int]], int]:
+    """
+    Metni token bütçesine göre isteklere böler. Dönüş: ([(system, user, ağırlık)], düşen_parça)
+    Sığan metin için tek istek (build_messages ile aynı). Uzun metin için her parça ayrı
+    puanlanır; ağırlık = parçanın karakter sayısı (merge_payloads'ta kullanılır).
+    EVAL_MAX_CHUNKS'ı aşan parçalar gönderilmez; sayısı merge_payloads'a verilir.
+    """
+    model = model or settings.openai_model
+    text = normalize_text(student_text)
+    chunks = split_by_tokens(text, settings.eval_chunk_tokens, model)
+    if len(chunks) <= 1:
+        return [(RUBRIC, f"FILENAME: {filename}\nSTUDENT_TEXT:\n{text}", len(text))], 0
+    dropped = 0
+    if settings.eval_max_chunks > 0 and len(chunks) > settings.eval_max_chunks:
+        print(f"[warn] {filename}: {len(chunks)} chunks, grading the first {settings.eval_max_chunks}")
+        dropped = len(chunks) - settings.eval_max_chunks
+        chunks = chunks[:settings.eval_max_chunks]
+    n = len(chunks)
+    return [
+        (RUBRIC,
+         f"FILENAME: {filename}\nPART: {i}/{n} of one long submission; grade this part on its own.\n"
+         f"STUDENT_TEXT:\n{chunk}",
+         len(chunk))
+        for i, chunk in enumerate(chunks, 1)
+    ], dropped
+
+def merge_payloads(payloads: List[Dict[str, Any]], weights: List[int], dropped: int = 0) -> Dict[str, Any]:
+    """
+    Parça puanlarını metin uzunluğuna göre ağırlıklı ortalar; listeleri birleştirir.
+    dropped > 0 → puan metnin tamamını kapsamıyor: "chunks_dropped" alanı eklenir.
+    """
+    if len(payloads) == 1:
+        if not dropped:
+            return payloads[0]
+        return {**payloads[0], "chunks": 1, "chunks_dropped": dropped}
+    total_w = float(sum(weights)) or 1.0
+    bd = {}
+    for k in ("content", "structure", "language", "originality"):
+        bd[k] = sum(p["breakdown"][k] * w for p, w in zip(payloads, weights)) / total_w
+    merged: Dict[str, Any] = {"breakdown": bd}
+    for k in ("strengths", "weaknesses", "suggestions"):
+        seen: List[str] = []
+        for p in payloads:
+            for item in p.get(k) or []:
+                if item not in seen:
+                    seen.append(item)
+        merged[k] = seen[:MAX_LIST_ITEMS]
+    # geri bildirim: en uzun parçanınki
+    merged["feedback"] = max(zip(payloads, weights), key=lambda pw: pw[1])[0].get("feedback")
+    merged["chunks"] = len(payloads)
+    if dropped:
+        merged["chunks_dropped"] = dropped
+    return _coerce_payload(merged)
+
+def evaluate_text(
+    api_key: str, student_text: str, filename: str, cache: Optional["GradingCache"] = None,
+    meter: Optional[UsageMeter] = None,
+) -> Dict[str, Any]:
+    if cache is not None:
+        return cache.get_or_compute(
+            student_text, settings.openai_model, lambda: evaluate_text(api_key, student_text, filename, meter=meter)
+        )
+
+    client = get_client(api_key)
+    model = settings.openai_model
+    plan, dropped = plan_requests(student_text, filename, model)
+    if meter is not None and len(plan) > 1:
+        meter.note_chunked()
+
+    # Hata olursa aynı isteği körlemesine tekrar göndermek yok: _chat yalnızca 429/5xx'te
+    # geri çekilip dener, desteklenmeyen biçimi düşürür, bozuk JSON'u yerelde onarır
+    parts = [_chat(client, model, system_msg, user_msg, meter=meter) for system_msg, user_msg, _ in plan]
 
-    return data
+    return merge_payloads(parts, [w for _, _, w in plan], dropped)
@@ -1,13 +1,18 @@
 from __future__ import annotations
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+import atexit
+import multiprocessing
 import os
+import threading
 
 import pytesseract
 from PIL import Image, ImageOps, ImageFilter
 
 # pdf2image ve pypdf isteğe bağlı (taralı PDF için)
 try:
-    from pdf2image import convert_from_path
+    from pdf2image import convert_from_path, pdfinfo_from_path
     PDF2IMAGE_AVAILABLE = True
 except Exception:
     PDF2IMAGE_AVAILABLE = False
@@ -26,6 +31,29 @@ if TESSERACT_CMD:
 OCR_LANG = os.getenv("OCR_LANG", "eng").strip()  # öneri: tur+eng
 IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff"}
 
+# Taralı PDF: sayfa başına OCR süreç havuzu (0 = CPU sayısı) ve belge başına sayfa sınırı (0 = sınırsız).
+# Süreç genelinde tek havuz: iş hattının extract thread'leri sayfalarını bu havuza verir.
+try:
+    OCR_PAGE_WORKERS = int(os.getenv("OCR_PAGE_WORKERS", "0") or 0) or (os.cpu_count() or 1)
+except ValueError:
+    OCR_PAGE_WORKERS = os.cpu_count() or 1
+try:
+    OCR_MAX_PAGES = int(os.getenv("OCR_MAX_PAGES", "50") or 0)
+except ValueError:
+    OCR_MAX_PAGES = 50
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+# Uyarlamalı DPI: sayfanın uzun kenarı en fazla OCR_MAX_PAGE_PIXELS piksel olacak şekilde
+# (A4 @ 300 DPI ≈ 3508 px); büyük sayfalar GB'larca RAM yemesin
+OCR_MAX_DPI = _env_int("OCR_MAX_DPI", 300)
+OCR_MIN_DPI = _env_int("OCR_MIN_DPI", 150)
+OCR_MAX_PAGE_PIXELS = _env_int("OCR_MAX_PAGE_PIXELS", 3508)
+
 
 def extract_text(path: Path) -> str:
     ext = path.suffix.lower()
@@ -82,18 +110,138 @@ def _from_pdf_textlayer(path: Path) -> str:
         return ""
 
 
-def _from_scanned_pdf_ocr(path: Path) -> str:
-    if not PDF2IMAGE_AVAILABLE:
-        return ""
+def _pdf_page_count(path: Path) -> int:
+    if PDF2IMAGE_AVAILABLE:
+        try:
+            return int(pdfinfo_from_path(str(path)).get("Pages", 0))
+        except Exception:
+            pass
+    if PYPDF_AVAILABLE:
+        try:
+            return len(PdfReader(str(path)).pages)
+        except Exception:
+            pass
+    return 0
+
+
+_page_pool: Optional[ProcessPoolExecutor] = None
+_page_pool_lock = threading.Lock()
+
+
+def _init_page_worker() -> None:
+    # Sayfalar zaten paralel; tesseract'ın kendi OpenMP thread'leri çekirdekleri boğmasın
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+
+def _get_page_pool() -> Optional[ProcessPoolExecutor]:
+    global _page_pool
+    if OCR_PAGE_WORKERS <= 1:
+        return None
+    with _page_pool_lock:
+        if _page_pool is None:
+            try:
+                _page_pool = ProcessPoolExecutor(
+                    max_workers=OCR_PAGE_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_page_worker,
+                )
+                atexit.register(_page_pool.shutdown, wait=False, cancel_futures=True)
+            except Exception:
+                _page_pool = None
+        return _page_pool
+
+
+def _page_sizes_pts(path: Path, pages: int) -> List[Optional[Tuple[float, float]]]:
+    # mediabox okumak ucuz: sayfalar render edilmeden boyutları bilinir
+    sizes: List[Optional[Tuple[float, float]]] = [None] * pages
+    if PYPDF_AVAILABLE:
+        try:
+            reader = PdfReader(str(path))
+            for i in range(min(pages, len(reader.pages))):
+                box = reader.pages[i].mediabox
+                sizes[i] = (float(box.width), float(box.height))
+        except Exception:
+            pass
+    return sizes
+
+
+def _adaptive_dpi(size_pts: Optional[Tuple[float, float]]) -> int:
+    if not size_pts:
+        return OCR_MAX_DPI
+    longest_in = max(size_pts) / 72.0
+    if longest_in <= 0:
+        return OCR_MAX_DPI
+    dpi = int(OCR_MAX_PAGE_PIXELS / longest_in)
+    return max(OCR_MIN_DPI, min(OCR_MAX_DPI, dpi))
+
+
+def _rss_mb() -> Optional[float]:
+    # Anlık RSS (Linux /proc). ru_maxrss kullanılmaz: uzun ömürlü worker'da süreç
+    # ömrünün tepesidir, tek belgenin değil. Ölçülemiyorsa None.
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except Exception:
+        return None
+
+
+def _ocr_pdf_page(path: str, page_no: int, dpi: int, lang: str) -> Tuple[str, Optional[float]]:
+    """
+    Tek sayfayı render edip OCR'lar; (metin, render sonrası anlık RSS MB) döner.
+    Her çağrı yalnızca kendi sayfasını bellekte tutar ve iş bitince bırakır.
+    """
     try:
-        images = convert_from_path(str(path), dpi=300)
+        images = convert_from_path(path, dpi=dpi, first_page=page_no, last_page=page_no, grayscale=True)
     except Exception:
+        return "", _rss_mb()
+    rss = _rss_mb()
+    try:
+        return "\n".join(_ocr_preprocess_and_read(img, lang) for img in images), rss
+    finally:
+        for img in images:
+            img.close()
+        del images
+
+
+def _from_scanned_pdf_ocr(path: Path, lang: Optional[str] = None, info: Optional[Dict[str, Any]] = None) -> str:
+    """
+    info verilirse doldurulur: ocr_pages (okunan), ocr_pages_total, ocr_truncated,
+    ocr_peak_rss_mb (bu belge boyunca render sonrası ölçülen en yüksek anlık RSS).
+    """
+    if not PDF2IMAGE_AVAILABLE:
+        return ""
+    lang = lang or OCR_LANG
+    total_pages = _pdf_page_count(path)
+    if total_pages <= 0:
         return ""
+    pages = min(total_pages, OCR_MAX_PAGES) if OCR_MAX_PAGES > 0 else total_pages
+
+    page_nos = list(range(1, pages + 1))
+    dpis = [_adaptive_dpi(sz) for sz in _page_sizes_pts(path, pages)]
+    pool = _get_page_pool()
+    results: List[Tuple[str, float]]
+    if pool is not None:
+        try:
+            # map sonuçları sayfa sırasıyla döndürür
+            results = list(pool.map(_ocr_pdf_page, [str(path)] * pages, page_nos, dpis, [lang] * pages))
+        except Exception:
+            pool = None
+    if pool is None:
+        # Akış halinde: her seferinde tek sayfa render → OCR → serbest bırak
+        results = [_ocr_pdf_page(str(path), n, dpi, lang) for n, dpi in zip(page_nos, dpis)]
 
-    texts = []
-    for img in images:
-        texts.append(_ocr_preprocess_and_read(img))
-    return "\n".join(texts)
+    samples = [rss for _, rss in results if rss is not None]
+    peak = round(max(samples)) if samples else None
+    if info is not None:
+        info.update({
+            "ocr_pages": pages,
+            "ocr_pages_total": total_pages,
+            "ocr_truncated": pages < total_pages,
+            "ocr_peak_rss_mb": peak,
+        })
+    if pages < total_pages:
+        print(f"[warn] {path.name}: OCR_MAX_PAGES={OCR_MAX_PAGES}, only {pages} of {total_pages} pages read")
+    return "\n".join(text for text, _ in results)
 
 
 def _from_image_ocr(path: Path) -> str:
@@ -104,7 +252,7 @@ def _from_image_ocr(path: Path) -> str:
         return ""
 
 
-def _ocr_preprocess_and_read(img: Image.Image) -> str:
+def _ocr_preprocess_and_read(img: Image.Image, lang: Optional[str] = None) -> str:
     """
     Basit ama etkili ön-işleme:
     - Gri ton
@@ -119,12 +267,15 @@ def _ocr_preprocess_and_read(img: Image.Image) -> str:
     g = g.filter(ImageFilter.SHARPEN)
     # 3) Basit binarizasyon
     bw = g.point(lambda x: 255 if x > 180 else 0, mode="1")
+    g.close()
 
     try:
-        return pytesseract.image_to_string(bw, lang=OCR_LANG)
+        return pytesseract.image_to_string(bw, lang=lang or OCR_LANG)
     except Exception:
         # Dil paketi yoksa en azından İngilizce dene
         try:
             return pytesseract.image_to_string(bw, lang="eng")
         except Exception:
             return ""
+    finally:
+        bw.close()
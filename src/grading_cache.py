@@ -0,0 +1,155 @@
+# src/grading_cache.py
+from __future__ import annotations
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from .evaluator import RUBRIC, TEMPERATURE, MAX_TOKENS, grading_setup, normalize_text
+
+# ─────────────────────────────────────────────────────────────────────────────
+# İçerik adresli puanlama önbelleği
+# Anahtar = sha256(normalize metin + RUBRIC + model + örnekleme parametreleri
+#                 + istem/şema sürümü, cevap biçimi, parça ve paket ayarları)
+# Değer  = _coerce_payload çıktısı (JSON)
+# Aynı metin tekrar yüklendiğinde / kopyalandığında LLM çağrısı yapılmaz; aynı koşuda
+# eşzamanlı gelen aynı metin de uçuştaki hesabı bekler (tek istek).
+# ─────────────────────────────────────────────────────────────────────────────
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS grades (
+    key        TEXT PRIMARY KEY,
+    payload    TEXT NOT NULL,
+    size       INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used  REAL NOT NULL
+)
+"""
+
+
+def cache_key(student_text: str, model: str) -> str:
+    h = hashlib.sha256()
+    parts = [normalize_text(student_text), RUBRIC, model, repr(TEMPERATURE), repr(MAX_TOKENS), grading_setup(model)]
+    for part in parts:
+        b = part.encode("utf-8")
+        # uzunluk öneki: parçalar birbirine karışmasın
+        h.update(len(b).to_bytes(8, "big"))
+        h.update(b)
+    return h.hexdigest()
+
+
+class GradingCache:
+    def __init__(self, db_path: str, max_bytes: int = 50 * 1024 * 1024, max_age_days: float = 90.0):
+        p = Path(db_path)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        self.path = str(p)
+        self.max_bytes = max(0, int(max_bytes))
+        self.max_age = max(0.0, float(max_age_days)) * 86400.0
+        self.hits = 0
+        self.misses = 0
+        self.deduped = 0  # uçuştaki aynı hesabı bekleyerek kazanılan istekler
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock:
+            # silinen sayfalar diske geri verilsin (text_cache ile aynı)
+            self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            if self._conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                # eski dosya auto_vacuum'suz oluşturulmuş → bir kereye mahsus dönüştür
+                self._conn.execute("VACUUM")
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(_SCHEMA)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS grades_last_used ON grades(last_used)")
+            self._conn.commit()
+
+    @classmethod
+    def for_output_dir(cls, out_dir: Path, max_mb: int = 50, max_age_days: float = 90.0) -> "GradingCache":
+        return cls(str(Path(out_dir) / "grading_cache.sqlite3"), max_mb * 1024 * 1024, max_age_days)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT payload, created_at FROM grades WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.max_age and now - row[1] > self.max_age):
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE grades SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, payload: Dict[str, Any]) -> None:
+        data = json.dumps(payload, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO grades (key, payload, size, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data.encode("utf-8")), now, now),
+            )
+            self._conn.commit()
+
+    def get_or_compute(self, student_text: str, model: str, compute: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        key = cache_key(student_text, model)
+        hit = self.get(key)
+        if hit is not None:
+            return hit
+        with self._lock:
+            fut = self._inflight.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._inflight[key] = Future()
+        if not owner:
+            # aynı metin şu an başka bir worker'da puanlanıyor → onun sonucunu (ya da hatasını) al
+            payload = fut.result()
+            with self._lock:
+                self.deduped += 1
+            return payload
+        try:
+            payload = compute()
+            self.put(key, payload)
+            fut.set_result(payload)
+            return payload
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def evict(self) -> int:
+        """
+        Önce yaşı dolanları, sonra toplam boyut sınırı aşılıyorsa en uzun süredir
+        kullanılmayanları siler. Silinen kayıt sayısını döner.
+        """
+        removed = 0
+        with self._lock:
+            if self.max_age:
+                cur = self._conn.execute("DELETE FROM grades WHERE created_at < ?", (time.time() - self.max_age,))
+                removed += cur.rowcount
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM grades").fetchone()[0]
+            if self.max_bytes and total > self.max_bytes:
+                excess = total - self.max_bytes
+                freed = 0
+                doomed = []
+                for key, size in self._conn.execute("SELECT key, size FROM grades ORDER BY last_used ASC"):
+                    if freed >= excess:
+                        break
+                    doomed.append((key,))
+                    freed += size
+                self._conn.executemany("DELETE FROM grades WHERE key = ?", doomed)
+                removed += len(doomed)
+            self._conn.commit()
+            if removed:
+                # silinen sayfaları diske geri ver; execute() yalnızca bir adım (tek sayfa)
+                # çalıştırır, executescript pragma'yı sonuna kadar yürütür
+                self._conn.executescript("PRAGMA incremental_vacuum;")
+                self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return removed
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
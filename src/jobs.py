@@ -0,0 +1,216 @@
+# src/jobs.py
+from __future__ import annotations
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Arka plan iş yöneticisi
+# POST /jobs hemen bir iş kimliği döner; koşu executor'da çalışır. Aynı klasör
+# için çalışan bir iş varken aynı parametreli tetikler yeni koşu açmaz, mevcut işe
+# katılır (single-flight). Parametreleri farklı tetik (force/limit/listing/rolling)
+# sıraya bir iş olarak eklenir ve aktif iş bitince çalışır; aynı klasörün koşuları
+# hiçbir zaman eşzamanlı değildir. İlerleme process_once'ın on_event olaylarından tutulur; aynı
+# olaylar sıra numarasıyla iş günlüğüne yazılır ve SSE ile canlı yayınlanır.
+# ─────────────────────────────────────────────────────────────────────────────
+
+ACTIVE = ("queued", "running")
+MAX_EVENTS = 20000  # iş başına tutulan olay sınırı (en eskiler düşer)
+
+
+@dataclass
+class Job:
+    id: str
+    key: str
+    params: Dict[str, Any]
+    status: str = "queued"  # queued | running | done | error
+    phase: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    joined: int = 0  # bu işe katılan ek tetik sayısı
+    total: int = 0
+    stages: List[str] = field(default_factory=list)
+    progress: Dict[str, int] = field(default_factory=dict)  # aşama → biten dosya
+    files: Dict[str, int] = field(default_factory=lambda: {"done": 0, "skipped": 0})
+    stats: Dict[str, Any] = field(default_factory=dict)
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    trace: Optional[str] = None
+    events: List[Dict[str, Any]] = field(default_factory=list, repr=False)
+    dropped: int = 0  # günlükten düşen olay sayısı (seq = dropped + liste konumu)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    _finished: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    def __post_init__(self) -> None:
+        self._cond = threading.Condition(self._lock)
+
+    def _log(self, ev: Dict[str, Any]) -> None:
+        # _lock tutulurken çağrılır
+        self.events.append({"seq": self.dropped + len(self.events), "ts": time.time(), **ev})
+        if len(self.events) > MAX_EVENTS:
+            cut = len(self.events) - MAX_EVENTS
+            del self.events[:cut]
+            self.dropped += cut
+        self._cond.notify_all()
+
+    def events_since(self, seq: int, timeout: float = 15.0) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        seq ve sonrasındaki olayları döner; yoksa timeout kadar bekler.
+        Dönüş: (olaylar, iş_bitti_mi)
+        """
+        with self._cond:
+            if self.dropped + len(self.events) <= seq and not self._finished.is_set():
+                self._cond.wait(timeout)
+            start = max(0, seq - self.dropped)
+            return list(self.events[start:]), self._finished.is_set()
+
+    def handle_event(self, ev: Dict[str, Any]) -> None:
+        with self._lock:
+            self._log(ev)
+            kind = ev.get("event")
+            if kind == "phase":
+                self.phase = ev.get("phase")
+                if self.phase == "pipeline":
+                    self.total = int(ev.get("total") or 0)
+                    self.stages = list(ev.get("stages") or [])
+                    self.progress = {name: 0 for name in self.stages}
+                    self.stats.update({k: ev[k] for k in ("found", "unchanged") if k in ev})
+            elif kind == "stage":
+                name = ev.get("stage")
+                self.progress[name] = self.progress.get(name, 0) + 1
+            elif kind == "file":
+                status = "skipped" if ev.get("status") == "skipped" else "done"
+                self.files[status] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "status": self.status,
+                "phase": self.phase,
+                "params": dict(self.params),
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "joined": self.joined,
+                "progress": {
+                    "total": self.total,
+                    "stages": {name: {"done": n, "total": self.total} for name, n in self.progress.items()},
+                    "files": dict(self.files),
+                },
+                "stats": (self.result or {}).get("stats") or dict(self.stats),
+                "result": self.result,
+                "error": self.error,
+                "trace": self.trace,
+            }
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._finished.wait(timeout)
+
+
+class JobManager:
+    def __init__(self, runner: Callable[..., Dict[str, Any]], max_workers: int = 1, keep: int = 50):
+        # runner(limit=..., force=..., on_event=...) → process_once ile aynı imza
+        self.runner = runner
+        self.keep = max(1, keep)
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._active: Dict[str, Job] = {}
+        self._pending: Dict[str, List[Job]] = {}  # anahtar → sırada bekleyen işler
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="job")
+
+    def submit(self, key: str, trailing: bool = False, **params: Any) -> Tuple[Job, bool]:
+        """
+        key: sıralama anahtarı (kaynak klasör). params: runner'a aynen geçer.
+        Dönüş: (iş, yeni_mi).
+        - Aktif iş yoksa hemen başlar.
+        - Aktif iş aynı params ile çalışıyorsa ona katılır (trailing değilse).
+        - Aksi halde sıradaki aynı params'lı işe katılır; yoksa sıraya yeni iş eklenir.
+        trailing=True → aktif iş aynı params'lı olsa bile bittikten sonra bir koşu daha
+        yapılır (aktif koşunun listelemesinden sonra gelen değişiklikler kaçmasın).
+        """
+        params = dict(params)
+        with self._lock:
+            active = self._active.get(key)
+            if active is None or active.status not in ACTIVE:
+                job = self._new_job(key, params)
+                self._active[key] = job
+                start = True
+            else:
+                start = False
+                if not trailing and active.params == params:
+                    job = active
+                else:
+                    queue = self._pending.setdefault(key, [])
+                    job = next((j for j in queue if j.params == params), None)
+                    if job is None:
+                        job = self._new_job(key, params)
+                        queue.append(job)
+                        return job, True
+                with job._lock:
+                    job.joined += 1
+                return job, False
+        if start:
+            self._executor.submit(self._run, job)
+        return job, True
+
+    def _new_job(self, key: str, params: Dict[str, Any]) -> Job:
+        # _lock tutulurken çağrılır
+        job = Job(id=uuid.uuid4().hex, key=key, params=params)
+        self._jobs[job.id] = job
+        self._trim()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def recent(self) -> List[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def _trim(self) -> None:
+        # yalnızca bitmiş işler atılır, en eskiden başlayarak
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= self.keep:
+                break
+            if self._jobs[job_id].status not in ACTIVE:
+                del self._jobs[job_id]
+
+    def _run(self, job: Job) -> None:
+        with job._lock:
+            job.status = "running"
+            job.started_at = time.time()
+        try:
+            result = self.runner(on_event=job.handle_event, **job.params)
+            with job._lock:
+                job.result = result
+                job.status = "done"
+        except Exception as e:
+            with job._lock:
+                job.error = str(e)
+                job.trace = traceback.format_exc()[:6000]
+                job.status = "error"
+        finally:
+            with self._lock:
+                nxt = None
+                if self._active.get(job.key) is job:
+                    del self._active[job.key]
+                    queue = self._pending.get(job.key)
+                    if queue:
+                        nxt = queue.pop(0)
+                        self._active[job.key] = nxt
+                    if not queue:
+                        self._pending.pop(job.key, None)
+            with job._lock:
+                job.finished_at = time.time()
+                job._finished.set()
+                job._log({"event": "end", "status": job.status, "error": job.error})
+            if nxt is not None:
+                self._executor.submit(self._run, nxt)
@@ -0,0 +1,83 @@
+# src/ledger.py
+from __future__ import annotations
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+# ─────────────────────────────────────────────────────────────────────────────
+# İşlenmiş dosya defteri
+# Drive file id + (md5Checksum | modifiedTime) ile anahtarlanır; aynı sürüm
+# bir daha indirilmez / OCR'lanmaz / puanlanmaz.
+# ─────────────────────────────────────────────────────────────────────────────
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed (
+    file_id      TEXT PRIMARY KEY,
+    fingerprint  TEXT NOT NULL,
+    name         TEXT,
+    status       TEXT NOT NULL,
+    total        INTEGER,
+    processed_at TEXT NOT NULL
+)
+"""
+
+
+def file_fingerprint(file_obj: Dict) -> str:
+    """
+    Dosya sürümünü temsil eden değer. Google Docs dosyalarında md5Checksum
+    olmadığı için modifiedTime'a düşer.
+    """
+    md5 = file_obj.get("md5Checksum")
+    if md5:
+        return f"md5:{md5}"
+    mtime = file_obj.get("modifiedTime")
+    if mtime:
+        return f"mtime:{mtime}"
+    return ""
+
+
+class ProcessedLedger:
+    def __init__(self, db_path: str):
+        p = Path(db_path)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        self.path = str(p)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(_SCHEMA)
+            self._conn.commit()
+
+    @classmethod
+    def for_output_dir(cls, out_dir: Path, ledger_path: Optional[str] = None) -> "ProcessedLedger":
+        return cls(ledger_path or str(Path(out_dir) / "ledger.sqlite3"))
+
+    def is_processed(self, file_obj: Dict) -> bool:
+        fp = file_fingerprint(file_obj)
+        if not fp:
+            # Sürüm bilgisi yoksa güvenli tarafta kal: yeniden işle
+            return False
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fingerprint FROM processed WHERE file_id = ?", (file_obj["id"],)
+            ).fetchone()
+        return bool(row and row[0] == fp)
+
+    def mark_processed(self, file_obj: Dict, status: str = "evaluated", total: Optional[int] = None) -> None:
+        fp = file_fingerprint(file_obj)
+        if not fp:
+            return
+        now = datetime.now().isoformat(timespec="seconds")
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO processed (file_id, fingerprint, name, status, total, processed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (file_obj["id"], fp, file_obj.get("name"), status, total, now),
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -1,19 +1,40 @@
 from __future__ import annotations
+import hashlib
 import os
+import re
 import mimetypes
+import threading
+from functools import partial
 from pathlib import Path
 from tqdm import tqdm
 from datetime import datetime
+from typing import Callable
 
 from .config import settings
-from .drive_client import DriveClient
-from .utils import read_file_to_text, normalize_download_filename, parse_student_meta
-from .evaluator import evaluate_text
-from .reporter import create_report_excel
+from .drive_client import DriveClient, GOOGLE_DOC_MIMES
+from .utils import (
+    read_file_to_text, read_buffer_to_text, normalize_download_filename, parse_student_meta,
+    EXTRACTOR_VERSION, BUFFERABLE_EXTS,
+)
+from .eval_engine import evaluate_text_pooled
+from .evaluator import get_client
+from .batch_eval import BatchEvaluator, BatchPending
+from .reporter import OrderedRows, ReportWriter, create_report_excel
 from .reporter_plagiarism import create_plagiarism_excel  # 🔹 eklendi
+from .ledger import ProcessedLedger
+from .grading_cache import GradingCache, cache_key
+from .text_cache import TextCache
+from .change_feed import ChangeCheckpoint, list_incremental
+from .pipeline import Stage, SkipItem, run_pipeline
+from .drive_watch import RollingReport
+from .run_text_store import RunTextStore
+from .tokens import TokenBudgetExceeded, UsageMeter
+from .resilience import ProviderUnavailable, get_breaker
 
 try:
-    from .similarity_checker import find_similar
+    from .similarity_checker import find_similar, jaccard_floor
+    from .plagiarism_index import PlagiarismIndex, check_history
+    from .winnowing import attach_passages
 except Exception:
     find_similar = None
 
@@ -41,141 +62,572 @@ def word_count_of(text: str) -> int:
     return len([w for w in (text or "").split() if w.strip()])
 
 
-def process_once(limit: int | None = None) -> dict:
-    drive = DriveClient.from_env(
+# ─────────────────────────────────────────────────────────────────────────────
+# İş hattı aşamaları (pipeline.Stage fn'leri; ctx dict alır, ctx döner)
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _drive() -> DriveClient:
+    # Süreç genelinde paylaşılan, thread-safe istemci (her thread kendi HTTP bağlantısını kullanır)
+    return DriveClient.shared(
         service_account_json=settings.service_account_json,
         oauth_client_secret_json=settings.oauth_client_secret_json,
         oauth_token_json=settings.oauth_token_json,
     )
 
-    files = drive.list_files_in_folder(settings.drive_source_folder_id)
-    stats = {"found": len(files), "allowed": 0, "downloaded": 0, "extracted": 0, "evaluated": 0, "skipped": []}
-    if limit:
-        files = files[:limit]
 
-    processed_rows = []
-    out_dir = Path(settings.local_output_dir or "outputs")
-    out_dir.mkdir(parents=True, exist_ok=True)
+def _download_stage(ctx: dict, text_cache: TextCache | None = None) -> dict:
+    f = ctx["file"]
+    norm_name = normalize_download_filename(f["name"], f.get("mimeType", ""))
+    ctx["norm_name"] = norm_name
+    # Aynı sürümün metni zaten çıkarılmışsa indirme ve OCR yok
+    hit = text_cache.get(f, ctx["ocr_lang"], EXTRACTOR_VERSION) if text_cache is not None else None
+    if hit is not None:
+        ctx["norm_name"] = hit["norm_name"] or norm_name
+        ctx["local_path"] = str(Path(ctx["out_dir"]) / ctx["norm_name"])
+        ctx["text"] = hit["text"]
+        ctx["text_cached"] = True
+        return ctx
+
+    def progress(_label: str, got: int, _total, rate: float) -> None:
+        ctx["download"] = {"bytes": got, "bytes_per_sec": round(rate)}
+
+    drive = _drive()
+    dest = str(Path(ctx["out_dir"]) / norm_name)
+    if _bufferable(f, dest):
+        # Küçük TXT/DOCX: diske dokunmadan bellekte oku
+        buf = drive.download_to_buffer(f, progress=progress)
+        ctx["local_path"] = _export_path(f, dest)
+        ctx["raw_text"] = read_buffer_to_text(buf, ctx["local_path"], f.get("mimeType", ""))
+        return ctx
+    ctx["local_path"] = drive.download_any(f, dest, progress=progress)
+    return ctx
+
+
+def _export_path(f: dict, dest: str) -> str:
+    # Google Docs export'unda dosya adı export uzantısını alır
+    mime = f.get("mimeType", "")
+    if mime in GOOGLE_DOC_MIMES:
+        ext = GOOGLE_DOC_MIMES[mime][1]
+        if not dest.lower().endswith(ext):
+            return str(Path(dest).with_suffix(ext))
+    return dest
+
+
+def _bufferable(f: dict, dest: str) -> bool:
+    limit = settings.inmemory_max_bytes
+    if limit <= 0:
+        return False
+    if Path(_export_path(f, dest)).suffix.lower() not in BUFFERABLE_EXTS:
+        return False
+    size = f.get("size")
+    # Google Docs export'larında size yok; metin belgeleri pratikte küçüktür
+    return (int(size) <= limit) if size else f.get("mimeType", "") in GOOGLE_DOC_MIMES
+
+
+def _extract_stage(ctx: dict) -> dict:
+    if ctx.get("text_cached"):
+        return ctx
+    if "raw_text" in ctx and ctx["raw_text"] is not None:
+        text_raw = ctx.pop("raw_text")
+    else:
+        # taralı PDF sayfaları extractor'ın ortak OCR süreç havuzunda okunur
+        info: dict = {}
+        text_raw = read_file_to_text(ctx["local_path"], ocr_lang=ctx["ocr_lang"],
+                                     mime_type=ctx["file"].get("mimeType", ""), info=info)
+        if info:
+            ctx["extract_info"] = info
+    clean_text = (text_raw or "").replace("\x0c", " ").strip()
+    if not clean_text or len(clean_text.split()) < 3:
+        # aynı sürüm bir daha okunamayacak; tekrar indirmeye gerek yok
+        raise SkipItem("empty or unreadable text", status="unreadable")
+    ctx["text"] = clean_text
+    return ctx
+
+
+def _evaluate_stage(ctx: dict, cache: GradingCache | None = None, meter: UsageMeter | None = None) -> dict:
+    # Paylaşılan async motor: ortak bağlantı havuzu + RPM/TPM limiter
+    compute = lambda: evaluate_text_pooled(ctx["text"], Path(ctx["local_path"]).name, meter)
+    try:
+        if cache is not None:
+            ctx["result"] = cache.get_or_compute(ctx["text"], settings.openai_model, compute)
+        else:
+            ctx["result"] = compute()
+    except (TokenBudgetExceeded, ProviderUnavailable) as e:
+        # deftere yazılmaz → dosya sonraki koşuda yeniden denenir
+        raise SkipItem(str(e), status=None)
+    return ctx
+
+
+def _evaluate_in_batch(results: list, out_dir: Path, cache: GradingCache | None = None,
+                       meter: UsageMeter | None = None) -> None:
+    """
+    EVAL_MODE=batch: çıkarılmış metinleri OpenAI Batch API ile toplu puanlar.
+    Bitmeyen istekler "pending" olarak atlanır; durum dosyası sayesinde sonraki /run devam eder.
+    """
+    todo = []
+    for ctx in results:
+        if ctx.get("skip"):
+            continue
+        hit = cache.get(cache_key(ctx["text"], settings.openai_model)) if cache is not None else None
+        if hit is not None:
+            ctx["result"] = hit
+            ctx["reached"].append("evaluate")
+        else:
+            todo.append(ctx)
+    if not todo:
+        return
+
+    batch = BatchEvaluator(
+        get_client(settings.openai_api_key),
+        state_path=str(out_dir / "batch_state.json"),
+        model=settings.openai_model,
+        poll_interval=settings.batch_poll_seconds,
+        max_wait=settings.batch_max_wait_minutes * 60.0,
+        max_attempts=settings.batch_max_attempts,
+    )
+    items = [(i, ctx["text"], Path(ctx["local_path"]).name) for i, ctx in enumerate(todo)]
+    out = batch.evaluate_all(items, meter)
+
+    finished = []
+    for (i, _, _), ctx in zip(items, todo):
+        val = out[i]
+        if isinstance(val, (BatchPending, TokenBudgetExceeded)):
+            ctx["skip"] = {"reason": f"evaluate pending: {val}", "status": None, "stage": "evaluate"}
+            continue
+        finished.append(items[i])
+        if isinstance(val, Exception):
+            ctx["skip"] = {"reason": f"evaluate error: {val}", "status": None, "stage": "evaluate"}
+            continue
+        ctx["result"] = val
+        ctx["reached"].append("evaluate")
+        if cache is not None:
+            cache.put(cache_key(ctx["text"], settings.openai_model), val)
+    batch.forget(finished)
+
+
+def _build_row(ctx: dict) -> dict:
+    clean_text = ctx["text"]
+    res = ctx["result"]
+
+    # 🧠 Ad-soyad-sınıf bilgisi: dosya adında yoksa metinden bulmaya çalış
+    first_name, last_name, cls, student_full = parse_student_meta(ctx["norm_name"], clean_text)
+    if not student_full and clean_text:
+        m = re.search(r"(?i)\b([A-ZÇĞİÖŞÜ][a-zçğıöşü]+)\s+([A-ZÇĞİÖŞÜ][a-zçğıöşü]+)\b", clean_text[:200])
+        if m:
+            first_name, last_name = m.group(1), m.group(2)
+            student_full = f"{first_name} {last_name}"
+
+    bd = res.get("breakdown") or {}
+    # puanın metnin tamamını kapsamadığı durumlar rapora yazılır
+    notes = []
+    info = ctx.get("extract_info") or {}
+    if info.get("ocr_truncated"):
+        notes.append(f"OCR: only the first {info['ocr_pages']} of {info['ocr_pages_total']} pages were read")
+    if res.get("chunks_dropped"):
+        graded_parts = res.get("chunks") or 0
+        notes.append(f"graded the first {graded_parts} of {graded_parts + res['chunks_dropped']} parts (EVAL_MAX_CHUNKS)")
+    return {
+        "first_name": first_name,
+        "last_name": last_name,
+        "class": cls,
+        "student": student_full,
+        "file_name": Path(ctx["local_path"]).name,
+        "file_id": ctx["file"]["id"],
+        "word_count": word_count_of(clean_text),
+        "total": res.get("total"),
+        "content": bd.get("content"),
+        "structure": bd.get("structure"),
+        "language": bd.get("language"),
+        "originality": bd.get("originality"),
+        "feedback": res.get("feedback"),
+        "breakdown": bd,
+        "notes": "; ".join(notes),
+        "text": clean_text,
+    }
 
-    for f in tqdm(files, desc="Processing files"):
-        fid = f["id"]
-        fname = f["name"]
-        mime = f.get("mimeType", "")
 
-        if not is_allowed(fname, mime):
-            stats["skipped"].append({"name": fname, "reason": f"not allowed ({mime})"})
-            continue
-        stats["allowed"] += 1
+def _staging_path(out_dir: Path, base_name: str) -> Path:
+    # Nihai ad Drive'da sahiplenilene kadar yerel dosya geçici adla yazılır
+    return out_dir / f".{Path(base_name).stem}.{os.getpid()}.{threading.get_ident()}{Path(base_name).suffix}"
 
-        norm_name = normalize_download_filename(fname, mime)
-        local_path = str(out_dir / norm_name)
 
-        try:
-            local_path = drive.download_any(f, local_path)
-            stats["downloaded"] += 1
-        except Exception as e:
-            stats["skipped"].append({"name": fname, "reason": f"download error: {e}"})
-            continue
+def _upload_unique(drive: DriveClient, tmp_path: Path, base_name: str, mime_type: str) -> tuple[Path, dict]:
+    """
+    Raporu klasördeki ilk boş adla yükler (tek sorgu + atomik sahiplenme) ve
+    yerel kopyayı aynı ada taşır.
+    """
+    uploaded = drive.upload_file_unique(
+        file_path=str(tmp_path),
+        base_name=base_name,
+        mime_type=mime_type,
+        parent_folder_id=settings.drive_reports_folder_id,
+    )
+    final_path = tmp_path.with_name(uploaded.get("name") or base_name)
+    tmp_path.replace(final_path)
+    return final_path, uploaded
+
+
+def _publish_rolling(drive: DriveClient, out_dir: Path, rows: list, mime_type: str) -> tuple[Path, dict]:
+    """
+    Kayan rapor (push bildirimli koşular): yeni satırlar öncekilerle birleştirilir ve
+    aynı Drive dosyası yerinde güncellenir; dosya yoksa/silindiyse yeniden yüklenir.
+    """
+    store = RollingReport(
+        str(out_dir / "rolling_report.json"), settings.rolling_report_days, settings.rolling_report_max_rows,
+    )
+    all_rows = store.merge(rows)
+    base_name = f"{settings.report_prefix}_rolling.xlsx"
+    tmp_path = _staging_path(out_dir, base_name)
+    create_report_excel(str(tmp_path), all_rows)
 
+    uploaded = None
+    if store.state.get("drive_file_id"):
         try:
-            text_raw = read_file_to_text(local_path, ocr_lang=settings.ocr_lang or "rus+kaz+tur+eng", mime_type=mime)
+            uploaded = drive.update_file_content(store.state["drive_file_id"], str(tmp_path), mime_type)
         except Exception as e:
-            stats["skipped"].append({"name": fname, "reason": f"extract error: {e}"})
-            continue
+            print(f"[warn] rolling report update failed, uploading a new one: {e}")
+    if uploaded is None:
+        uploaded = drive.upload_file_unique(str(tmp_path), base_name, mime_type, settings.drive_reports_folder_id)
+        store.state["drive_file_id"] = uploaded.get("id")
+    final_path = out_dir / base_name
+    tmp_path.replace(final_path)
+    store.save()
+    return final_path, uploaded
+
+
+def _own_output(name: str) -> bool:
+    # uygulamanın kendi yüklediği raporlar (kaynak klasörle aynı klasöre yüklenmiş olabilir)
+    return name.startswith((f"{settings.report_prefix}_", "plagiarism_"))
+
+
+def pending_changes() -> int:
+    """
+    Push bildirimi sonrası koşu açmadan önce bakılır: kaynak klasörde puanlanacak
+    yeni/değişmiş dosya sayısı. Drive bildirimi tüm Drive için gelir (kendi rapor ve
+    intihal yüklemelerimiz dahil); kaynak klasör dışındaki, izinli türde olmayan,
+    bizim yazdığımız ya da bu sürümü zaten işlenmiş dosyalar sayılmaz.
+    Hiçbiri yoksa akış token'ı ilerletilir → sonraki bakış yalnızca yeni değişiklikleri okur.
+    """
+    drive = _drive()
+    out_dir = Path(settings.local_output_dir or "outputs")
+    checkpoint = ChangeCheckpoint(out_dir / "drive_changes.json")
+    if not checkpoint.load(settings.drive_source_folder_id):
+        return 1  # ilk koşu: tam listeleme gerekir
+    files, next_token = list_incremental(drive, settings.drive_source_folder_id, checkpoint)
+    files = [f for f in files if is_allowed(f["name"], f.get("mimeType", "")) and not _own_output(f["name"])]
+    if files:
+        ledger = ProcessedLedger.for_output_dir(out_dir, settings.ledger_path)
+        try:
+            files = [f for f in files if not ledger.is_processed(f)]
+        finally:
+            ledger.close()
+    if not files and next_token:
+        checkpoint.save(settings.drive_source_folder_id, next_token)
+    return len(files)
+
+
+def process_once(
+    limit: int | None = None,
+    force: bool | None = None,
+    on_event: Callable[[dict], None] | None = None,
+    listing: str | None = None,
+    rolling: bool = False,
+) -> dict:
+    """
+    Kaynak klasördeki yeni/değişmiş dosyaları işler.
+    force=True → defter yok sayılır, her dosya yeniden puanlanır.
+    on_event: ilerleme olayları ({"event": "phase" | "stage" | "file", ...}); bkz. src/jobs.py
+    listing: "full" | "changes" (None = DRIVE_LISTING_MODE)
+    rolling=True → günlük rapor yerine kayan rapor güncellenir (push bildirimli koşular)
+    """
+    # SQLite bağlantıları, metin deposu ve rapor taslağı koşu nasıl biterse bitsin kapatılır
+    # (uzun ömürlü sunucuda push koşuları tutamaç biriktirmesin)
+    cleanup: list = []
+    try:
+        return _process_once(limit, force, on_event, listing, rolling, cleanup)
+    finally:
+        for close in reversed(cleanup):
+            try:
+                close()
+            except Exception as e:
+                print(f"[warn] cleanup failed: {e}")
+
+
+def _process_once(
+    limit: int | None,
+    force: bool | None,
+    on_event: Callable[[dict], None] | None,
+    listing: str | None,
+    rolling: bool,
+    cleanup: list,
+) -> dict:
+    # cleanup: açılan her kaynağın kapatıcısı eklenir; process_once sırayla tersten çağırır
+    if force is None:
+        force = settings.force_reprocess
+
+    def emit(event: str, **data) -> None:
+        if on_event is not None:
+            try:
+                on_event({"event": event, **data})
+            except Exception as e:
+                print(f"[warn] progress callback failed: {e}")
+
+    emit("phase", phase="listing")
+
+    drive = _drive()
 
-        clean_text = (text_raw or "").replace("\x0c", " ").strip()
-        if not clean_text or len(clean_text.split()) < 3:
-            stats["skipped"].append({"name": fname, "reason": "empty or unreadable text"})
-            continue
-        stats["extracted"] += 1
+    out_dir = Path(settings.local_output_dir or "outputs")
+    out_dir.mkdir(parents=True, exist_ok=True)
 
+    # 🔁 Artımlı modda yalnızca son checkpoint'ten beri değişenler listelenir (force = tam liste)
+    checkpoint = None
+    next_token = None
+    if (listing or settings.drive_listing_mode) == "changes" and not force:
+        checkpoint = ChangeCheckpoint(out_dir / "drive_changes.json")
+        files, next_token = list_incremental(drive, settings.drive_source_folder_id, checkpoint)
+    else:
+        files = drive.list_files_in_folder(settings.drive_source_folder_id)
+    stats = {"found": len(files), "unchanged": 0, "allowed": 0, "downloaded": 0, "extracted": 0, "evaluated": 0,
+             "cache_hits": 0, "cache_misses": 0, "cache_deduped": 0, "text_cache_hits": 0, "skipped": [],
+             "ocr": {"documents": 0, "pages": 0, "peak_rss_mb": None, "truncated": []}, "chunks_truncated": [],
+             "download": {"files": 0, "bytes": 0, "seconds": 0.0, "bytes_per_sec": 0}}
+
+    # 📒 Daha önce aynı sürümü işlenmiş dosyaları atla (limit yeni işlere uygulanır)
+    ledger = ProcessedLedger.for_output_dir(out_dir, settings.ledger_path)
+    cleanup.append(ledger.close)
+    if not force:
+        fresh = [f for f in files if not ledger.is_processed(f)]
+        stats["unchanged"] = len(files) - len(fresh)
+        files = fresh
+    # Token yalnızca akıştaki her dosya kalıcı bir sonuca ulaştıysa ilerletilir
+    settled = not (limit and len(files) > limit)
+    if limit:
+        files = files[:limit]
+
+    def _commit_feed() -> None:
+        if checkpoint is not None and next_token and settled:
+            checkpoint.save(settings.drive_source_folder_id, next_token)
+
+    cache = None
+    if settings.grade_cache_max_mb > 0:
+        cache = GradingCache.for_output_dir(out_dir, settings.grade_cache_max_mb, settings.grade_cache_max_age_days)
+        cleanup.append(cache.close)
+
+    text_cache = TextCache.for_output_dir(out_dir, settings.text_cache_max_mb) if settings.text_cache_max_mb > 0 else None
+    if text_cache is not None:
+        cleanup.append(text_cache.close)
+
+    def _on_stage(_idx: int, stage: str, ctx: dict) -> None:
+        emit("stage", stage=stage, file_id=ctx["file"]["id"], file_name=ctx["file"]["name"],
+             seconds=ctx.get("timings", {}).get(stage))
+
+    def _file_event(ctx: dict) -> None:
+        # dosya başına son olay: süreler + puan (atlandıysa neden)
+        skip = ctx.get("skip")
+        emit("file", status="skipped" if skip else "done", file_id=ctx["file"]["id"],
+             file_name=ctx["file"]["name"], reason=skip["reason"] if skip else None,
+             stage=skip["stage"] if skip else None, timings=dict(ctx.get("timings", {})),
+             total=None if skip else (ctx.get("result") or {}).get("total"),
+             cached=bool(ctx.get("text_cached")), ocr=ctx.get("extract_info"), download=ctx.get("download"))
+
+    # 📄 Rapor satırları dosya bittikçe yazılır; yeniden sıralama tamponu klasör sırasını korur
+    today = datetime.now().strftime("%Y-%m-%d")
+    base_name = f"{settings.report_prefix}_{today}.xlsx"
+    mime_type = mimetypes.guess_type(base_name)[0] or \
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    report_tmp = _staging_path(out_dir, base_name)
+    # yükleme sonrası taslak nihai ada taşınmış olur; yarıda kalan koşuda silinir
+    cleanup.append(partial(report_tmp.unlink, missing_ok=True))
+    rolling_rows: list = []
+    writer = None if rolling else ReportWriter(str(report_tmp))
+    if writer is not None:
+        cleanup.append(writer.close)
+    report_rows = OrderedRows(rolling_rows.append if rolling else writer.append)
+    # kopya kontrolü metinleri diskte (mmap); satırlar yalnızca tutamaç taşır
+    texts = RunTextStore(str(out_dir))
+    cleanup.append(texts.close)
+
+    def _finish_row(idx: int, ctx: dict) -> None:
+        if ctx.get("skip"):
+            report_rows.put(idx, None)
+            return
         try:
-            res = evaluate_text(settings.openai_api_key, clean_text, Path(local_path).name)
-            stats["evaluated"] += 1
+            row = _build_row(ctx)
+            text = row.pop("text")
+            # tam metin koşu sonuna kadar bellekte tutulmaz; kopya kontrolü depodan okur
+            ctx["lite"] = {"file_id": row["file_id"], "file_name": row["file_name"],
+                           "student": row["student"], "text": texts.append(text[:6000]),
+                           "md5": hashlib.md5(text.encode("utf-8")).hexdigest()}
         except Exception as e:
-            stats["skipped"].append({"name": fname, "reason": f"evaluate error: {e}"})
+            ctx["skip"] = {"reason": f"report error: {e}", "status": None, "stage": "report"}
+            report_rows.put(idx, None)
+            return
+        ctx.pop("text", None)
+        report_rows.put(idx, row)
+
+    def _on_done(idx: int, ctx: dict) -> None:
+        # satır her durumda sıralama tamponuna girmeli; yoksa sonraki satırlar hiç yazılmaz
+        try:
+            pbar.update(1)
+            # batch modunda puan iş hattından sonra gelir → olay _evaluate_in_batch sonrası
+            if not batch_mode or ctx.get("skip"):
+                _file_event(ctx)
+            if text_cache is not None and ctx.get("text") and not ctx.get("text_cached"):
+                try:
+                    text_cache.put(ctx["file"], ctx["text"], ctx["ocr_lang"], EXTRACTOR_VERSION,
+                                   ctx.get("norm_name", ""))
+                except Exception as e:
+                    print(f"[warn] text cache write failed for {ctx['file']['name']}: {e}")
+        finally:
+            if not batch_mode:
+                _finish_row(idx, ctx)
+
+    allowed = [f for f in files if is_allowed(f["name"], f.get("mimeType", ""))]
+    batch_mode = settings.eval_mode == "batch"
+    # token/gecikme sayacı + isteğe bağlı koşu bütçesi
+    meter = UsageMeter(settings.run_token_budget)
+    stages = [
+        Stage("download", partial(_download_stage, text_cache=text_cache), workers=settings.pipeline_download_workers),
+        Stage("extract", _extract_stage, workers=settings.pipeline_extract_workers),
+    ]
+    if not batch_mode:
+        # paketleme açıksa bir paketi dolduracak kadar teslim aynı anda beklemeli
+        eval_workers = settings.pipeline_evaluate_workers
+        if settings.eval_pack_tokens > 0:
+            eval_workers = max(eval_workers, settings.eval_pack_max_items)
+        stages.append(Stage("evaluate", partial(_evaluate_stage, cache=cache, meter=meter), workers=eval_workers))
+    items = [
+        {"file": f, "out_dir": str(out_dir), "ocr_lang": settings.ocr_lang or "rus+kaz+tur+eng"}
+        for f in allowed
+    ]
+    emit("phase", phase="pipeline", total=len(items), stages=[st.name for st in stages],
+         found=stats["found"], unchanged=stats["unchanged"])
+    with tqdm(total=len(items), desc="Processing files") as pbar:
+        results = run_pipeline(items, stages, queue_size=settings.pipeline_queue_size,
+                               on_done=_on_done, on_stage=_on_stage)
+    if batch_mode:
+        emit("phase", phase="batch")
+        reported = {ctx["file"]["id"] for ctx in results if ctx.get("skip")}
+        _evaluate_in_batch(results, out_dir, cache, meter)
+        for idx, ctx in enumerate(results):
+            if ctx["file"]["id"] not in reported:
+                _file_event(ctx)
+            _finish_row(idx, ctx)
+    by_id = {ctx["file"]["id"]: ctx for ctx in results}
+    if text_cache is not None:
+        stats["text_cache_hits"] = text_cache.hits
+        text_cache.evict()
+    if cache is not None:
+        stats["cache_hits"], stats["cache_misses"] = cache.hits, cache.misses
+        stats["cache_deduped"] = cache.deduped
+        cache.evict()
+    stats["tokens"] = meter.stats()
+    stats["provider"] = get_breaker().status()
+
+    # Sonuçları klasör sırasıyla topla → stats deterministik
+    graded = []
+    lite = []
+    for f in files:
+        fname = f["name"]
+        mime = f.get("mimeType", "")
+        ctx = by_id.get(f["id"])
+        if ctx is None:
+            stats["skipped"].append({"name": fname, "reason": f"not allowed ({mime})"})
+            continue
+        stats["allowed"] += 1
+        reached = ctx.get("reached", [])
+        stats["downloaded"] += int("download" in reached)
+        stats["extracted"] += int("extract" in reached)
+        stats["evaluated"] += int("evaluate" in reached)
+        dl = ctx.get("download")
+        if dl and dl.get("bytes_per_sec"):
+            stats["download"]["files"] += 1
+            stats["download"]["bytes"] += dl["bytes"]
+            stats["download"]["seconds"] += dl["bytes"] / dl["bytes_per_sec"]
+        info = ctx.get("extract_info")
+        if info:
+            ocr = stats["ocr"]
+            ocr["documents"] += 1
+            ocr["pages"] += info.get("ocr_pages", 0)
+            if info.get("ocr_peak_rss_mb") is not None:
+                ocr["peak_rss_mb"] = max(ocr["peak_rss_mb"] or 0, info["ocr_peak_rss_mb"])
+            if info.get("ocr_truncated"):
+                ocr["truncated"].append({"name": fname, "pages": info["ocr_pages"],
+                                         "pages_total": info["ocr_pages_total"]})
+
+        skip = ctx.get("skip")
+        if skip:
+            stats["skipped"].append({"name": fname, "reason": skip["reason"]})
+            if skip.get("status"):
+                ledger.mark_processed(f, status=skip["status"])
+            else:
+                settled = False  # geçici hata → sonraki koşuda aynı değişiklik tekrar görülsün
             continue
 
-        # 🧠 Ad-soyad-sınıf bilgisi: dosya adında yoksa metinden bulmaya çalış
-        first_name, last_name, cls, student_full = parse_student_meta(norm_name, clean_text)
-        if not student_full and clean_text:
-            import re
-            m = re.search(r"(?i)\b([A-ZÇĞİÖŞÜ][a-zçğıöşü]+)\s+([A-ZÇĞİÖŞÜ][a-zçğıöşü]+)\b", clean_text[:200])
-            if m:
-                first_name, last_name = m.group(1), m.group(2)
-                student_full = f"{first_name} {last_name}"
-
-        bd = res.get("breakdown") or {}
-
-        processed_rows.append({
-            "first_name": first_name,
-            "last_name": last_name,
-            "class": cls,
-            "student": student_full,
-            "file_name": Path(local_path).name,
-            "file_id": fid,
-            "word_count": word_count_of(clean_text),
-            "total": res.get("total"),
-            "content": bd.get("content"),
-            "structure": bd.get("structure"),
-            "language": bd.get("language"),
-            "originality": bd.get("originality"),
-            "feedback": res.get("feedback"),
-            "breakdown": bd,
-            "text": clean_text,
-        })
-
-    if not processed_rows:
+        lite.append(ctx["lite"])
+        graded.append((f, ctx["result"].get("total")))
+        if ctx["result"].get("chunks_dropped"):
+            stats["chunks_truncated"].append({"name": fname, "chunks": ctx["result"].get("chunks"),
+                                              "dropped": ctx["result"]["chunks_dropped"]})
+
+    dls = stats["download"]
+    if dls["seconds"]:
+        dls["bytes_per_sec"] = round(dls["bytes"] / dls["seconds"])
+    dls["seconds"] = round(dls["seconds"], 2)
+
+    if writer is not None:
+        writer.close()
+    if not graded:
+        _commit_feed()
         return {"rows": 0, "local_report": None, "drive_report_link": None, "stats": stats}
 
-    today = datetime.now().strftime("%Y-%m-%d")
-    base_name = f"{settings.report_prefix}_{today}.xlsx"
-    unique_name = drive.unique_name_in_folder(base_name, settings.drive_reports_folder_id)
-
-    report_path = out_dir / unique_name
-    create_report_excel(str(report_path), processed_rows)
-
-    mime_type = mimetypes.guess_type(str(report_path))[0] or \
-        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-
-    uploaded = drive.upload_file(
-        file_path=str(report_path),
-        name=unique_name,
-        mime_type=mime_type,
-        parent_folder_id=settings.drive_reports_folder_id,
-    )
+    emit("phase", phase="report", rows=report_rows.written)
+    if rolling:
+        report_path, uploaded = _publish_rolling(drive, out_dir, rolling_rows, mime_type)
+    else:
+        report_path, uploaded = _upload_unique(drive, report_tmp, base_name, mime_type)
     report_link = uploaded.get("webViewLink")
 
+    # Rapor Drive'a çıktıktan sonra deftere yaz; yarıda kalan koşu tekrar puanlanır
+    for f, total in graded:
+        ledger.mark_processed(f, status="evaluated", total=total)
+    _commit_feed()
+
     # 🔍 Kopya (plagiarism) kontrolü
     plag_link = None
     if find_similar:
-        lite = [
-            {
-                "file_name": r["file_name"],
-                "student": r["student"],
-                "text": r["text"][:6000],
-            }
-            for r in processed_rows
-        ]
+        emit("phase", phase="plagiarism")
         try:
-            pairs = find_similar(lite, threshold=80.0)
-            if pairs:
-                plag_name = drive.unique_name_in_folder(f"plagiarism_{today}.xlsx", settings.drive_reports_folder_id)
-                plag_path = out_dir / plag_name
-                create_plagiarism_excel(str(plag_path), pairs)
-
-                up2 = drive.upload_file(
-                    file_path=str(plag_path),
-                    name=plag_name,
-                    mime_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    parent_folder_id=settings.drive_reports_folder_id,
+            pairs = find_similar(
+                lite, threshold=80.0, method=settings.similarity_method,
+                partial=settings.similarity_partial_ratio,
+            )
+            if settings.plag_passages and pairs:
+                pairs = attach_passages(lite, pairs)
+            history, copies = [], []
+            if settings.plag_index_enabled:
+                # geçmiş koşularla karşılaştır: en eski kaynak "earlier_source" olarak raporlanır
+                index = PlagiarismIndex.for_output_dir(out_dir)
+                try:
+                    pairs, history, copies = check_history(index, lite, pairs, jaccard_floor(80.0))
+                    index.prune(settings.plag_index_retention_days, settings.plag_index_max_docs)
+                finally:
+                    index.close()
+            if pairs or history or copies:
+                plag_base = f"plagiarism_{today}.xlsx"
+                plag_tmp = _staging_path(out_dir, plag_base)
+                create_plagiarism_excel(str(plag_tmp), pairs, history, copies)
+
+                _, up2 = _upload_unique(
+                    drive, plag_tmp, plag_base,
+                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 )
                 plag_link = up2.get("webViewLink")
         except Exception as e:
             print(f"[warn] plagiarism check failed: {e}")
 
     return {
-        "rows": len(processed_rows),
+        "rows": len(graded),
         "local_report": str(report_path),
         "drive_report_link": report_link,
         "plagiarism_drive_link": plag_link,
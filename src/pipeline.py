@@ -0,0 +1,153 @@
+# src/pipeline.py
+from __future__ import annotations
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Aşamalı (staged) iş hattı
+# Her aşama kendi worker havuzuna ve sınırlı kuyruğuna sahiptir; böylece
+# indirme, OCR ve LLM gecikmeleri toplanmak yerine üst üste biner.
+# Sonuçlar girdi sırasıyla döner → rapor sırası ve stats deterministik kalır.
+# ─────────────────────────────────────────────────────────────────────────────
+
+Ctx = Dict[str, Any]
+
+
+class SkipItem(Exception):
+    """
+    Bir aşama öğeyi bilerek düşürmek istediğinde fırlatır.
+    status: işlenmiş dosya defterine yazılacak durum (None = yazma).
+    """
+
+    def __init__(self, reason: str, status: Optional[str] = None):
+        super().__init__(reason, status)
+        self.reason = reason
+        self.status = status
+
+
+@dataclass
+class Stage:
+    name: str
+    fn: Callable[[Ctx], Ctx]
+    workers: int = 1
+    # "thread" = I/O ağırlıklı, "process" = CPU ağırlıklı (fn ve ctx pickle edilebilir olmalı)
+    kind: str = "thread"
+
+
+_DONE = object()
+
+
+def run_pipeline(
+    items: List[Ctx],
+    stages: List[Stage],
+    queue_size: int = 8,
+    on_done: Optional[Callable[[int, Ctx], None]] = None,
+    on_stage: Optional[Callable[[int, str, Ctx], None]] = None,
+) -> List[Ctx]:
+    """
+    items: her öğe için başlangıç ctx'i
+    on_stage(idx, aşama, ctx): bir öğe bir aşamayı başarıyla bitirdiğinde (ilerleme için)
+    Dönüş: items ile aynı sırada son ctx'ler. Her ctx'e şunlar eklenir:
+      - "reached": başarıyla tamamlanan aşama adları
+      - "timings": aşama adı → saniye
+      - "skip": {"reason", "status", "stage"} (öğe düştüyse)
+    """
+    n = len(items)
+    results: List[Optional[Ctx]] = [None] * n
+    if n == 0:
+        return []
+
+    queues = [queue.Queue(maxsize=max(1, queue_size)) for _ in stages]
+    remaining = [n]
+    all_done = threading.Event()
+    lock = threading.Lock()
+
+    pools: List[Optional[ProcessPoolExecutor]] = []
+    for st in stages:
+        pool = None
+        if st.kind == "process" and st.workers > 0:
+            try:
+                # thread'ler çalışırken fork etmek kilitlenmeye yol açabilir → spawn
+                pool = ProcessPoolExecutor(max_workers=st.workers, mp_context=multiprocessing.get_context("spawn"))
+            except Exception:
+                pool = None  # süreç havuzu açılamıyorsa thread'de çalıştır
+        pools.append(pool)
+
+    def finish(idx: int, ctx: Ctx) -> None:
+        results[idx] = ctx
+        if on_done:
+            try:
+                on_done(idx, ctx)
+            except Exception as e:
+                # yarım kalan öğe "bitti" sayılmaz: atlandı olarak işaretlenir
+                name = (ctx.get("file") or {}).get("name", idx)
+                print(f"[warn] on_done failed for {name}: {e}")
+                ctx.setdefault("skip", {"reason": f"done error: {e}", "status": None, "stage": "done"})
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                all_done.set()
+
+    def worker(si: int) -> None:
+        st = stages[si]
+        pool = pools[si]
+        q = queues[si]
+        while True:
+            item = q.get()
+            if item is _DONE:
+                return
+            idx, ctx = item
+            t0 = time.perf_counter()
+            try:
+                if pool is not None:
+                    ctx = pool.submit(st.fn, ctx).result()
+                else:
+                    ctx = st.fn(ctx)
+                ctx.setdefault("reached", []).append(st.name)
+                ctx.setdefault("timings", {})[st.name] = round(time.perf_counter() - t0, 3)
+                if on_stage:
+                    try:
+                        on_stage(idx, st.name, ctx)
+                    except Exception:
+                        pass
+            except SkipItem as e:
+                ctx["skip"] = {"reason": e.reason, "status": e.status, "stage": st.name}
+                finish(idx, ctx)
+                continue
+            except Exception as e:
+                ctx["skip"] = {"reason": f"{st.name} error: {e}", "status": None, "stage": st.name}
+                finish(idx, ctx)
+                continue
+            if si + 1 < len(stages):
+                queues[si + 1].put((idx, ctx))
+            else:
+                finish(idx, ctx)
+
+    threads: List[threading.Thread] = []
+    for si, st in enumerate(stages):
+        for _ in range(max(1, st.workers)):
+            t = threading.Thread(target=worker, args=(si,), daemon=True, name=f"pipeline-{st.name}")
+            t.start()
+            threads.append(t)
+
+    try:
+        for idx, ctx in enumerate(items):
+            ctx.setdefault("reached", [])
+            queues[0].put((idx, ctx))
+        all_done.wait()
+    finally:
+        for si, st in enumerate(stages):
+            for _ in range(max(1, st.workers)):
+                queues[si].put(_DONE)
+        for t in threads:
+            t.join(timeout=5)
+        for pool in pools:
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+    return [r if r is not None else items[i] for i, r in enumerate(results)]
@@ -0,0 +1,227 @@
+# src/plagiarism_index.py
+from __future__ import annotations
+import sqlite3
+import threading
+import time
+from array import array
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .similarity_checker import NUM_PERM, band_keys, estimate_jaccard, signature_of, text_of
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Koşular arası kopya indeksi
+# Her puanlanan teslimin MinHash imzası ve LSH bant anahtarları SQLite'ta tutulur.
+# Yeni koşu yalnızca bant eşleşen eski teslimleri okur (alt-doğrusal sorgu) ve
+# tahmini jaccard'a göre "daha önceki kaynak"ı bulur. Öğrencinin kendi eski teslimi
+# (yeniden yükleme, klasör kopyası) kopya sayılmaz; metni birebir aynı (md5) olanlar
+# kopya yerine ayrı listelenir.
+# ─────────────────────────────────────────────────────────────────────────────
+
+# Sabit bant ayarı (32×4): indeks eşikten bağımsız, J ≈ 0.5 ve üstünü yüksek olasılıkla yakalar
+INDEX_BANDS = 32
+INDEX_ROWS = 4
+
+_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS docs (
+        doc_id    INTEGER PRIMARY KEY AUTOINCREMENT,
+        file_id   TEXT UNIQUE,
+        file_name TEXT,
+        student   TEXT,
+        added_at  REAL NOT NULL,
+        signature BLOB NOT NULL,
+        md5       TEXT
+    )
+    """,
+    "CREATE TABLE IF NOT EXISTS bands (band INTEGER NOT NULL, bucket INTEGER NOT NULL, doc_id INTEGER NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS bands_lookup ON bands(band, bucket)",
+    "CREATE INDEX IF NOT EXISTS bands_doc ON bands(doc_id)",
+    "CREATE INDEX IF NOT EXISTS docs_added ON docs(added_at)",
+]
+
+
+def _pack(sig: Sequence[int]) -> bytes:
+    return array("I", sig).tobytes()
+
+
+def _unpack(blob: bytes) -> Tuple[int, ...]:
+    a = array("I")
+    a.frombytes(blob)
+    return tuple(a)
+
+
+class PlagiarismIndex:
+    def __init__(self, db_path: str):
+        p = Path(db_path)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        self.path = str(p)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            for stmt in _SCHEMA:
+                self._conn.execute(stmt)
+            cols = {row[1] for row in self._conn.execute("PRAGMA table_info(docs)")}
+            if "md5" not in cols:
+                # md5 sütunundan önce oluşturulmuş indeks
+                self._conn.execute("ALTER TABLE docs ADD COLUMN md5 TEXT")
+            self._conn.commit()
+
+    @classmethod
+    def for_output_dir(cls, out_dir: Path) -> "PlagiarismIndex":
+        return cls(str(Path(out_dir) / "plagiarism_index.sqlite3"))
+
+    def add(self, file_id: str, file_name: str, student: str, sig: Sequence[int], md5: str = "") -> None:
+        """Teslimi indekse ekler; aynı file_id varsa eski imza değiştirilir. md5: normalize metnin md5'i."""
+        if len(sig) != NUM_PERM:
+            return
+        with self._lock:
+            old = self._conn.execute("SELECT doc_id FROM docs WHERE file_id = ?", (file_id,)).fetchone()
+            if old:
+                self._conn.execute("DELETE FROM bands WHERE doc_id = ?", (old[0],))
+                self._conn.execute("DELETE FROM docs WHERE doc_id = ?", (old[0],))
+            cur = self._conn.execute(
+                "INSERT INTO docs (file_id, file_name, student, added_at, signature, md5) VALUES (?, ?, ?, ?, ?, ?)",
+                (file_id, file_name, student, time.time(), _pack(sig), md5 or None),
+            )
+            doc_id = cur.lastrowid
+            self._conn.executemany(
+                "INSERT INTO bands (band, bucket, doc_id) VALUES (?, ?, ?)",
+                [(b, h, doc_id) for b, h in band_keys(sig, INDEX_BANDS, INDEX_ROWS)],
+            )
+            self._conn.commit()
+
+    def query(self, sig: Sequence[int], jaccard_min: float, exclude_file_ids: Iterable[str] = ()) -> List[Dict[str, Any]]:
+        """
+        Bant eşleşen eski teslimleri tahmini jaccard ≥ jaccard_min ile döner,
+        en eski önce.
+        """
+        excluded = set(exclude_file_ids)
+        keys = band_keys(sig, INDEX_BANDS, INDEX_ROWS)
+        with self._lock:
+            doc_ids = set()
+            for b, h in keys:
+                for (doc_id,) in self._conn.execute(
+                    "SELECT doc_id FROM bands WHERE band = ? AND bucket = ?", (b, h)
+                ):
+                    doc_ids.add(doc_id)
+            rows = []
+            for doc_id in doc_ids:
+                row = self._conn.execute(
+                    "SELECT file_id, file_name, student, added_at, signature, md5 FROM docs WHERE doc_id = ?",
+                    (doc_id,),
+                ).fetchone()
+                if row:
+                    rows.append(row)
+        out = []
+        for file_id, file_name, student, added_at, blob, md5 in rows:
+            if file_id in excluded:
+                continue
+            est = estimate_jaccard(sig, _unpack(blob))
+            if est >= jaccard_min:
+                out.append({
+                    "file_id": file_id,
+                    "file_name": file_name,
+                    "student": student,
+                    "added_at": added_at,
+                    "md5": md5,
+                    "jaccard_est": est,
+                })
+        out.sort(key=lambda m: m["added_at"])
+        return out
+
+    def prune(self, retention_days: int = 0, max_docs: int = 0) -> int:
+        """Saklama süresini aşan ve (varsa) en fazla belge sayısının üstündeki en eski kayıtları siler."""
+        with self._lock:
+            rows = self._conn.execute("SELECT doc_id, added_at FROM docs ORDER BY added_at ASC").fetchall()
+            cutoff = time.time() - retention_days * 86400.0 if retention_days > 0 else None
+            doomed = [d for d, added in rows if cutoff is not None and added < cutoff]
+            remaining = len(rows) - len(doomed)
+            if max_docs > 0 and remaining > max_docs:
+                gone = set(doomed)
+                doomed += [d for d, _ in rows if d not in gone][:remaining - max_docs]
+            for doc_id in doomed:
+                self._conn.execute("DELETE FROM bands WHERE doc_id = ?", (doc_id,))
+                self._conn.execute("DELETE FROM docs WHERE doc_id = ?", (doc_id,))
+            self._conn.commit()
+        return len(doomed)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _same_student(a: Optional[str], b: Optional[str]) -> bool:
+    a, b = (a or "").strip().casefold(), (b or "").strip().casefold()
+    return bool(a) and a == b
+
+
+def check_history(
+    index: PlagiarismIndex,
+    assignments: List[Dict[str, Any]],
+    pairs: List[Dict[str, Any]],
+    jaccard_min: float,
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Bu koşunun teslimlerini geçmişe karşı sorgular, sonra indekse ekler.
+    assignments öğelerinde "md5" (normalize metnin md5'i) beklenir.
+    Dönüş: (çiftler, geçmiş_eşleşmeleri, birebir_kopyalar)
+    - Aynı öğrencinin eski teslimleri (yeniden yükleme, klasör kopyası) atlanır.
+    - Metni birebir aynı (md5) eski teslimler kopya sayılmaz → birebir_kopyalar.
+    - Çiftlere "earlier_source" alanı eklenir (a ya da b için bulunan en eski kaynak).
+    - Geçmiş eşleşmeleri ayrı listedir: eski metin saklanmadığı için RapidFuzz skoru
+      yoktur, ölçüt MinHash ile tahmini 3-gram Jaccard'dır ("jaccard_est", %).
+      combined ile aynı sütuna/eşiğe karıştırılmaz.
+    """
+    sigs = [signature_of(text_of(a)) for a in assignments]
+    run_ids = {a.get("file_id") for a in assignments if a.get("file_id")}
+
+    found: Dict[Any, List[Dict[str, Any]]] = {}
+    identical: Dict[Any, List[Dict[str, Any]]] = {}
+    for a, sig in zip(assignments, sigs):
+        key = a.get("file_id") or a.get("file_name")
+        for m in index.query(sig, jaccard_min, exclude_file_ids=run_ids):
+            if _same_student(a.get("student"), m.get("student")):
+                continue
+            if a.get("md5") and m.get("md5") == a["md5"]:
+                identical.setdefault(key, []).append(m)
+            else:
+                found.setdefault(key, []).append(m)
+
+    def label(m: Dict[str, Any]) -> str:
+        day = datetime.fromtimestamp(m["added_at"]).strftime("%Y-%m-%d")
+        who = f", {m['student']}" if m.get("student") else ""
+        return f"{m['file_name']} ({day}{who})"
+
+    out = []
+    for p in pairs:
+        ms = found.get(p.get("file_id_a") or p.get("file_a")) or found.get(p.get("file_id_b") or p.get("file_b"))
+        out.append({**p, "earlier_source": label(ms[0]) if ms else ""})
+
+    def rows_of(matches: Dict[Any, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        rows = []
+        for a in assignments:
+            for m in matches.get(a.get("file_id") or a.get("file_name"), []):
+                rows.append({
+                    "file": a.get("file_name"),
+                    "student": a.get("student"),
+                    "file_id": a.get("file_id"),
+                    "earlier_file": m["file_name"],
+                    "earlier_student": m.get("student"),
+                    "earlier_file_id": m["file_id"],
+                    "earlier_date": datetime.fromtimestamp(m["added_at"]).strftime("%Y-%m-%d"),
+                    "jaccard_est": round(m["jaccard_est"] * 100, 2),
+                })
+        return rows
+
+    history = rows_of(found)
+    copies = rows_of(identical)
+
+    for a, sig in zip(assignments, sigs):
+        if a.get("file_id"):
+            index.add(a["file_id"], a.get("file_name", ""), a.get("student", ""), sig, a.get("md5", ""))
+
+    history.sort(key=lambda x: x["jaccard_est"], reverse=True)
+    return out, history, copies
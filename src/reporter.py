@@ -1,10 +1,10 @@
 # src/reporter.py
 from __future__ import annotations
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import Any, Callable, Dict, List, Optional
 import json
-import openpyxl
-from openpyxl.styles import Font, Alignment, PatternFill
+import threading
+import xlsxwriter
 
 HEADERS = [
     "first_name",
@@ -20,6 +20,7 @@ HEADERS = [
     "language",
     "originality",
     "feedback",
+    "notes",
 ]
 
 def _cell(value: Any) -> Any:
@@ -31,46 +32,94 @@ def _cell(value: Any) -> Any:
         return json.dumps(value, ensure_ascii=False)
     return value
 
-def create_report_excel(output_path: str, rows: List[Dict[str, Any]]) -> str:
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Report"
+def _row_values(r: Dict[str, Any]) -> List[Any]:
+    bd = r.get("breakdown") or {}
+    return [
+        _cell(r.get("first_name")),
+        _cell(r.get("last_name")),
+        _cell(r.get("class")),
+        _cell(r.get("student")),
+        _cell(r.get("file_name")),
+        _cell(r.get("file_id")),
+        _cell(r.get("word_count")),
+        _cell(r.get("total")),
+        _cell(bd.get("content", r.get("content"))),
+        _cell(bd.get("structure", r.get("structure"))),
+        _cell(bd.get("language", r.get("language"))),
+        _cell(bd.get("originality", r.get("originality"))),
+        _cell(r.get("feedback")),
+        _cell(r.get("notes")),
+    ]
 
-    # Başlıklar
-    ws.append(HEADERS)
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill("solid", fgColor="4F81BD")
-    for col, _h in enumerate(HEADERS, 1):
-        c = ws.cell(row=1, column=col)
-        c.font = header_font
-        c.fill = header_fill
-        ws.column_dimensions[c.column_letter].width = 20
-    ws.column_dimensions["M"].width = 80  # feedback daha geniş
 
-    # Satırlar
-    for r in rows:
-        bd = r.get("breakdown") or {}
-        ws.append([
-            _cell(r.get("first_name")),
-            _cell(r.get("last_name")),
-            _cell(r.get("class")),
-            _cell(r.get("student")),
-            _cell(r.get("file_name")),
-            _cell(r.get("file_id")),
-            _cell(r.get("word_count")),
-            _cell(r.get("total")),
-            _cell(bd.get("content", r.get("content"))),
-            _cell(bd.get("structure", r.get("structure"))),
-            _cell(bd.get("language", r.get("language"))),
-            _cell(bd.get("originality", r.get("originality"))),
-            _cell(r.get("feedback")),
-        ])
+class ReportWriter:
+    """
+    Akışlı rapor yazıcı (xlsxwriter constant_memory): her satır eklendiği anda
+    diske yazılır, bellekte yalnızca geçerli satır tutulur. Hücre biçimleri
+    sütun düzeyinde bir kez tanımlanır; 50 ya da 50.000 satır için bellek sabit.
+    Satırlar sırayla eklenmeli (bkz. OrderedRows).
+    """
+
+    def __init__(self, output_path: str):
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = output_path
+        self.rows = 0
+        self._lock = threading.Lock()
+        # formül/URL dönüştürme kapalı: öğrenci metni "=..." ile başlasa da düz metin kalır
+        self._wb = xlsxwriter.Workbook(output_path, {
+            "constant_memory": True,
+            "strings_to_formulas": False,
+            "strings_to_urls": False,
+        })
+        self._ws = self._wb.add_worksheet("Report")
+        wrap = self._wb.add_format({"text_wrap": True, "valign": "top"})
+        header = self._wb.add_format({"bold": True, "font_color": "#FFFFFF", "bg_color": "#4F81BD"})
+        fb = HEADERS.index("feedback")
+        self._ws.set_column(0, len(HEADERS) - 1, 20, wrap)
+        self._ws.set_column(fb, fb, 80, wrap)  # feedback daha geniş
+        self._ws.set_column(fb + 1, fb + 1, 40, wrap)  # notes
+        self._ws.write_row(0, 0, HEADERS, header)
+
+    def append(self, r: Dict[str, Any]) -> None:
+        with self._lock:
+            self.rows += 1
+            self._ws.write_row(self.rows, 0, _row_values(r))
+
+    def close(self) -> str:
+        # tekrar çağrılabilir (koşu sonu temizliği)
+        with self._lock:
+            if not self._wb.fileclosed:
+                self._wb.close()
+        return self.path
+
 
-    # Hücre biçimleri
-    for row in ws.iter_rows(min_row=2):
-        for c in row:
-            c.alignment = Alignment(wrap_text=True, vertical="top")
+class OrderedRows:
+    """
+    Yeniden sıralama tamponu: iş hattı öğeleri bitiş sırasıyla verir, satırlar ise
+    girdi sırasıyla yazılır. put(idx, None) = bu öğe için satır yok (atlandı).
+    Tamponda yalnızca sırası gelmemiş satırlar bekler.
+    """
 
-    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
-    wb.save(output_path)
-    return output_path
+    def __init__(self, emit: Callable[[Dict[str, Any]], None]):
+        self.emit = emit
+        self.written = 0
+        self._next = 0
+        self._pending: Dict[int, Optional[Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def put(self, idx: int, row: Optional[Dict[str, Any]]) -> None:
+        with self._lock:
+            self._pending[idx] = row
+            while self._next in self._pending:
+                ready = self._pending.pop(self._next)
+                self._next += 1
+                if ready is not None:
+                    self.emit(ready)
+                    self.written += 1
+
+
+def create_report_excel(output_path: str, rows: List[Dict[str, Any]]) -> str:
+    writer = ReportWriter(output_path)
+    for r in rows:
+        writer.append(r)
+    return writer.close()
@@ -1,25 +1,70 @@
 from openpyxl import Workbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
 from datetime import datetime
 from pathlib import Path
 
-def create_plagiarism_excel(path: str, pairs):
-    if not pairs:
+def _pct(v):
+    # hesaplanmamış skor (ör. partial_ratio kapalı) → boş hücre
+    return "" if v is None else round(v, 2)
+
+def _snippet(text):
+    # OCR çıktısındaki kontrol karakterleri openpyxl'de hata verir
+    return ILLEGAL_CHARACTERS_RE.sub(" ", text or "")
+
+def create_plagiarism_excel(path: str, pairs, history=None, copies=None):
+    """
+    pairs: bu koşudaki çiftler (RapidFuzz combined ≥ eşik)
+    history: geçmiş koşulardaki teslimlerle eşleşmeler (MinHash tahmini Jaccard) → ayrı sayfa
+    copies: geçmişteki, metni birebir aynı (md5) teslimler → kopya değil, ayrı sayfa
+    """
+    if not pairs and not history and not copies:
         return None
     wb = Workbook()
     ws = wb.active
     ws.title = "Plagiarism"
 
     ws.append(["file_a", "file_b", "student_a", "student_b",
-               "combined(%)", "token_set(%)", "jaccard(%)"])
+               "combined(%)", "token_set(%)", "jaccard(%)", "earlier_source", "passages"])
 
     for p in pairs:
         ws.append([
             p.get("file_a"), p.get("file_b"),
             p.get("student_a"), p.get("student_b"),
-            round(p.get("combined", 0), 2),
-            round(p.get("rf_token_set", 0), 2),
-            round(p.get("jaccard_3gram", 0), 2)
+            _pct(p.get("combined")),
+            _pct(p.get("rf_token_set")),
+            _pct(p.get("jaccard_3gram")),
+            p.get("earlier_source") or "",
+            len(p.get("passages") or []),
         ])
 
+    # Eşleşen pasajlar: karakter konumları çıkarılmış metne göredir
+    ps = wb.create_sheet("Passages")
+    ps.append(["file_a", "file_b", "a_start", "a_end", "b_start", "b_end", "passage_a", "passage_b"])
+    for p in pairs:
+        for m in p.get("passages") or []:
+            ps.append([
+                p.get("file_a"), p.get("file_b"),
+                m["a_start"], m["a_end"], m["b_start"], m["b_end"],
+                _snippet(m.get("a_text")), _snippet(m.get("b_text")),
+            ])
+    ps.column_dimensions["G"].width = 80
+    ps.column_dimensions["H"].width = 80
+
+    # Geçmiş koşular: farklı ölçüt (eski metin yok → yalnızca MinHash imzası), ayrı sayfa
+    hs = wb.create_sheet("Earlier submissions")
+    hs.append(["file", "student", "earlier_file", "earlier_student", "earlier_date", "minhash_jaccard_est(%)"])
+    for h in history or []:
+        hs.append([
+            h.get("file"), h.get("student"),
+            h.get("earlier_file"), h.get("earlier_student"), h.get("earlier_date"),
+            _pct(h.get("jaccard_est")),
+        ])
+
+    # Birebir aynı metin (yeniden yükleme/klasör kopyası olabilir): kontrol için, kopya skoru değil
+    cs = wb.create_sheet("Identical copies")
+    cs.append(["file", "student", "earlier_file", "earlier_student", "earlier_date"])
+    for c in copies or []:
+        cs.append([c.get("file"), c.get("student"), c.get("earlier_file"), c.get("earlier_student"), c.get("earlier_date")])
+
     wb.save(path)
     return path
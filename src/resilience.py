@@ -0,0 +1,155 @@
+# src/resilience.py
+from __future__ import annotations
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import openai
+
+from .config import settings
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Sağlayıcı çağrıları için ortak dayanıklılık katmanı
+# - Hata sınıflandırma: 429 / 5xx / zaman aşımı / bağlantı → geri çekilip tekrar;
+#   diğer 4xx (geçersiz istek, yetki, içerik) tekrar edilmez.
+# - Devre kesici: art arda tekrar edilebilir hatalar eşiği aşınca tüm istekler
+#   bekleme süresi boyunca durur (koşu duraklar); sonra tek bir deneme isteği
+#   geçer, başarılıysa devre kapanır, değilse bekleme ikiye katlanır. Sağlayıcı
+#   max_pause'dan uzun süre bozuk kalırsa ProviderUnavailable → dosyalar sonraki
+#   koşuya kalır. Sync (evaluator) ve async (eval_engine) yollar aynı kesiciyi paylaşır.
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+class ProviderUnavailable(Exception):
+    """Sağlayıcı uzun süredir bozuk; devre açık kaldı."""
+
+
+def retry_after(exc: Exception) -> Optional[float]:
+    resp = getattr(exc, "response", None)
+    headers = getattr(resp, "headers", None) or {}
+    try:
+        ms = headers.get("retry-after-ms")
+        if ms:
+            return float(ms) / 1000.0
+        sec = headers.get("retry-after")
+        if sec:
+            return float(sec)
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code == 429 or exc.status_code >= 500
+    return False
+
+
+def is_rate_limit(exc: Exception) -> bool:
+    return isinstance(exc, openai.RateLimitError) or getattr(exc, "status_code", None) == 429
+
+
+def backoff_delay(attempt: int, exc: Exception) -> float:
+    # Retry-After varsa ona uy; yoksa full jitter: [0, 2^attempt) saniye, üst sınır 60 sn
+    wait = retry_after(exc)
+    if wait is not None:
+        return wait + random.uniform(0, 1.0)
+    return random.uniform(0, min(60.0, 2.0 ** attempt))
+
+
+class CircuitBreaker:
+    def __init__(self, threshold: int = 5, cooldown: float = 15.0, max_cooldown: float = 240.0,
+                 max_pause: float = 900.0):
+        self.threshold = max(1, threshold)
+        self.base_cooldown = max(0.1, cooldown)
+        self.max_cooldown = max(self.base_cooldown, max_cooldown)
+        self.max_pause = max(0.0, max_pause)
+        self.state = "closed"  # closed | open | half_open
+        self.failures = 0
+        self.trips = 0
+        self.cooldown = self.base_cooldown
+        self.open_until = 0.0
+        self.degraded_since: Optional[float] = None
+        self.probe_started = 0.0
+        self._lock = threading.Lock()
+
+    def wait_time(self) -> float:
+        """
+        İstekten önce çağrılır: 0 = şimdi gönder, >0 = o kadar bekleyip tekrar sor.
+        Devre max_pause'dan uzun süredir açıksa ProviderUnavailable.
+        """
+        with self._lock:
+            if self.state == "closed":
+                return 0.0
+            now = time.monotonic()
+            if self.degraded_since is not None and self.max_pause and now - self.degraded_since > self.max_pause:
+                raise ProviderUnavailable(
+                    f"provider degraded for {round(now - self.degraded_since)}s (circuit open)"
+                )
+            if self.state == "open":
+                if now < self.open_until:
+                    return self.open_until - now
+                # bekleme bitti → bu çağıran deneme isteğini yapar
+                self.state = "half_open"
+                self.probe_started = now
+                return 0.0
+            # half_open: deneme sürerken diğerleri bekler; deneme sonuçsuz kaldıysa yenisi geçer
+            if now - self.probe_started > 2 * self.cooldown:
+                self.probe_started = now
+                return 0.0
+            return min(1.0, self.cooldown)
+
+    def record_success(self) -> None:
+        # sağlayıcı cevap verdi (4xx dahil) → devre kapanır
+        with self._lock:
+            if self.state != "closed":
+                print(f"[warn] provider recovered, resuming (circuit closed after {self.trips} trip(s))")
+            self.state = "closed"
+            self.failures = 0
+            self.cooldown = self.base_cooldown
+            self.degraded_since = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.threshold):
+                now = time.monotonic()
+                self.state = "open"
+                self.open_until = now + self.cooldown
+                self.trips += 1
+                if self.degraded_since is None:
+                    self.degraded_since = now
+                print(f"[warn] provider degraded: pausing requests for {self.cooldown:.0f}s "
+                      f"({self.failures} consecutive failures)")
+                self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "trips": self.trips,
+                "open_for_seconds": round(max(0.0, self.open_until - time.monotonic())) if self.state == "open" else 0,
+            }
+
+
+# ── Süreç geneli kesiciler (sağlayıcı adresi başına) ───────────────────────
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(base_url: Optional[str] = None) -> CircuitBreaker:
+    key = base_url or settings.openai_base_url or "default"
+    with _breakers_lock:
+        br = _breakers.get(key)
+        if br is None:
+            br = CircuitBreaker(
+                threshold=settings.openai_breaker_threshold,
+                cooldown=settings.openai_breaker_cooldown_seconds,
+                max_pause=settings.openai_breaker_max_pause_seconds,
+            )
+            _breakers[key] = br
+        return br
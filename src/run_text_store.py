@@ -0,0 +1,68 @@
+# src/run_text_store.py
+from __future__ import annotations
+import mmap
+import tempfile
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Koşu süresince metin deposu
+# Metinler tek bir isimsiz geçici dosyaya sırayla eklenir (UTF-8); satırlar yalnızca
+# (ofset, uzunluk) tutan bir TextRef taşır. Okuma mmap üzerinden yapılır, böylece
+# kopya kontrolü sırasında bellekte aynı anda yalnızca işlenen metinler bulunur.
+# Dosya kapatıldığında (ya da süreç bittiğinde) işletim sistemi siler.
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+@dataclass(frozen=True)
+class TextRef:
+    store: "RunTextStore"
+    offset: int
+    length: int
+
+    def read(self) -> str:
+        return self.store.read(self.offset, self.length)
+
+
+class RunTextStore:
+    def __init__(self, dir_path: Optional[str] = None):
+        if dir_path:
+            Path(dir_path).mkdir(parents=True, exist_ok=True)
+        self._fh = tempfile.TemporaryFile(dir=dir_path or None, prefix=".run_texts.")
+        self._size = 0
+        self._mm: Optional[mmap.mmap] = None
+        self._lock = threading.Lock()
+
+    def append(self, text: str) -> TextRef:
+        data = (text or "").encode("utf-8")
+        with self._lock:
+            offset = self._size
+            self._fh.seek(offset)
+            self._fh.write(data)
+            self._size += len(data)
+        return TextRef(self, offset, len(data))
+
+    def read(self, offset: int, length: int) -> str:
+        if length == 0:
+            return ""
+        with self._lock:
+            if self._mm is None or len(self._mm) < offset + length:
+                # ekleme sürdükçe eşlem büyür; okuma aşamasında bir kez yeniden eşlenir
+                self._fh.flush()
+                if self._mm is not None:
+                    self._mm.close()
+                self._mm = mmap.mmap(self._fh.fileno(), self._size, access=mmap.ACCESS_READ)
+            return self._mm[offset:offset + length].decode("utf-8")
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def close(self) -> None:
+        with self._lock:
+            if self._mm is not None:
+                self._mm.close()
+                self._mm = None
+            self._fh.close()
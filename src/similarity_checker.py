@@ -1,13 +1,51 @@
 # src/similarity_checker.py
 from __future__ import annotations
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Iterable, Optional, Sequence, Set, Tuple
+from functools import lru_cache
+import hashlib
+import random
 import re
+import zlib
 from itertools import combinations
 
 try:
-    from rapidfuzz import fuzz
+    from rapidfuzz import fuzz, process as rf_process
 except Exception:
     fuzz = None  # requirements'a rapidfuzz ekleyeceğiz
+    rf_process = None
+
+try:
+    import numpy as np
+except Exception:
+    np = None  # MinHash saf Python'a düşer (aynı sonuç, daha yavaş)
+
+try:
+    from scipy import sparse
+except Exception:
+    sparse = None  # "sparse" yöntemi yoksa "minhash"e düşer
+
+def text_of(a: Dict[str, Any]) -> str:
+    """
+    assignments[*]["text"] düz metin ya da .read() ile okunan bir tutamaç olabilir
+    (run_text_store.TextRef); tutamaçlar ancak gerektiğinde okunur.
+    """
+    t = a.get("text")
+    if t is None:
+        return ""
+    return t if isinstance(t, str) else t.read()
+
+class _LazyTexts(Sequence):
+    # sparse_candidates için: metinler indeksle erişildiğinde okunur
+    def __init__(self, assignments: List[Dict[str, Any]]):
+        self.assignments = assignments
+
+    def __len__(self) -> int:
+        return len(self.assignments)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [text_of(a) for a in self.assignments[i]]
+        return text_of(self.assignments[i])
 
 def _clean(t: str) -> str:
     t = t or ""
@@ -22,20 +60,157 @@ def _shingles(text: str, k: int = 3) -> set:
         return set(tokens)
     return set(tuple(tokens[i:i+k]) for i in range(len(tokens)-k+1))
 
-def pair_score(a_text: str, b_text: str) -> Dict[str, Any]:
-    a = _clean(a_text)
-    b = _clean(b_text)
+# ─────────────────────────────────────────────────────────────────────────────
+# MinHash / LSH aday üretimi
+# combined = 0.5*token_set + 0.5*jaccard ve token_set ≤ 100 olduğundan
+# combined ≥ T ancak jaccard ≥ 2T/100 - 1 ise mümkündür. LSH bantları bu alt sınıra
+# göre seçilir; tam pair_score yalnızca aday çiftlerde çalışır.
+# ─────────────────────────────────────────────────────────────────────────────
+
+NUM_PERM = 128
+_MERSENNE = (1 << 61) - 1
+_MASK64 = (1 << 64) - 1
+_MAX_HASH = (1 << 32) - 1
+# Sabit tohum: imzalar süreçler/koşular arasında karşılaştırılabilir kalır
+_rng = random.Random(1)
+_PERMS: List[Tuple[int, int]] = [(_rng.randrange(1, _MERSENNE), _rng.randrange(0, _MERSENNE)) for _ in range(NUM_PERM)]
+
+if np is not None:
+    _PERM_A = np.array([a for a, _ in _PERMS], dtype=np.uint64)
+    _PERM_B = np.array([b for _, b in _PERMS], dtype=np.uint64)
+
+def _stable_hash(s: str) -> int:
+    # Python hash() süreç başına rastgele; kalıcı indeks için sabit hash gerekir
+    return int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little")
+
+def _shingle_key(sh) -> str:
+    return " ".join(sh) if isinstance(sh, tuple) else str(sh)
+
+def minhash_signature(shingles: Iterable) -> Tuple[int, ...]:
+    hs = [_stable_hash(_shingle_key(x)) for x in shingles]
+    if not hs:
+        return tuple([_MAX_HASH] * NUM_PERM)
+    # (a*h + b) 64-bit taşmalı, sonra mod Mersenne asalı (numpy uint64 ile aynı sonuç)
+    if np is not None:
+        with np.errstate(over="ignore"):
+            hv = np.asarray(hs, dtype=np.uint64)[:, None]
+            mat = (hv * _PERM_A + _PERM_B) % np.uint64(_MERSENNE) & np.uint64(_MAX_HASH)
+        return tuple(int(v) for v in mat.min(axis=0))
+    return tuple(
+        min(((a * h + b) & _MASK64) % _MERSENNE & _MAX_HASH for h in hs)
+        for a, b in _PERMS
+    )
+
+def signature_of(text: str) -> Tuple[int, ...]:
+    return minhash_signature(_shingles(_clean(text), 3))
+
+def estimate_jaccard(sig_a: Sequence[int], sig_b: Sequence[int]) -> float:
+    if not sig_a or not sig_b:
+        return 0.0
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / float(len(sig_a))
+
+def jaccard_floor(threshold: float) -> float:
+    """combined ≥ threshold için gereken en düşük 3-gram jaccard (0..1)."""
+    return max(0.0, 2.0 * threshold / 100.0 - 1.0)
+
+def lsh_params(jaccard_min: float, num_perm: int = NUM_PERM) -> Optional[Tuple[int, int]]:
+    """
+    (bant, satır) seçer: S-eğrisinin eşiği (1/b)^(1/r), hedef jaccard'ın %80'inin altında
+    kalan en seçici ayar. Hedef 0 ise None (tüm çiftler aday).
+    """
+    if jaccard_min <= 0:
+        return None
+    for rows in (16, 8, 6, 5, 4, 3, 2, 1):
+        bands = num_perm // rows
+        if bands >= 1 and (1.0 / bands) ** (1.0 / rows) <= 0.8 * jaccard_min:
+            return bands, rows
+    return num_perm, 1
+
+def band_keys(sig: Sequence[int], bands: int, rows: int) -> List[Tuple[int, int]]:
+    # (bant_no, bant_hash) — kalıcı indekste de aynı anahtarlar kullanılır
+    out = []
+    for b in range(bands):
+        chunk = ",".join(str(v) for v in sig[b * rows:(b + 1) * rows])
+        out.append((b, _stable_hash(chunk)))
+    return out
+
+def lsh_candidates(signatures: List[Tuple[int, ...]], jaccard_min: float) -> List[Tuple[int, int]]:
+    n = len(signatures)
+    params = lsh_params(jaccard_min)
+    if params is None:
+        return list(combinations(range(n), 2))
+    bands, rows = params
+    buckets: Dict[Tuple[int, int], List[int]] = {}
+    for i, sig in enumerate(signatures):
+        for key in band_keys(sig, bands, rows):
+            buckets.setdefault(key, []).append(i)
+    cands: Set[Tuple[int, int]] = set()
+    for members in buckets.values():
+        if len(members) > 1:
+            cands.update(combinations(members, 2))
+    return sorted(cands)
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Seyrek matris ile toplu jaccard
+# 3-gram'lar sabit boyutlu öznitelik uzayına hash'lenir (sözlük yok). İkili belge ×
+# öznitelik matrisinde kesişimler X·Xᵀ ile blok blok hesaplanır; jaccard alt sınırını
+# geçen çiftler pair_score ile tam puanlanır (rapor alanları "exact" ile aynı).
+# ─────────────────────────────────────────────────────────────────────────────
+
+SPARSE_FEATURES = 1 << 22
+SPARSE_BLOCK_ROWS = 256
+# hash çakışmaları jaccard'ı çok az oynatabilir; filtre bu pay kadar gevşek tutulur
+_SPARSE_SLACK = 0.02
+
+def _feature_ids(text: str) -> List[int]:
+    return sorted({zlib.crc32(_shingle_key(sh).encode("utf-8")) % SPARSE_FEATURES for sh in _shingles(_clean(text), 3)})
+
+def shingle_matrix(texts: Sequence[str]):
+    """İkili CSR matris (belge × hash'lenmiş 3-gram)."""
+    indptr = [0]
+    indices: List[int] = []
+    for t in texts:
+        indices.extend(_feature_ids(t))
+        indptr.append(len(indices))
+    data = np.ones(len(indices), dtype=np.float32)
+    return sparse.csr_matrix(
+        (data, np.asarray(indices, dtype=np.int64), np.asarray(indptr, dtype=np.int64)),
+        shape=(len(texts), SPARSE_FEATURES),
+    )
+
+def sparse_candidates(texts: Sequence[str], jaccard_min: float, block_rows: int = SPARSE_BLOCK_ROWS) -> List[Tuple[int, int]]:
+    n = len(texts)
+    if jaccard_min <= 0:
+        return list(combinations(range(n), 2))
+    X = shingle_matrix(texts)
+    sizes = np.asarray(X.sum(axis=1)).ravel()
+    XT = X.T.tocsr()  # CSR @ CSR: blok başına biçim dönüşümü yok
+    floor = max(0.0, jaccard_min - _SPARSE_SLACK)
+    out: List[Tuple[int, int]] = []
+    for start in range(0, n, block_rows):
+        # blok × n kesişim matrisi: bellek blok boyutuyla sınırlı
+        inter = (X[start:start + block_rows] @ XT).tocoo()
+        rows = inter.row + start
+        keep = inter.col > rows
+        i, j, k = rows[keep], inter.col[keep], inter.data[keep]
+        jac = k / (sizes[i] + sizes[j] - k)
+        hit = jac >= floor
+        out.extend(zip(i[hit].tolist(), j[hit].tolist()))
+    out.sort()
+    return out
+
+def _score_cleaned(a: str, b: str, A: set, B: set, partial: bool = True, token_set: Optional[float] = None) -> Dict[str, Any]:
+    # a, b: _clean'den geçmiş metinler; A, B: 3-gram kümeleri
     # RapidFuzz oranları
     rf = {}
     if fuzz:
-        rf["token_set_ratio"] = float(fuzz.token_set_ratio(a, b))
-        rf["partial_ratio"]   = float(fuzz.partial_ratio(a, b))
+        rf["token_set_ratio"] = float(token_set) if token_set is not None else float(fuzz.token_set_ratio(a, b))
+        rf["partial_ratio"]   = float(fuzz.partial_ratio(a, b)) if partial else None
         rf["ratio"]           = float(fuzz.ratio(a, b))
     else:
         rf["token_set_ratio"] = rf["partial_ratio"] = rf["ratio"] = 0.0
 
     # 3-gram jaccard
-    A = _shingles(a, 3); B = _shingles(b, 3)
     inter = len(A & B); uni = len(A | B) if (A or B) else 1
     jaccard = inter / uni
 
@@ -49,24 +224,107 @@ def pair_score(a_text: str, b_text: str) -> Dict[str, Any]:
         "combined": round(combined*100, 2),
     }
 
-def find_similar(assignments: List[Dict[str, Any]], threshold: float = 80.0) -> List[Dict[str, Any]]:
+def pair_score(a_text: str, b_text: str, partial: bool = True) -> Dict[str, Any]:
+    a = _clean(a_text)
+    b = _clean(b_text)
+    return _score_cleaned(a, b, _shingles(a, 3), _shingles(b, 3), partial)
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Toplu RapidFuzz (process.cdist)
+# combined ≥ T için token_set ≥ 2T - 100 gerekir; bu alt sınır score_cutoff olarak
+# C++ tarafında uygulanır, matris tüm çekirdeklerde blok blok hesaplanır. Her blok
+# yalnızca kendi satırından sonraki sütunlarla eşleşir (üçgenin çoğu boşa gitmez).
+# ─────────────────────────────────────────────────────────────────────────────
+
+CDIST_BLOCK_ROWS = 64
+
+def token_set_floor(threshold: float) -> float:
+    """combined ≥ threshold için gereken en düşük token_set oranı (0..100)."""
+    return max(0.0, 2.0 * threshold - 100.0)
+
+def cdist_candidates(cleaned: Sequence[str], threshold: float, block_rows: int = CDIST_BLOCK_ROWS) -> Dict[Tuple[int, int], float]:
+    """(i, j) → token_set oranı; yalnızca alt sınırı geçen i < j çiftleri."""
+    n = len(cleaned)
+    cutoff = token_set_floor(threshold)
+    out: Dict[Tuple[int, int], float] = {}
+    for start in range(0, n, block_rows):
+        # sonuçlar float64: combined yuvarlaması tekil hesapla birebir aynı kalsın
+        mat = rf_process.cdist(
+            cleaned[start:start + block_rows], cleaned[start:],
+            scorer=fuzz.token_set_ratio, score_cutoff=cutoff, dtype=np.float64, workers=-1,
+        )
+        rows, cols = np.nonzero(mat >= cutoff) if cutoff > 0 else np.indices(mat.shape).reshape(2, -1)
+        for r, c in zip(rows.tolist(), cols.tolist()):
+            i, j = start + r, start + c
+            if j > i:
+                out[(i, j)] = float(mat[r, c])
+    return out
+
+def _pair_record(a: Dict[str, Any], b: Dict[str, Any], sc: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "file_a": a.get("file_name"),
+        "file_b": b.get("file_name"),
+        "student_a": a.get("student"),
+        "student_b": b.get("student"),
+        "file_id_a": a.get("file_id"),
+        "file_id_b": b.get("file_id"),
+        **sc
+    }
+
+def find_similar(
+    assignments: List[Dict[str, Any]],
+    threshold: float = 80.0,
+    method: str = "minhash",
+    partial: bool = False,
+) -> List[Dict[str, Any]]:
     """
     assignments: [{ "file_name": str, "text": str, "file_id": str, "student": str, ...}, ...]
     threshold: combined skorda alt sınır (0..100)
+    method: "minhash" (LSH ile aday çiftler, ~doğrusal) | "sparse" (seyrek matris
+            jaccard filtresi) | "cdist" (RapidFuzz token_set matrisi, çok çekirdek)
+            | "exact" (tüm çiftler)
+    partial: rf_partial (partial_ratio, en pahalı skor) hesaplansın mı; kapalıysa None
     """
+    if method == "sparse" and (sparse is None or np is None):
+        print("[warn] SIMILARITY_METHOD=sparse needs scipy + numpy; falling back to minhash")
+        method = "minhash"
+    if method == "cdist" and (rf_process is None or np is None):
+        print("[warn] SIMILARITY_METHOD=cdist needs rapidfuzz + numpy; falling back to minhash")
+        method = "minhash"
+
+    # Temiz metin ve 3-gram kümeleri sınırlı bir önbellekte tutulur: metinler tutamaçsa
+    # (run_text_store) bellekte tüm klasör değil, yalnızca son kullanılan belgeler durur.
+    # Adaylar (i, j) sırasıyla geldiğinden i neredeyse hep önbellekte olur.
+    @lru_cache(maxsize=256)
+    def cleaned_of(i: int) -> str:
+        return _clean(text_of(assignments[i]))
+
+    @lru_cache(maxsize=256)
+    def shingles_of(i: int) -> set:
+        return _shingles(cleaned_of(i), 3)
+
+    n = len(assignments)
+    token_sets: Dict[Tuple[int, int], float] = {}
+    if method == "exact":
+        candidates: Iterable[Tuple[int, int]] = combinations(range(n), 2)
+    elif method == "sparse":
+        candidates = sparse_candidates(_LazyTexts(assignments), jaccard_floor(threshold))
+    elif method == "cdist":
+        # cdist tüm metinleri aynı anda ister
+        token_sets = cdist_candidates([_clean(text_of(a)) for a in assignments], threshold)
+        candidates = sorted(token_sets)
+    else:
+        sigs = [minhash_signature(_shingles(_clean(text_of(a)), 3)) for a in assignments]
+        candidates = lsh_candidates(sigs, jaccard_floor(threshold))
+
     results: List[Dict[str, Any]] = []
-    for a, b in combinations(assignments, 2):
-        sc = pair_score(a.get("text",""), b.get("text",""))
+    for i, j in candidates:
+        sc = _score_cleaned(
+            cleaned_of(i), cleaned_of(j), shingles_of(i), shingles_of(j),
+            partial=partial, token_set=token_sets.get((i, j)),
+        )
         if sc["combined"] >= threshold:
-            results.append({
-                "file_a": a.get("file_name"),
-                "file_b": b.get("file_name"),
-                "student_a": a.get("student"),
-                "student_b": b.get("student"),
-                "file_id_a": a.get("file_id"),
-                "file_id_b": b.get("file_id"),
-                **sc
-            })
+            results.append(_pair_record(assignments[i], assignments[j], sc))
     # skora göre sırala
     results.sort(key=lambda x: x["combined"], reverse=True)
     return results
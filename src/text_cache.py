@@ -0,0 +1,112 @@
+# src/text_cache.py
+from __future__ import annotations
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, Optional
+
+from .ledger import file_fingerprint
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Çıkarılmış metin deposu
+# Drive file id + (md5Checksum | modifiedTime) ile anahtarlanır. Metin zlib ile
+# sıkıştırılır; OCR dili ve çıkarıcı sürümü kaydedilir, uymazsa kayıt kullanılmaz.
+# Rubrik değişip yeniden puanlama gerektiğinde indirme ve OCR tekrar yapılmaz.
+# ─────────────────────────────────────────────────────────────────────────────
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS texts (
+    file_id           TEXT PRIMARY KEY,
+    fingerprint       TEXT NOT NULL,
+    ocr_lang          TEXT NOT NULL,
+    extractor_version TEXT NOT NULL,
+    norm_name         TEXT,
+    data              BLOB NOT NULL,
+    size              INTEGER NOT NULL,
+    last_used         REAL NOT NULL
+)
+"""
+
+
+class TextCache:
+    def __init__(self, db_path: str, max_bytes: int = 200 * 1024 * 1024):
+        p = Path(db_path)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        self.path = str(p)
+        self.max_bytes = max(0, int(max_bytes))
+        self.hits = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock:
+            # auto_vacuum yalnızca tablo oluşturulmadan önce etkili olur
+            self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(_SCHEMA)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS texts_last_used ON texts(last_used)")
+            self._conn.commit()
+
+    @classmethod
+    def for_output_dir(cls, out_dir: Path, max_mb: int = 200) -> "TextCache":
+        return cls(str(Path(out_dir) / "text_cache.sqlite3"), max_mb * 1024 * 1024)
+
+    def get(self, file_obj: Dict, ocr_lang: str, extractor_version: str) -> Optional[Dict[str, str]]:
+        """Eşleşen kayıt varsa {"text", "norm_name"} döner."""
+        fp = file_fingerprint(file_obj)
+        if not fp:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT norm_name, data FROM texts "
+                "WHERE file_id = ? AND fingerprint = ? AND ocr_lang = ? AND extractor_version = ?",
+                (file_obj["id"], fp, ocr_lang, extractor_version),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE texts SET last_used = ? WHERE file_id = ?", (time.time(), file_obj["id"]))
+            self._conn.commit()
+            self.hits += 1
+        return {"norm_name": row[0], "text": zlib.decompress(row[1]).decode("utf-8")}
+
+    def put(self, file_obj: Dict, text: str, ocr_lang: str, extractor_version: str, norm_name: str = "") -> None:
+        fp = file_fingerprint(file_obj)
+        if not fp or not text:
+            return
+        data = zlib.compress(text.encode("utf-8"), 6)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO texts "
+                "(file_id, fingerprint, ocr_lang, extractor_version, norm_name, data, size, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (file_obj["id"], fp, ocr_lang, extractor_version, norm_name, data, len(data), time.time()),
+            )
+            self._conn.commit()
+
+    def evict(self) -> int:
+        """Toplam sıkıştırılmış boyut sınırı aşılırsa en eski kullanılanları siler."""
+        if not self.max_bytes:
+            return 0
+        with self._lock:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM texts").fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+            excess = total - self.max_bytes
+            freed = 0
+            doomed = []
+            for file_id, size in self._conn.execute("SELECT file_id, size FROM texts ORDER BY last_used ASC"):
+                if freed >= excess:
+                    break
+                doomed.append((file_id,))
+                freed += size
+            self._conn.executemany("DELETE FROM texts WHERE file_id = ?", doomed)
+            self._conn.commit()
+            # silinen sayfaları diske geri ver (1 GB disk); execute() tek adımda yalnızca
+            # bir sayfa bırakır → executescript pragma'yı sonuna kadar yürütür
+            self._conn.executescript("PRAGMA incremental_vacuum;")
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return len(doomed)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,151 @@
+# src/tokens.py
+from __future__ import annotations
+import re
+import threading
+from typing import Any, Dict, List, Optional
+
+try:
+    import tiktoken
+except Exception:
+    tiktoken = None  # yaklaşık sayıma düşer
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Token sayımı ve koşu başına token bütçesi
+# tiktoken varsa modelin gerçek kodlaması kullanılır; yoksa (ya da kodlama dosyası
+# indirilemiyorsa) UTF-8 bayt/4 yaklaşımı: Latin ≈ 4 karakter/token, Kiril ≈ 2.
+# ─────────────────────────────────────────────────────────────────────────────
+
+_encodings: Dict[str, Any] = {}
+_enc_lock = threading.Lock()
+
+
+def _encoding(model: str):
+    if tiktoken is None:
+        return None
+    with _enc_lock:
+        if model not in _encodings:
+            enc = None
+            try:
+                enc = tiktoken.encoding_for_model(model)
+            except Exception:
+                try:
+                    enc = tiktoken.get_encoding("o200k_base")
+                except Exception as e:
+                    print(f"[warn] tiktoken encoding unavailable, using byte estimate: {e}")
+            _encodings[model] = enc
+        return _encodings[model]
+
+
+def count_tokens(text: str, model: str) -> int:
+    enc = _encoding(model)
+    if enc is not None:
+        return len(enc.encode(text or "", disallowed_special=()))
+    return (len((text or "").encode("utf-8")) + 3) // 4
+
+
+def split_by_tokens(text: str, max_tokens: int, model: str) -> List[str]:
+    """
+    Metni en fazla max_tokens'lık parçalara böler; kelime ortasından kesmez.
+    Sığıyorsa tek parça döner.
+    """
+    text = text or ""
+    if max_tokens <= 0 or count_tokens(text, model) <= max_tokens:
+        return [text]
+    words = re.findall(r"\S+\s*", text)
+    chunks: List[str] = []
+    cur: List[str] = []
+    cur_tokens = 0
+    for w in words:
+        n = count_tokens(w, model)
+        if cur and cur_tokens + n > max_tokens:
+            chunks.append("".join(cur).strip())
+            cur, cur_tokens = [], 0
+        cur.append(w)
+        cur_tokens += n
+    if cur:
+        chunks.append("".join(cur).strip())
+    return chunks
+
+
+def _field(obj: Any, name: str) -> Any:
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+class TokenBudgetExceeded(Exception):
+    """Koşunun token bütçesi doldu; kalan dosyalar sonraki koşuya kalır."""
+
+
+class UsageMeter:
+    """
+    Bir koşunun token ve gecikme istatistikleri + isteğe bağlı token bütçesi.
+    reserve() istekten önce tahmini maliyeti ayırır, record() gerçek kullanımla düzeltir.
+    """
+
+    def __init__(self, budget: int = 0):
+        self.budget = max(0, int(budget))
+        self.reserved = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.requests = 0
+        self.chunked = 0
+        self.packed = 0
+        self.pack_retries = 0
+        self.latencies: List[float] = []
+        self._lock = threading.Lock()
+
+    def reserve(self, estimate: int) -> None:
+        with self._lock:
+            if self.budget and self.reserved + estimate > self.budget:
+                raise TokenBudgetExceeded(f"token budget exhausted ({self.reserved}/{self.budget})")
+            self.reserved += estimate
+
+    def note_chunked(self) -> None:
+        with self._lock:
+            self.chunked += 1
+
+    def note_packed(self, items: int, retried: int) -> None:
+        with self._lock:
+            self.packed += items
+            self.pack_retries += retried
+
+    def release(self, estimate: int) -> None:
+        # istek hiç gönderilemediyse ayrılan pay geri verilir
+        with self._lock:
+            self.reserved = max(0, self.reserved - estimate)
+
+    def record(self, estimate: int, usage: Any, seconds: Optional[float] = None) -> None:
+        # usage: SDK nesnesi ya da (batch çıktısındaki) dict
+        prompt = int(_field(usage, "prompt_tokens") or 0)
+        completion = int(_field(usage, "completion_tokens") or 0)
+        cached = int(_field(_field(usage, "prompt_tokens_details"), "cached_tokens") or 0)
+        with self._lock:
+            if usage is not None:
+                self.reserved += prompt + completion - estimate
+            self.prompt_tokens += prompt
+            self.completion_tokens += completion
+            self.cached_tokens += cached
+            self.requests += 1
+            if seconds is not None:
+                self.latencies.append(seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lat = sorted(self.latencies)
+            p95 = lat[min(len(lat) - 1, int(round(0.95 * (len(lat) - 1))))] if lat else 0.0
+            return {
+                "requests": self.requests,
+                "chunked_files": self.chunked,
+                "packed_files": self.packed,
+                "pack_retries": self.pack_retries,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "cached_prompt_tokens": self.cached_tokens,
+                "budget": self.budget or None,
+                "latency_avg_ms": round(1000 * sum(lat) / len(lat)) if lat else 0,
+                "latency_p95_ms": round(1000 * p95),
+            }
@@ -1,8 +1,9 @@
 from __future__ import annotations
+import io
 import re
 import os
 from pathlib import Path
-from typing import Tuple, Optional
+from typing import BinaryIO, Tuple, Optional
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Ad Soyad / Sınıf ayıklama
@@ -116,12 +117,19 @@ def normalize_download_filename(name: str, mime_type: str) -> str:
 # Metin çıkarma (TXT/DOCX/PDF/IMG)
 # ─────────────────────────────────────────────────────────────────────────────
 
-def read_file_to_text(path: str, ocr_lang: str = "tur+eng+rus+kaz", mime_type: Optional[str] = None) -> str:
+# Çıkarma mantığı değiştiğinde artır → metin deposundaki eski kayıtlar kullanılmaz
+EXTRACTOR_VERSION = "2"
+
+def read_file_to_text(
+    path: str, ocr_lang: str = "tur+eng+rus+kaz", mime_type: Optional[str] = None,
+    info: Optional[dict] = None,
+) -> str:
     """
     TXT: utf-8 olarak oku
     DOCX: docx2txt varsa onu kullan; yoksa python-docx basit paragraf birleştir
-    PDF: pdfminer.six varsa onu kullan; yoksa boş döner
+    PDF: pdfminer.six varsa onu kullan; metin katmanı yoksa extractor ile OCR
     IMG: PIL+pytesseract ile OCR
+    info verilirse taralı PDF'te OCR ölçümleriyle doldurulur (bkz. extractor._from_scanned_pdf_ocr).
     """
     p = Path(path)
     ext = p.suffix.lower()
@@ -151,7 +159,15 @@ def read_file_to_text(path: str, ocr_lang: str = "tur+eng+rus+kaz", mime_type: O
     if ext == ".pdf" or mime == "application/pdf":
         try:
             from pdfminer.high_level import extract_text  # type: ignore
-            return extract_text(str(p)) or ""
+            text = extract_text(str(p)) or ""
+        except Exception:
+            text = ""
+        if text.strip():
+            return text
+        # Metin katmanı yok → taralı PDF: sayfa sayfa paralel OCR
+        try:
+            from .extractor import _from_scanned_pdf_ocr
+            return _from_scanned_pdf_ocr(p, lang=ocr_lang, info=info)
         except Exception:
             return ""
 
@@ -173,3 +189,33 @@ def read_file_to_text(path: str, ocr_lang: str = "tur+eng+rus+kaz", mime_type: O
         return p.read_text(encoding="utf-8", errors="ignore")
     except Exception:
         return ""
+
+
+# Bellek içi tampondan okunabilen türler (OCR gerektirmeyenler)
+BUFFERABLE_EXTS = {".txt", ".docx"}
+
+def read_buffer_to_text(buf: BinaryIO, name: str, mime_type: Optional[str] = None) -> Optional[str]:
+    """
+    Diske yazılmadan indirilen küçük TXT/DOCX dosyalarını okur.
+    Tür desteklenmiyorsa None döner (çağıran diske indirip read_file_to_text kullanır).
+    """
+    ext = Path(name).suffix.lower()
+    mime = (mime_type or "").lower()
+
+    if ext == ".txt" or mime.startswith("text/"):
+        return buf.read().decode("utf-8", errors="ignore")
+
+    if ext == ".docx" or "officedocument.wordprocessingml.document" in mime:
+        data = buf.read()
+        try:
+            import docx2txt  # type: ignore
+            return docx2txt.process(io.BytesIO(data)) or ""
+        except Exception:
+            try:
+                import docx  # type: ignore
+                doc = docx.Document(io.BytesIO(data))
+                return "\n".join([para.text for para in doc.paragraphs])
+            except Exception:
+                return ""
+
+    return None
@@ -0,0 +1,136 @@
+# src/winnowing.py
+from __future__ import annotations
+import zlib
+from typing import Any, Dict, List, Sequence, Tuple
+
+from .similarity_checker import text_of
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Pasaj düzeyinde eşleşme (winnowing, MOSS tarzı)
+# Metin harf/rakam dizisine indirgenir (orijinal karakter konumları saklanır),
+# K karakterlik parçalar hash'lenir ve her W'lik pencerenin en küçük hash'i parmak
+# izi olarak seçilir. En az W+K-1 karakterlik her ortak parça en az bir ortak parmak
+# izi üretir. Parmak izi → (belge, konum) ters indeksi koşu başına bir kez, doğrusal
+# sürede kurulur; işaretli çiftler için ortak izler ardışık pasajlara birleştirilir.
+# ─────────────────────────────────────────────────────────────────────────────
+
+K = 25                 # k-gram uzunluğu (normalize karakter)
+W = 20                 # pencere → ≥ 44 karakterlik eşleşmeler garanti yakalanır
+MAX_GAP = 2 * K        # aynı pasaja sayılacak en büyük iz aralığı
+MIN_PASSAGE_CHARS = 40
+MAX_PASSAGES_PER_PAIR = 20
+SNIPPET_CHARS = 300
+
+Fingerprint = Tuple[int, int]  # (hash, normalize konum)
+
+
+def _normalize(text: str) -> Tuple[str, List[int]]:
+    # yalnızca harf/rakam, küçük harf; her karakterin orijinal konumu
+    chars: List[str] = []
+    pos: List[int] = []
+    for i, ch in enumerate(text or ""):
+        if ch.isalnum():
+            chars.append(ch.lower())
+            pos.append(i)
+    return "".join(chars), pos
+
+
+def fingerprints(norm: str, k: int = K, w: int = W) -> List[Fingerprint]:
+    n = len(norm) - k + 1
+    if n <= 0:
+        return []
+    hashes = [zlib.crc32(norm[i:i + k].encode("utf-8")) for i in range(n)]
+    out: List[Fingerprint] = []
+    last = -1
+    for start in range(max(1, n - w + 1)):
+        window = hashes[start:start + w]
+        # en sağdaki minimum (Schleimer vd.): aynı iz tekrar tekrar seçilmez
+        m = min(window)
+        idx = start + len(window) - 1 - window[::-1].index(m)
+        if idx != last:
+            out.append((m, idx))
+            last = idx
+    return out
+
+
+class PassageIndex:
+    """Parmak izi → [(belge, konum)] ters indeksi (koşu başına bir kez kurulur)."""
+
+    def __init__(self, texts: Sequence[str]):
+        self.texts = list(texts)
+        self._pos: List[List[int]] = []
+        self._fps: List[List[Fingerprint]] = []
+        self.index: Dict[int, List[Tuple[int, int]]] = {}
+        for doc, text in enumerate(self.texts):
+            norm, pos = _normalize(text)
+            fps = fingerprints(norm)
+            self._pos.append(pos)
+            self._fps.append(fps)
+            for h, p in fps:
+                self.index.setdefault(h, []).append((doc, p))
+
+    def _span(self, doc: int, first: int, last: int) -> Tuple[int, int]:
+        # normalize konum aralığı → orijinal metinde [start, end)
+        pos = self._pos[doc]
+        return pos[first], pos[min(last + K - 1, len(pos) - 1)] + 1
+
+    def passages(self, a: int, b: int) -> List[Dict[str, Any]]:
+        hits: List[Tuple[int, int]] = []
+        for h, pa in self._fps[a]:
+            for doc, pb in self.index.get(h, ()):
+                if doc == b:
+                    hits.append((pa, pb))
+        if not hits:
+            return []
+        hits.sort()
+
+        # a'da ardışık ve b'de aynı kaymayla ilerleyen izler tek pasajdır
+        runs: List[List[Tuple[int, int]]] = []
+        for pa, pb in hits:
+            for run in runs:
+                la, lb = run[-1]
+                if 0 <= pa - la <= MAX_GAP and 0 <= pb - lb <= MAX_GAP:
+                    run.append((pa, pb))
+                    break
+            else:
+                runs.append([(pa, pb)])
+
+        out: List[Dict[str, Any]] = []
+        for run in runs:
+            a_start, a_end = self._span(a, run[0][0], run[-1][0])
+            b_start, b_end = self._span(b, min(p for _, p in run), max(p for _, p in run))
+            if a_end - a_start < MIN_PASSAGE_CHARS:
+                continue
+            out.append({
+                "a_start": a_start, "a_end": a_end,
+                "b_start": b_start, "b_end": b_end,
+                "a_text": self.texts[a][a_start:a_end][:SNIPPET_CHARS],
+                "b_text": self.texts[b][b_start:b_end][:SNIPPET_CHARS],
+            })
+        out.sort(key=lambda p: p["a_end"] - p["a_start"], reverse=True)
+        return out[:MAX_PASSAGES_PER_PAIR]
+
+
+def attach_passages(assignments: List[Dict[str, Any]], pairs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Her çifte "passages" alanı ekler: [{a_start, a_end, b_start, b_end, a_text, b_text}]
+    Konumlar assignments[*]["text"] içindeki karakter konumlarıdır.
+    """
+    def key(file_id: Any, file_name: Any) -> Any:
+        return file_id or file_name
+
+    slot = {key(a.get("file_id"), a.get("file_name")): i for i, a in enumerate(assignments)}
+    ends = [
+        (slot.get(key(p.get("file_id_a"), p.get("file_a"))), slot.get(key(p.get("file_id_b"), p.get("file_b"))))
+        for p in pairs
+    ]
+    # yalnızca işaretli çiftlerdeki belgeler indekslenir
+    involved = sorted({i for pair in ends for i in pair if i is not None})
+    local = {doc: n for n, doc in enumerate(involved)}
+    index = PassageIndex([text_of(assignments[i]) for i in involved])
+
+    out = []
+    for p, (a, b) in zip(pairs, ends):
+        found = index.passages(local[a], local[b]) if a is not None and b is not None else []
+        out.append({**p, "passages": found})
+    return out
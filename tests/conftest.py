@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# testler depo kökünden "src" paketini içe aktarır
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,106 @@
+# Batch modu: OpenAI files/batches uç noktalarının yerel taklidiyle
+import json
+import types
+
+import pytest
+
+from src import batch_eval, evaluator
+from src.batch_eval import BatchEvaluator, BatchPending
+from src.config import settings
+
+GRADE = {
+    "total": 40,
+    "breakdown": {"content": 20, "structure": 10, "language": 5, "originality": 5},
+    "strengths": ["s"], "weaknesses": ["w"], "suggestions": ["x"], "feedback": "ok",
+}
+
+
+class FakeBatchAPI:
+    """
+    client.files / client.batches yerine geçer. Batch oluşturulunca her satır hemen
+    cevaplanır; reject_formats'taki response_format tipleri satır başına 400 alır.
+    """
+
+    def __init__(self, reject_formats=(), complete=True):
+        self.reject_formats = set(reject_formats)
+        self.complete = complete
+        self.store = {}
+        self.batches = {}
+        self.submitted = []  # her batch'in satırları
+        self.files = types.SimpleNamespace(create=self._file_create, content=self._file_content)
+        self.batches_api = types.SimpleNamespace(create=self._batch_create, retrieve=self._batch_retrieve)
+
+    def client(self):
+        return types.SimpleNamespace(files=self.files, batches=self.batches_api)
+
+    def _file_create(self, file, purpose):
+        fid = f"file-{len(self.store)}"
+        self.store[fid] = file.read().decode("utf-8")
+        return types.SimpleNamespace(id=fid)
+
+    def _file_content(self, fid):
+        return types.SimpleNamespace(text=self.store[fid])
+
+    def _batch_create(self, input_file_id, endpoint, completion_window):
+        lines = [json.loads(l) for l in self.store[input_file_id].splitlines() if l.strip()]
+        self.submitted.append(lines)
+        out, err = [], []
+        for rec in lines:
+            fmt = (rec["body"].get("response_format") or {}).get("type")
+            if fmt in self.reject_formats:
+                err.append({"custom_id": rec["custom_id"], "response": {"status_code": 400, "body": {"error": {
+                    "message": f"Invalid parameter: 'response_format' of type '{fmt}' is not supported with this model.",
+                    "type": "invalid_request_error"}}}})
+                continue
+            out.append({"custom_id": rec["custom_id"], "response": {"status_code": 200, "body": {
+                "choices": [{"message": {"content": json.dumps(GRADE)}}],
+                "usage": {"prompt_tokens": 100, "completion_tokens": 10}}}})
+        bid = f"batch-{len(self.batches)}"
+        self.store[f"{bid}-out"] = "\n".join(json.dumps(r) for r in out)
+        self.store[f"{bid}-err"] = "\n".join(json.dumps(r) for r in err)
+        self.batches[bid] = "completed" if self.complete else "in_progress"
+        return types.SimpleNamespace(id=bid)
+
+    def _batch_retrieve(self, bid):
+        return types.SimpleNamespace(status=self.batches[bid], output_file_id=f"{bid}-out",
+                                     error_file_id=f"{bid}-err")
+
+
+@pytest.fixture(autouse=True)
+def _isolate(monkeypatch):
+    monkeypatch.setattr(settings, "openai_strict_schema", True)
+    monkeypatch.setattr(settings, "eval_chunk_tokens", 4000)
+    monkeypatch.setattr(evaluator, "_format_level", {})
+    monkeypatch.setattr(batch_eval.time, "sleep", lambda _s: None)
+
+
+def _evaluator(api, tmp_path, **kw):
+    kw.setdefault("max_attempts", 1)
+    return BatchEvaluator(api.client(), str(tmp_path / "batch_state.json"), "test-model",
+                          poll_interval=1, max_wait=60, **kw)
+
+
+def test_results_map_back_to_items(tmp_path):
+    api = FakeBatchAPI()
+    out = _evaluator(api, tmp_path).evaluate_all([("a", "first text", "a.txt"), ("b", "second text", "b.txt")])
+    assert out["a"]["total"] == 40 and out["b"]["breakdown"]["content"] == 20
+
+
+def test_rejected_json_schema_is_resubmitted_as_json_object(tmp_path):
+    api = FakeBatchAPI(reject_formats={"json_schema"})
+    out = _evaluator(api, tmp_path).evaluate_all([("a", "first text", "a.txt")])
+    assert out["a"]["total"] == 40
+    formats = [[(r["body"].get("response_format") or {}).get("type") for r in lines] for lines in api.submitted]
+    assert formats == [["json_schema"], ["json_object"]]
+
+
+def test_state_survives_restart(tmp_path):
+    api = FakeBatchAPI(complete=False)
+    first = BatchEvaluator(api.client(), str(tmp_path / "batch_state.json"), "test-model", max_wait=0)
+    out = first.evaluate_all([("a", "first text", "a.txt")])
+    assert isinstance(out["a"], BatchPending)
+
+    api.batches = {bid: "completed" for bid in api.batches}
+    out = _evaluator(api, tmp_path).evaluate_all([("a", "first text", "a.txt")])
+    assert out["a"]["total"] == 40
+    assert len(api.submitted) == 1  # aynı batch'ten alındı, yeniden gönderilmedi